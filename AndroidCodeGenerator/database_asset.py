@@ -0,0 +1,201 @@
+"""Builds the database file offline with python's sqlite3, filled with
+reference data, to ship as an asset. The generated DatabaseHandler
+copies it into place before the database is first opened, so onCreate
+and the inserts never run on the device.
+
+The schema is made from the same definitions as the generated code.
+Rows are loaded before the indexes and the triggers of your own are
+created, so they do not fire for reference data. Full text search is
+kept up to date while loading. Cached counts and sums are computed
+again afterwards, since parents may be loaded after their children or
+come with values of their own, and materialized views are built.
+ANALYZE then runs over the real data, and the file is VACUUMed.
+
+>>> import os, tempfile, shutil
+>>> from db_table import Table, Column, Index
+>>> tmpdir = tempfile.mkdtemp()
+>>> csv_path = os.path.join(tmpdir, "words.csv")
+>>> with open(csv_path, "w") as f:
+...     _ = f.write("word,length\\nhello,5\\nhi,\\n")
+>>> word = Table('Word').add_cols(Column('word').text.not_null,\
+Column('length').integer).add_indexes(Index('ix_word').on('word'))
+
+>>> asset = DatabaseAsset(os.path.join(tmpdir, "SampleDB"), version=3)
+>>> asset.add_tables(word)
+>>> asset.add_data('Word', csv_path)
+>>> asset.build()
+{'Word': 2}
+
+>>> import sqlite3
+>>> con = sqlite3.connect(asset.path)
+>>> con.execute("SELECT word, length FROM Word").fetchall() == \
+[("hello", 5), ("hi", None)]
+True
+>>> con.execute("PRAGMA user_version").fetchone()[0]
+3
+>>> con.close()
+
+>>> song = Table('Song').add_cols(Column('album').integer)
+>>> album = Table('Album').count_of('songs', song, 'album')
+>>> asset = DatabaseAsset(os.path.join(tmpdir, "Music"))
+>>> asset.add_tables(song, album)
+>>> asset.add_data('Song', [{'album': 1}, {'album': 1}])
+>>> asset.add_data('Album', [{'_id': 1, 'songs': 5}])
+>>> sorted(asset.build().items())
+[('Album', 1), ('Song', 2)]
+>>> con = sqlite3.connect(asset.path)
+>>> con.execute("SELECT songs FROM Album").fetchall()
+[(2,)]
+>>> con.close()
+>>> shutil.rmtree(tmpdir)
+"""
+
+import csv
+import json
+import os
+import sqlite3 as sql
+from db_table import creation_order
+
+class DatabaseAsset(object):
+    """A prepopulated database at path. version must be the
+    DATABASE_VERSION of the handler, or the database would be
+    upgraded on first open. Rows are inserted chunk rows per
+    transaction."""
+
+    def __init__(self, path, version=1, chunk=50000):
+        self.path = path
+        self.version = version
+        self.chunk = chunk
+        self.tables = []
+        self.triggers = []
+        self.views = []
+        # Sources of rows by table name
+        self.data = {}
+
+    def add_tables(self, *sqltables):
+        self.tables.extend(sqltables)
+
+    def add_triggers(self, *triggers):
+        self.triggers.extend(triggers)
+
+    def add_views(self, *views):
+        self.views.extend(views)
+
+    def add_data(self, table_name, source):
+        """Rows for a table, from a .csv file with a header row, a .json
+        file holding a list of objects, or a list of dicts"""
+        self.data.setdefault(table_name, []).append(source)
+
+    def rows(self, table, source):
+        """The rows of source as lists of values, and their columns"""
+        if isinstance(source, (list, tuple)):
+            records = source
+        elif source.endswith(".json"):
+            with open(source) as f:
+                records = json.load(f)
+        else:
+            with open(source) as f:
+                records = [_decoded(row) for row in csv.DictReader(f)]
+            # Csv only has strings, empty is NULL for all but text
+            types = dict((col.name, col.type) for col in table._columns)
+            for row in records:
+                for name, value in row.items():
+                    row[name] = _typed(types.get(name), value)
+        if not records:
+            return [], []
+        names = [col.name for col in table._columns if col.name in records[0]]
+        return [[row.get(name) for name in names] for row in records], names
+
+    def build(self, fingerprint=None):
+        """Create the database file, replacing an existing one, and
+        return the number of rows loaded by table name. fingerprint is
+        the schema fingerprint of the handler, if it uses one."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        con = sql.connect(self.path, isolation_level=None)
+        cur = con.cursor()
+        cur.execute("PRAGMA foreign_keys = ON")
+        loaded = {}
+        cur.execute("BEGIN")
+        cur.execute("PRAGMA defer_foreign_keys = ON")
+        tables = creation_order(self.tables)
+        for table in tables:
+            cur.execute(str(table))
+        for table in tables:
+            if table.fts is not None:
+                for stmt in table.fts.stmts:
+                    cur.execute(stmt)
+            for trigger in table.cache_triggers:
+                cur.execute(str(trigger))
+
+        for table in tables:
+            loaded[table.name] = 0
+            for source in self.data.get(table.name, []):
+                rows, names = self.rows(table, source)
+                insert = "INSERT INTO {} ({}) VALUES ({})"\
+                         .format(table.name, ", ".join(names),
+                                 ", ".join("?" * len(names)))
+                for start in range(0, len(rows), self.chunk):
+                    cur.executemany(insert, rows[start:start + self.chunk])
+                    # Large transactions, but not all rows in memory twice
+                    cur.execute("COMMIT")
+                    cur.execute("BEGIN")
+                    cur.execute("PRAGMA defer_foreign_keys = ON")
+                loaded[table.name] += len(rows)
+
+        for table in tables:
+            for index in table.indexes:
+                cur.execute(str(index))
+        # After the indexes, which the lookups of the children use
+        for table in tables:
+            for stmt in table.cache_rebuild_stmts:
+                cur.execute(stmt)
+        for trigger in self.triggers:
+            if not trigger.is_temp:
+                cur.execute(str(trigger))
+        for view in self.views:
+            if view.is_temp:
+                continue
+            for stmt in view.stmts:
+                cur.execute(stmt)
+            for trigger in view.triggers:
+                cur.execute(str(trigger))
+            if view.is_materialized:
+                for stmt in view.rebuild_stmts:
+                    cur.execute(stmt)
+
+        if fingerprint is not None:
+            cur.execute("CREATE TABLE schema_fingerprint (_id INTEGER PRIMARY\
+ KEY, fingerprint INTEGER NOT NULL)")
+            cur.execute("INSERT INTO schema_fingerprint (_id, fingerprint)\
+ VALUES (1, ?)", (fingerprint,))
+        cur.execute("PRAGMA user_version = {:d}".format(self.version))
+        cur.execute("COMMIT")
+
+        cur.execute("ANALYZE")
+        cur.execute("VACUUM")
+        con.close()
+        return loaded
+
+def _decoded(row):
+    """Csv rows are bytes in python 2"""
+    if str is bytes:
+        return dict((k.decode("utf-8"),
+                     v if v is None else v.decode("utf-8"))
+                    for k, v in row.items())
+    return row
+
+def _typed(sqltype, value):
+    if sqltype == "TEXT" or sqltype is None:
+        return value
+    if value == "":
+        return None
+    if sqltype == "INTEGER":
+        return int(value)
+    if sqltype == "REAL":
+        return float(value)
+    return value
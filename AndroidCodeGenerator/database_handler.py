@@ -16,57 +16,443 @@
 >>> handler.add_dbitems(DBItem(t, pkg))
 """
 
+import zlib
+import dbitem
 from dbitem import DBItem
+from db_table import creation_order
+from profiler import Profile
+
+def schema_fingerprint(statements):
+    """A positive 31 bit checksum of the sql statements of a schema,
+    which changes when any of them does
+
+    >>> schema_fingerprint(["CREATE TABLE A (_id INTEGER PRIMARY KEY)"])
+    1849970735
+    >>> schema_fingerprint(["CREATE TABLE A (_id INTEGER)"])
+    1418305121
+    """
+    data = "\n".join(str(stmt) for stmt in statements)
+    return zlib.crc32(data.encode("utf-8")) & 0x7fffffff
 
 class DatabaseHandler(object):
-    """Generates a DatabaseHandler.java file"""
+    """Generates a DatabaseHandler.java file
+
+    With a fingerprint, permanent triggers and views are recreated in
+    onOpen only when the fingerprint stored in the database differs,
+    and the temporary ones are created in a single transaction. See
+    schema_fingerprint."""
+
+    def __init__(self, databasename, pkg, fingerprint=None, stats=None,
+                 cache=None, asset=None, profile=None):
+        """stats are sqlite_stat1 rows as (table, index, stat), like
+        SQLTester.analyze returns. onCreate writes them so the planner
+        has statistics before ANALYZE ever runs on the device.
 
-    def __init__(self, databasename, pkg):
+        With a RenderCache, the getters of tables which did not change
+        since the last write are not rendered again.
+
+        asset is the name of a prebuilt database in the assets of the
+        app, see DatabaseAsset. It is copied into place before the
+        database is first opened.
+
+        profile is a Profile which gets the time spent on the getters
+        of every table."""
         self.databasename = databasename
         self.pkg = pkg
+        self.fingerprint = fingerprint
+        self.stats = stats or []
+        self.cache = cache
+        self.asset = asset
+        self.profile = profile if profile is not None \
+                       else Profile(enabled=False)
         self.dbitems = []
 
     def add_dbitems(self, *items):
         self.dbitems.extend(items)
 
     def create_tables(self):
-        result = ""
-        for table in self.dbitems:
-            result += CREATE_DROP_TEMPLATE.format(classname=table.classname)
+        """Drops and creates the tables, referenced tables first"""
+        # Views are created by DatabaseViews
+        items = [item for item in self.dbitems if not item.read_only]
+        order = creation_order([item.sql_table for item in items])
+        items.sort(key=lambda item: order.index(item.sql_table))
+        return "".join([self.create_table(item) for item in items])
+
+    def create_table(self, table):
+        result = CREATE_DROP_TEMPLATE.format(classname=table.classname)
+        if table.indexes:
+            result += CREATE_INDEXES_TEMPLATE.format(
+                classname=table.classname)
+        if table.fts is not None:
+            result += CREATE_FTS_TEMPLATE.format(classname=table.classname)
         return result
 
     def table_getters(self):
-        result = ""
+        result = []
         for table in self.dbitems:
-            result += GETITEM_TEMPLATE.format(classname=table.classname)
-            result += GETALL_TEMPLATE.format(classname=table.classname)
+            with self.profile.phase("render_handler.getters",
+                                    table.sql_table.name):
+                if self.cache is None:
+                    result.append(self.getters(table))
+                else:
+                    key = ("getters", table.read_only,
+                           self.cache.definition(table.sql_table))
+                    result.append(self.cache.render(
+                        key, lambda: self.getters(table)))
+        return "".join(result)
+
+    def getters(self, table):
+        """The getters of one item"""
+        selection = self.selection(table)
+        result = [GETITEM_TEMPLATE.format(classname=table.classname),
+                  GETALL_TEMPLATE.format(classname=table.classname,
+                                         selection=selection),
+                  COUNT_TEMPLATE.format(classname=table.classname,
+                                        selection=selection),
+                  self.aggregates(table)]
+        if table.read_only:
+            return "".join(result)
+        if table.sql_table.is_columnar:
+            result.append(GETCOLUMNS_TEMPLATE.format(classname=table.classname,
+                                                     selection=selection))
+        if table.fts is not None:
+            result.append(SEARCH_TEMPLATE.format(classname=table.classname))
+        if table.sql_table.soft_deletes:
+            result.append(PURGE_TEMPLATE.format(classname=table.classname))
+        result.append(self.scalar_getters(table))
+        return "".join(result)
+
+    def selection(self, item):
+        """The selection reads of item use, which leaves out rows marked
+        deleted if the table has soft deletes
+
+        >>> from db_table import Table
+        >>> handler = DatabaseHandler("db", "com.ex")
+        >>> handler.selection(DBItem(Table('Note').soft_delete, "com.ex"))
+        'NoteItem.notDeleted(selection)'
+        >>> handler.selection(DBItem(Table('Note'), "com.ex"))
+        'selection'
+        """
+        if getattr(item.sql_table, "soft_deletes", False):
+            return "{}.notDeleted(selection)".format(item.classname)
+        return "selection"
+
+    def aggregates(self, item):
+        """Typed min, max and sum of the numeric columns
+
+        >>> from db_table import Table, Column
+        >>> t = Table('Song').add_cols(Column('length').integer)
+        >>> print(DatabaseHandler("db", "com.ex").aggregates(DBItem(t, "com.ex")))
+        <BLANKLINE>
+            public synchronized Long minSongItemLength(final String selection,
+                    final String[] args) {
+                return aggregateLong(SongItem.TABLE_NAME,
+                        "MIN(" + SongItem.COL_LENGTH + ")", selection, args);
+            }
+        <BLANKLINE>
+            public synchronized Long maxSongItemLength(final String selection,
+                    final String[] args) {
+                return aggregateLong(SongItem.TABLE_NAME,
+                        "MAX(" + SongItem.COL_LENGTH + ")", selection, args);
+            }
+        <BLANKLINE>
+            public synchronized long sumSongItemLength(final String selection,
+                    final String[] args) {
+                return aggregateLong(SongItem.TABLE_NAME,
+                        "IFNULL(SUM(" + SongItem.COL_LENGTH + "), 0)", selection, args);
+            }
+        <BLANKLINE>
+        """
+        result = ""
+        selection = self.selection(item)
+        for java_col in item.aggregate_columns:
+            boxed, primitive = dbitem.AGGREGATE_TYPES[java_col.value_kind]
+            # Integer sums stay exact, TOTAL is a float
+            if primitive == "long":
+                total = ("IFNULL(SUM(", "), 0)")
+            else:
+                total = ("TOTAL(", ")")
+            for name, function, java_type in (("min", ("MIN(", ")"), boxed),
+                                              ("max", ("MAX(", ")"), boxed),
+                                              ("sum", total, primitive)):
+                result += AGGREGATE_TEMPLATE.format(classname=item.classname,
+                                                    name=name,
+                                                    function=function[0],
+                                                    close=function[1],
+                                                    java_type=java_type,
+                                                    kind=boxed,
+                                                    field=java_col.method_name,
+                                                    const=java_col.const_name,
+                                                    selection=selection)
+        return result
+
+    def scalar_getters(self, item):
+        """Single column getters which use compiled statements, and
+        loaders of lazy columns"""
+        result = ""
+        for java_col in item.scalar_columns:
+            if java_col.java_type == "String":
+                template = GETFIELD_STRING_TEMPLATE
+            else:
+                template = GETFIELD_LONG_TEMPLATE
+            result += template.format(classname=item.classname,
+                                      field=java_col.method_name,
+                                      query=java_col.query_const_name)
+        for java_col in item.lazy_columns:
+            result += GETLAZY_TEMPLATE.format(
+                classname=item.classname,
+                java_type=java_col.java_type,
+                field=java_col.method_name,
+                query=java_col.query_const_name,
+                cursor_get=java_col.cursor_get.format(0))
         return result
 
     @property
     def classname(self):
         return "DatabaseHandler"
 
+    def load_stats(self):
+        """Statements of onCreate which fill sqlite_stat1, and the
+        rows they insert
+
+        >>> handler = DatabaseHandler("db", "com.ex",\
+stats=[("Note", None, "100"), ("Note", "ix_note_title", "100 2")])
+        >>> print(handler.load_stats()[0])
+        <BLANKLINE>
+        <BLANKLINE>
+                // Planner statistics from ANALYZE of sample data
+                db.execSQL("ANALYZE sqlite_master");
+                db.execSQL("DELETE FROM sqlite_stat1");
+                for (final String[] row : STAT1) {
+                    db.execSQL("INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (?, ?, ?)",
+                            row);
+                }
+                // Reloads the statistics
+                db.execSQL("ANALYZE sqlite_master");
+        >>> print(handler.load_stats()[1])
+        <BLANKLINE>
+            private static final String[][] STAT1 = {
+                { "Note", null, "100" },
+                { "Note", "ix_note_title", "100 2" }
+            };
+        <BLANKLINE>
+        """
+        if not self.stats:
+            return "", ""
+        rows = []
+        for row in self.stats:
+            rows.append("{{ {} }}".format(", ".join(
+                "null" if value is None else '"{}"'.format(value)
+                for value in row)))
+        return (STATS_TEMPLATE,
+                STAT1_TEMPLATE.format(rows=",\n        ".join(rows)))
+
+    def open_schema(self):
+        """What onOpen does to triggers and views, and what onCreate
+        does to record it"""
+        if self.fingerprint is None:
+            return OPEN_TEMP_TEMPLATE, ""
+        return (OPEN_FINGERPRINT_TEMPLATE,
+                FINGERPRINT_TEMPLATE.format(fingerprint=self.fingerprint))
+
     def __repr__(self):
+        open_schema, fingerprint = self.open_schema()
+        load_stats, stat_rows = self.load_stats()
         return HANDLER_TEMPLATE.format(classname=self.classname,
                                        pkg=self.pkg,
                                        databasename=self.databasename,
                                        create_tables=self.create_tables(),
+                                       load_stats=load_stats,
+                                       stat_rows=stat_rows,
+                                       asset_imports=ASSET_IMPORTS \
+                                       if self.asset else "",
+                                       asset=ASSET_TEMPLATE.format(
+                                           asset=self.asset) \
+                                       if self.asset else "",
+                                       open_schema=open_schema,
+                                       fingerprint=fingerprint,
+                                       save_fingerprint=\
+                                       SAVE_FINGERPRINT_TEMPLATE \
+                                       if self.fingerprint is not None \
+                                       else "",
                                        table_getters=self.table_getters())
 
+# ANALYZE of sqlite_master alone creates sqlite_stat1, and loads what
+# it holds
+STATS_TEMPLATE = """
+
+        // Planner statistics from ANALYZE of sample data
+        db.execSQL("ANALYZE sqlite_master");
+        db.execSQL("DELETE FROM sqlite_stat1");
+        for (final String[] row : STAT1) {
+            db.execSQL("INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (?, ?, ?)",
+                    row);
+        }
+        // Reloads the statistics
+        db.execSQL("ANALYZE sqlite_master");"""
+
+STAT1_TEMPLATE = """
+    private static final String[][] STAT1 = {{
+        {rows}
+    }};
+"""
+
+ASSET_IMPORTS = """
+import java.io.File;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.OutputStream;
+"""
+
+ASSET_TEMPLATE = """
+    // Prebuilt database in the assets, see DatabaseAsset
+    private static final String ASSET_NAME = "{asset}";
+    private boolean assetChecked = false;
+
+    // The copy happens when the database is first opened, on the
+    // thread which opens it, and not in getInstance
+    @Override
+    public synchronized SQLiteDatabase getWritableDatabase() {{
+        checkAsset();
+        return super.getWritableDatabase();
+    }}
+
+    @Override
+    public synchronized SQLiteDatabase getReadableDatabase() {{
+        checkAsset();
+        return super.getReadableDatabase();
+    }}
+
+    private void checkAsset() {{
+        if (!assetChecked) {{
+            copyAsset(context);
+            assetChecked = true;
+        }}
+    }}
+
+    /**
+     * Copies the prebuilt database into place if there is no database
+     * yet, so onCreate is not run. If copying fails, onCreate creates
+     * an empty database instead.
+     */
+    private static synchronized void copyAsset(final Context context) {{
+        final File target = context.getDatabasePath(DATABASE_NAME);
+        if (target.exists()) {{
+            return;
+        }}
+        target.getParentFile().mkdirs();
+        // Renamed when complete, so a crash can not leave half a file
+        final File partial = new File(target.getPath() + ".partial");
+        try {{
+            final InputStream in = context.getAssets().open(ASSET_NAME);
+            try {{
+                final OutputStream out = new FileOutputStream(partial);
+                try {{
+                    final byte[] buffer = new byte[64 * 1024];
+                    int read;
+                    while ((read = in.read(buffer)) > 0) {{
+                        out.write(buffer, 0, read);
+                    }}
+                }}
+                finally {{
+                    out.close();
+                }}
+            }}
+            finally {{
+                in.close();
+            }}
+            if (!partial.renameTo(target)) {{
+                partial.delete();
+            }}
+        }}
+        catch (IOException e) {{
+            partial.delete();
+        }}
+    }}
+"""
+
+OPEN_TEMP_TEMPLATE = """
+            // Create temporary triggers and views
+            DatabaseTriggers.createTemp(db);
+            DatabaseViews.createTemp(db);"""
+
+# Permanent objects are only touched when the generated schema changed,
+# so an open costs one query plus the temporary objects
+OPEN_FINGERPRINT_TEMPLATE = """
+            db.beginTransaction();
+            try {
+                if (storedFingerprint(db) != SCHEMA_FINGERPRINT) {
+                    DatabaseTriggers.create(db);
+                    DatabaseViews.create(db);
+                    saveFingerprint(db);
+                }
+                // Temporary triggers and views, in one transaction
+                DatabaseTriggers.createTemp(db);
+                DatabaseViews.createTemp(db);
+                db.setTransactionSuccessful();
+            }
+            finally {
+                db.endTransaction();
+            }"""
+
+SAVE_FINGERPRINT_TEMPLATE = """
+        saveFingerprint(db);"""
+
+FINGERPRINT_TEMPLATE = """
+    // Checksum of the generated tables, triggers and views
+    private static final long SCHEMA_FINGERPRINT = {fingerprint}L;
+    private static final String SCHEMA_TABLE = "schema_fingerprint";
+
+    private static long storedFingerprint(final SQLiteDatabase db) {{
+        // Missing in databases created before fingerprints were used
+        db.execSQL("CREATE TABLE IF NOT EXISTS " + SCHEMA_TABLE
+                + " (_id INTEGER PRIMARY KEY, fingerprint INTEGER NOT NULL)");
+        return DatabaseUtils.longForQuery(db, "SELECT IFNULL(MAX(fingerprint), 0) FROM "
+                + SCHEMA_TABLE, null);
+    }}
+
+    private static void saveFingerprint(final SQLiteDatabase db) {{
+        db.execSQL("CREATE TABLE IF NOT EXISTS " + SCHEMA_TABLE
+                + " (_id INTEGER PRIMARY KEY, fingerprint INTEGER NOT NULL)");
+        db.execSQL("INSERT OR REPLACE INTO " + SCHEMA_TABLE
+                + " (_id, fingerprint) VALUES (1, " + SCHEMA_FINGERPRINT + ")");
+    }}
+"""
+
 CREATE_DROP_TEMPLATE = """
         db.execSQL("DROP TABLE IF EXISTS " + {classname}.TABLE_NAME);
         db.execSQL({classname}.CREATE_TABLE);
 """
 
+CREATE_INDEXES_TEMPLATE = """
+        for (final String sql : {classname}.CREATE_INDEXES) {{
+            db.execSQL(sql);
+        }}
+"""
+
+CREATE_FTS_TEMPLATE = """
+        db.execSQL("DROP TABLE IF EXISTS " + {classname}.FTS_TABLE);
+        for (final String sql : {classname}.CREATE_FTS) {{
+            db.execSQL(sql);
+        }}
+"""
+
 GETITEM_TEMPLATE = """
     public synchronized Cursor get{classname}Cursor(final long id) {{
         final SQLiteDatabase db = this.getReadableDatabase();
-        final Cursor cursor = db.query({classname}.TABLE_NAME,
-                {classname}.FIELDS, {classname}.COL_ID + " IS ?",
-                new String[] {{ String.valueOf(id) }}, null, null, null, null);
+        // Same sql every time so the connection can reuse the statement
+        final Cursor cursor = db.rawQuery({classname}.QUERY_BY_ID,
+                new String[] {{ String.valueOf(id) }});
         return cursor;
     }}
 
+    public synchronized boolean exists{classname}(final long id) {{
+        final SQLiteStatement stmt = compiled({classname}.QUERY_EXISTS);
+        stmt.bindLong(1, id);
+        return stmt.simpleQueryForLong() > 0;
+    }}
+
     public synchronized {classname} get{classname}(final long id) {{
         final Cursor cursor = get{classname}Cursor(id);
         final {classname} result;
@@ -89,7 +475,7 @@ GETALL_TEMPLATE = """
         final SQLiteDatabase db = this.getReadableDatabase();
 
         final Cursor cursor = db.query({classname}.TABLE_NAME,
-                {classname}.FIELDS, selection, args, null, null, sortOrder, null);
+                {classname}.FIELDS, {selection}, args, null, null, sortOrder, null);
 
         return cursor;
     }}
@@ -111,16 +497,181 @@ GETALL_TEMPLATE = """
     }}
 """
 
+SEARCH_TEMPLATE = """
+    /**
+     * Full text search with MATCH, for at most limit rows (-1 for no
+     * limit). If ranked, the snippet of the match is added as the last
+     * column and rows with more matching terms come first.
+     */
+    public synchronized Cursor search{classname}sCursor(final String query,
+            final int limit, final boolean ranked) {{
+        return this.getReadableDatabase().rawQuery(
+                ranked ? {classname}.SEARCH_RANKED : {classname}.SEARCH,
+                new String[] {{ query, String.valueOf(limit) }});
+    }}
+
+    public synchronized List<{classname}> search{classname}s(final String query,
+                                                            final int limit) {{
+        final List<{classname}> result = new ArrayList<{classname}>();
+
+        final Cursor cursor = search{classname}sCursor(query, limit, false);
+
+        while (cursor.moveToNext()) {{
+            result.add(new {classname}(cursor));
+        }}
+
+        cursor.close();
+        return result;
+    }}
+"""
+
+COUNT_TEMPLATE = """
+    public synchronized long count{classname}s(final String selection,
+                                                final String[] args) {{
+        return DatabaseUtils.queryNumEntries(this.getReadableDatabase(),
+                {classname}.TABLE_NAME, {selection}, args);
+    }}
+
+    /**
+     * One row with the number of matching rows in column _count.
+     */
+    public synchronized Cursor count{classname}sCursor(final String selection,
+                                                       final String[] args) {{
+        return this.getReadableDatabase().query({classname}.TABLE_NAME,
+                new String[] {{ "COUNT(*) AS " + BaseColumns._COUNT }},
+                {selection}, args, null, null, null, null);
+    }}
+
+    /**
+     * True if any row matches, which stops at the first one.
+     */
+    public synchronized boolean exists{classname}(final String selection,
+                                                 final String[] args) {{
+        final String where = {selection};
+        final String clause = where == null || where.isEmpty()
+                ? "" : " WHERE " + where;
+        return DatabaseUtils.longForQuery(this.getReadableDatabase(),
+                "SELECT EXISTS (SELECT 1 FROM " + {classname}.TABLE_NAME
+                + clause + ")", args) > 0;
+    }}
+"""
+
+AGGREGATE_TEMPLATE = """
+    public synchronized {java_type} {name}{classname}{field}(final String selection,
+            final String[] args) {{
+        return aggregate{kind}({classname}.TABLE_NAME,
+                "{function}" + {classname}.{const} + "{close}", {selection}, args);
+    }}
+"""
+
+PURGE_TEMPLATE = """
+    /**
+     * Removes rows marked deleted, batchSize rows per transaction so
+     * other threads get the database in between. Returns the number
+     * of removed rows. A batchSize of -1 removes all in one go.
+     */
+    public int purge{classname}s(final int batchSize) {{
+        int total = 0;
+        int removed;
+        do {{
+            removed = purge{classname}sBatch(batchSize);
+            total += removed;
+        }} while (removed > 0 && removed >= batchSize);
+        return total;
+    }}
+
+    private synchronized int purge{classname}sBatch(final int batchSize) {{
+        final SQLiteDatabase db = this.getWritableDatabase();
+        db.beginTransaction();
+        try {{
+            final SQLiteStatement stmt = compiled({classname}.PURGE);
+            stmt.bindLong(1, batchSize);
+            final int removed = stmt.executeUpdateDelete();
+            db.setTransactionSuccessful();
+            return removed;
+        }}
+        finally {{
+            db.endTransaction();
+        }}
+    }}
+"""
+
+GETCOLUMNS_TEMPLATE = """
+    public synchronized {classname}.Columns get{classname}Columns(
+            final String selection, final String[] args,
+            final String sortOrder) {{
+        final Cursor cursor = this.getReadableDatabase().query(
+                {classname}.TABLE_NAME, {classname}.Columns.FIELDS,
+                {selection}, args, null, null, sortOrder, null);
+        try {{
+            return new {classname}.Columns(cursor);
+        }}
+        finally {{
+            cursor.close();
+        }}
+    }}
+"""
+
+GETLAZY_TEMPLATE = """
+    public synchronized {java_type} get{classname}{field}(final long id) {{
+        final Cursor cursor = this.getReadableDatabase().rawQuery(
+                {classname}.{query}, new String[] {{ String.valueOf(id) }});
+        try {{
+            if (cursor.moveToFirst()) {{
+                return {cursor_get};
+            }}
+            return null;
+        }}
+        finally {{
+            cursor.close();
+        }}
+    }}
+"""
+
+GETFIELD_STRING_TEMPLATE = """
+    public synchronized String get{classname}{field}(final long id) {{
+        final SQLiteStatement stmt = compiled({classname}.{query});
+        stmt.bindLong(1, id);
+        try {{
+            return stmt.simpleQueryForString();
+        }}
+        catch (SQLiteDoneException e) {{
+            return null;
+        }}
+    }}
+"""
+
+GETFIELD_LONG_TEMPLATE = """
+    public synchronized long get{classname}{field}(final long id,
+            final long defaultValue) {{
+        final SQLiteStatement stmt = compiled({classname}.{query});
+        stmt.bindLong(1, id);
+        try {{
+            return stmt.simpleQueryForLong();
+        }}
+        catch (SQLiteDoneException e) {{
+            return defaultValue;
+        }}
+    }}
+"""
+
 HANDLER_TEMPLATE = """package {pkg};
 
 import java.util.ArrayList;
+import java.util.HashMap;
+import java.util.HashSet;
 import java.util.List;
-
+{asset_imports}
 import android.content.ContentValues;
 import android.content.Context;
 import android.database.Cursor;
+import android.database.DatabaseUtils;
 import android.database.sqlite.SQLiteDatabase;
+import android.database.sqlite.SQLiteDoneException;
 import android.database.sqlite.SQLiteOpenHelper;
+import android.database.sqlite.SQLiteStatement;
+import android.net.Uri;
+import android.provider.BaseColumns;
 
 /**
  * Database handler, SQLite wrapper and ORM layer.
@@ -149,32 +700,73 @@ public class {classname} extends SQLiteOpenHelper {{
                 DATABASE_VERSION);
         this.context = context.getApplicationContext();
     }}
+{asset}
+    // Compiled statements keyed on their sql. They belong to the
+    // connection they were compiled on, so are dropped when it changes.
+    private final HashMap<String, SQLiteStatement> statements =
+            new HashMap<String, SQLiteStatement>();
+
+    private synchronized SQLiteStatement compiled(final String sql) {{
+        SQLiteStatement stmt = statements.get(sql);
+        if (stmt == null) {{
+            stmt = this.getReadableDatabase().compileStatement(sql);
+            statements.put(sql, stmt);
+        }}
+        stmt.clearBindings();
+        return stmt;
+    }}
+
+    private synchronized void clearStatements() {{
+        for (SQLiteStatement stmt : statements.values()) {{
+            stmt.close();
+        }}
+        statements.clear();
+    }}
+
+    @Override
+    public synchronized void close() {{
+        clearStatements();
+        super.close();
+    }}
 
     @Override
     public void onOpen(SQLiteDatabase db) {{
         super.onOpen(db);
+        clearStatements();
+        supportsUpsert = sqliteAtLeast(db, 3, 24);
         if (!db.isReadOnly()) {{
             // Enable foreign key constraints
             // This line requires android16
             // db.setForeignKeyConstraintsEnabled(true);
             // This line works everywhere though
             db.execSQL("PRAGMA foreign_keys=ON;");
-
-            // Create temporary triggers and views
-            DatabaseTriggers.createTemp(db);
-            DatabaseViews.createTemp(db);
+{open_schema}
         }}
     }}
 
     @Override
     public synchronized void onCreate(SQLiteDatabase db) {{
+        // All of the schema or nothing
+        db.beginTransaction();
+        try {{
+            createSchema(db);
+            db.setTransactionSuccessful();
+        }}
+        finally {{
+            db.endTransaction();
+        }}
+    }}
+
+    private void createSchema(SQLiteDatabase db) {{
+        // Foreign keys are checked when the transaction commits
+        db.execSQL("PRAGMA defer_foreign_keys = ON");
         {create_tables}
 
         // Create Triggers and Views
         DatabaseTriggers.create(db);
-        DatabaseViews.create(db);
+        DatabaseViews.create(db);{save_fingerprint}{load_stats}
     }}
-
+{stat_rows}{fingerprint}
     // Upgrading database
     @Override
     public synchronized void onUpgrade(SQLiteDatabase db, int oldVersion,
@@ -183,22 +775,178 @@ public class {classname} extends SQLiteOpenHelper {{
         onCreate(db);
     }}
 
-    // Convenience methods
-    public synchronized boolean putItem(final DBItem item) {{
+    private Cursor aggregate(final String table, final String expression,
+            final String selection, final String[] args) {{
+        return this.getReadableDatabase().query(table,
+                new String[] {{ expression }}, selection, args, null, null,
+                null, null);
+    }}
+
+    // Aggregates are null if no rows matched, except sums
+    private Long aggregateLong(final String table, final String expression,
+            final String selection, final String[] args) {{
+        final Cursor cursor = aggregate(table, expression, selection, args);
+        try {{
+            return cursor.moveToFirst() && !cursor.isNull(0)
+                    ? cursor.getLong(0) : null;
+        }}
+        finally {{
+            cursor.close();
+        }}
+    }}
+
+    private Double aggregateDouble(final String table, final String expression,
+            final String selection, final String[] args) {{
+        final Cursor cursor = aggregate(table, expression, selection, args);
+        try {{
+            return cursor.moveToFirst() && !cursor.isNull(0)
+                    ? cursor.getDouble(0) : null;
+        }}
+        finally {{
+            cursor.close();
+        }}
+    }}
+
+    // Upserts (INSERT ... ON CONFLICT DO UPDATE) need sqlite 3.24
+    private boolean supportsUpsert = false;
+
+    private static boolean sqliteAtLeast(final SQLiteDatabase db,
+            final int major, final int minor) {{
+        final String[] version = DatabaseUtils.stringForQuery(db,
+                "SELECT sqlite_version()", null).split("\\\\.");
+        final int dbMajor = Integer.parseInt(version[0]);
+        final int dbMinor = Integer.parseInt(version[1]);
+        return dbMajor > major || (dbMajor == major && dbMinor >= minor);
+    }}
+
+    /**
+     * Writes the item with one statement. Upserts keyed on a unique
+     * constraint also look up the _id of new items.
+     */
+    private boolean upsertItem(final DBItem item) {{
+        final SQLiteStatement stmt = compiled(item.getUpsertSql());
+        item.bindUpsert(stmt);
+        final long id = stmt.executeInsert();
+
+        if (item.getId() < 0) {{
+            final String keySql = item.getUpsertKeySql();
+            if (keySql == null) {{
+                if (id < 1) {{
+                    return false;
+                }}
+                item.setId(id);
+            }}
+            else {{
+                final SQLiteStatement keyStmt = compiled(keySql);
+                item.bindUpsertKey(keyStmt);
+                item.setId(keyStmt.simpleQueryForLong());
+            }}
+        }}
+        return true;
+    }}
+
+    // Tables changed during a batch, notified once when it ends
+    private final HashSet<Uri> batchUris = new HashSet<Uri>();
+    private int batchDepth = 0;
+    private boolean batchSuccessful = false;
+    private boolean batchFailed = false;
+
+    /**
+     * Starts a batch of writes in a single transaction. Batches can
+     * be nested. Change notifications are collected and sent once per
+     * table when the outermost batch ends, unless it was rolled back.
+     * Batches are meant to be used from a single writing thread.
+     */
+    public synchronized void beginBatch() {{
+        this.getWritableDatabase().beginTransaction();
+        batchDepth++;
+    }}
+
+    /**
+     * Marks the current batch as successful, like
+     * SQLiteDatabase.setTransactionSuccessful.
+     */
+    public synchronized void setBatchSuccessful() {{
+        this.getWritableDatabase().setTransactionSuccessful();
+        batchSuccessful = true;
+    }}
+
+    public synchronized void endBatch() {{
+        this.getWritableDatabase().endTransaction();
+        if (!batchSuccessful) {{
+            batchFailed = true;
+        }}
+        batchSuccessful = false;
+        batchDepth--;
+
+        if (batchDepth == 0) {{
+            if (!batchFailed) {{
+                for (Uri uri : batchUris) {{
+                    notifyChange(uri);
+                }}
+            }}
+            batchUris.clear();
+            batchFailed = false;
+        }}
+    }}
+
+    /**
+     * Runs writes as one batch, which is successful if no exception
+     * is thrown.
+     */
+    public synchronized void runInBatch(final Runnable writes) {{
+        beginBatch();
+        try {{
+            writes.run();
+            setBatchSuccessful();
+        }}
+        finally {{
+            endBatch();
+        }}
+    }}
+
+    private void notifyChange(final Uri uri) {{
+        try {{
+            context.getContentResolver().notifyChange(uri, null, false);
+        }}
+        catch (UnsupportedOperationException e) {{
+           // Catch this for test suite. Mock provider cant notify
+        }}
+    }}
+
+    private void notifyProvider(final DBItem item) {{
+        if (batchDepth > 0) {{
+            batchUris.add(item.getBaseUri());
+        }}
+        else {{
+            item.notifyProvider(context);
+        }}
+    }}
+
+    private boolean updateOrInsertItem(final SQLiteDatabase db,
+            final DBItem item) {{
         boolean success = false;
-        int result = 0;
-        final SQLiteDatabase db = this.getWritableDatabase();
-        final ContentValues values = item.getContent();
+        long result = 0;
 
         if (item.getId() > -1) {{
-            result += db.update(item.getTableName(), values,
-                    DBItem.COL_ID + " IS ?",
-                    new String[] {{ String.valueOf(item.getId()) }});
+            final String[] idArgs = new String[] {{ String.valueOf(item.getId()) }};
+            // Only write what has changed
+            final ContentValues changed = item.getChangedContent();
+            if (changed.size() > 0) {{
+                result += db.update(item.getTableName(), changed,
+                        DBItem.COL_ID + " IS ?", idArgs);
+            }}
+            else {{
+                // Nothing to write if the row exists
+                result += DatabaseUtils.queryNumEntries(db,
+                        item.getTableName(), DBItem.COL_ID + " IS ?", idArgs);
+            }}
         }}
 
         // Update failed or wasn't possible, insert instead
         if (result < 1) {{
-            final long id = db.insert(item.getTableName(), null, values);
+            final long id = db.insert(item.getTableName(), null,
+                    item.getContent());
 
             if (id > 0) {{
                 item.setId(id);
@@ -208,20 +956,72 @@ public class {classname} extends SQLiteOpenHelper {{
         else {{
             success = true;
         }}
+        return success;
+    }}
+
+    // Convenience methods
+    public synchronized boolean putItem(final DBItem item) {{
+        boolean success = false;
+        final SQLiteDatabase db = this.getWritableDatabase();
+
+        // Changed lazy columns are written by a separate update
+        final ContentValues lazyValues = item.getLazyContent();
+        final boolean hasLazy = lazyValues != null && lazyValues.size() > 0;
+        if (hasLazy) {{
+            db.beginTransaction();
+        }}
+        try {{
+            // Items keyed on a unique constraint which already have an
+            // _id might conflict on both, and items tracking changes
+            // only update what changed, so they take the old path.
+            if (supportsUpsert && item.getUpsertSql() != null
+                    && (item.getId() < 0 || (item.getUpsertKeySql() == null
+                                             && !item.tracksChanges()))) {{
+                success = upsertItem(item);
+            }}
+            else {{
+                success = updateOrInsertItem(db, item);
+            }}
+
+            if (success && hasLazy) {{
+                db.update(item.getTableName(), lazyValues,
+                        DBItem.COL_ID + " IS ?",
+                        new String[] {{ String.valueOf(item.getId()) }});
+                item.clearLazyContent();
+            }}
+            if (hasLazy) {{
+                db.setTransactionSuccessful();
+            }}
+        }}
+        finally {{
+            if (hasLazy) {{
+                db.endTransaction();
+            }}
+        }}
 
         if (success) {{
-            item.notifyProvider(context);
+            item.clearChanges();
+            notifyProvider(item);
         }}
         return success;
     }}
 
     public synchronized int deleteItem(DBItem item) {{
         final SQLiteDatabase db = this.getWritableDatabase();
-        final int result = db.delete(item.getTableName(), DBItem.COL_ID
-                + " IS ?", new String[] {{ Long.toString(item.getId()) }});
+        final String[] idArgs = new String[] {{ Long.toString(item.getId()) }};
+        final ContentValues deleted = item.getSoftDeleteContent();
+        final int result;
+        if (deleted != null) {{
+            result = db.update(item.getTableName(), deleted,
+                    DBItem.COL_ID + " IS ?", idArgs);
+        }}
+        else {{
+            result = db.delete(item.getTableName(),
+                    DBItem.COL_ID + " IS ?", idArgs);
+        }}
 
         if (result > 0) {{
-            item.notifyProvider(context);
+            notifyProvider(item);
         }}
 
         return result;
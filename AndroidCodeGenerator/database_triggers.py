@@ -25,7 +25,7 @@ class DatabaseTriggers(object):
          * if they already exist.
          */
         public static void create(final SQLiteDatabase db) {
-            db.execSQL("DROP TRIGGER IF EXISTS tr_log";
+            db.execSQL("DROP TRIGGER IF EXISTS tr_log");
             db.execSQL(tr_log);
         }
     <BLANKLINE>
@@ -92,7 +92,7 @@ _D_T = '''
 "{0.java_string}";'''
 
 _C_P = '''
-        db.execSQL("DROP TRIGGER IF EXISTS {0.name}";
+        db.execSQL("DROP TRIGGER IF EXISTS {0.name}");
         db.execSQL({0.name});
 '''
 
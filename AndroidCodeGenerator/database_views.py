@@ -5,6 +5,15 @@ class DatabaseViews(object):
 
     Examples:
 
+    >>> from db_table import Table, Column, Join
+    >>> artist = Table('Artist').add_cols(Column('name').text)
+    >>> dv = DatabaseViews("com.example.appname.database")
+    >>> dv.add(View('artists').as_sql(Join(artist, ['name']).select)\
+.materialized)
+    >>> print(dv.rebuild)
+    for (final String sql : REBUILD_artists) {
+                    db.execSQL(sql);
+                }
     """
 
     def __init__(self, pkg):
@@ -21,8 +30,12 @@ class DatabaseViews(object):
     def create_perm(self):
         result = ""
         for view in self.views:
-            if not view.is_temp:
+            if view.is_materialized:
+                result += _C_M.format(view)
+            elif not view.is_temp:
                 result += _C_P.format(view)
+        if any(view.is_materialized for view in self.views):
+            result += "\n        rebuild(db);"
         return result.strip()
 
     @property
@@ -33,28 +46,67 @@ class DatabaseViews(object):
                 result += _C_T.format(view)
         return result.strip()
 
+    @property
+    def rebuild(self):
+        result = ""
+        for view in self.views:
+            if view.is_materialized:
+                result += _R_T.format(view)
+        return result.strip()
+
     @property
     def def_views(self):
         result = ""
         for view in self.views:
-            result += _D_T.format(view)
+            if view.is_materialized:
+                result += _D_M.format(view,
+                                      stmts=_java_array(view.stmts),
+                                      rebuild=_java_array(view.rebuild_stmts))
+            else:
+                result += _D_T.format(view)
 
         return result.strip()
 
+def _java_array(stmts):
+    return ",\n        ".join(['"{}"'.format(stmt) for stmt in stmts])
+
 _D_T = '''
     private static final String {0.name} =
 "{0.java_string}";'''
 
+# Tables backing a materialized view, and its full rebuild
+_D_M = '''
+    private static final String[] {0.name} = {{
+        {stmts}
+    }};
+
+    public static final String[] REBUILD_{0.name} = {{
+        {rebuild}
+    }};'''
+
 _C_P = '''
-        db.execSQL("DROP VIEW IF EXISTS {0.name}";
+        drop(db, "{0.name}");
         db.execSQL({0.name});
 '''
 
+_C_M = '''
+        drop(db, "{0.name}");
+        for (final String sql : {0.name}) {{
+            db.execSQL(sql);
+        }}
+'''
+
 _C_T = '''        db.execSQL({0.name});'''
 
+_R_T = '''
+            for (final String sql : REBUILD_{0.name}) {{
+                db.execSQL(sql);
+            }}'''
+
 
 _J_T = '''package {0.pkg};
 
+import android.database.DatabaseUtils;
 import android.database.sqlite.SQLiteDatabase;
 
 public class DatabaseViews {{
@@ -67,6 +119,23 @@ public class DatabaseViews {{
         {0.create_perm}
     }}
 
+    /**
+     * Drop a view, or the table backing a materialized view, as what
+     * it is in the database now. A view may have become materialized
+     * or the other way around since it was created.
+     */
+    private static void drop(final SQLiteDatabase db, final String name) {{
+        final String type = DatabaseUtils.stringForQuery(db,
+                "SELECT IFNULL((SELECT type FROM sqlite_master WHERE name = ?), '')",
+                new String[] {{ name }});
+        if ("view".equals(type)) {{
+            db.execSQL("DROP VIEW " + name);
+        }}
+        else if ("table".equals(type)) {{
+            db.execSQL("DROP TABLE " + name);
+        }}
+    }}
+
     /**
      * Create temporary views. Nothing is done if they
      * already exist.
@@ -75,5 +144,20 @@ public class DatabaseViews {{
         {0.create_temp}
     }}
 
+    /**
+     * Recompute every row of the materialized views. Their
+     * triggers keep them up to date after that.
+     */
+    public static void rebuild(final SQLiteDatabase db) {{
+        db.beginTransaction();
+        try {{
+            {0.rebuild}
+            db.setTransactionSuccessful();
+        }}
+        finally {{
+            db.endTransaction();
+        }}
+    }}
+
     {0.def_views}
 }}'''
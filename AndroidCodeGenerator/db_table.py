@@ -20,6 +20,9 @@ _C_TR = \
     {body}
   END"""
 
+# Current time in milliseconds since the epoch
+NOW_MILLIS = "(CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER))"
+
 class Column(object):
     """Used to build a column definition. Example usage:
 
@@ -28,12 +31,30 @@ class Column(object):
 
     >>> Column('_id').integer.primary_key
     _id INTEGER PRIMARY KEY
+
+    >>> Column('thumbnail').blob.lazy
+    thumbnail BLOB
+
+    Narrower java types only change the generated class, the
+    column is still stored as INTEGER or REAL:
+
+    >>> Column('starred').as_boolean.not_null.default(0)
+    starred INTEGER NOT NULL DEFAULT 0
+
+    >>> Column('kind').enum('NOTE', 'TASK').not_null
+    kind INTEGER NOT NULL
     """
 
     def __init__(self, name):
         self.name = name
         self.type = "TEXT"
         self.constraint = ""
+        self.is_lazy = False
+        # Maintained by triggers, never written by the item
+        self.is_derived = False
+        # Java representation, None for the default of the sql type
+        self.java_repr = None
+        self.enum_values = ()
 
     @property
     def upper_name(self):
@@ -64,6 +85,55 @@ class Column(object):
     def timestamp(self):
         return self.set_type("TIMESTAMP")
 
+    @property
+    def blob(self):
+        return self.set_type("BLOB")
+
+    def set_java_repr(self, typestring, repr):
+        '''Set the sql type and how the value is held in java'''
+        self.java_repr = repr
+        return self.set_type(typestring)
+
+    @property
+    def as_int(self):
+        return self.set_java_repr("INTEGER", "int")
+
+    @property
+    def as_short(self):
+        return self.set_java_repr("INTEGER", "short")
+
+    @property
+    def as_boolean(self):
+        '''Stored as 0 or 1'''
+        return self.set_java_repr("INTEGER", "boolean")
+
+    @property
+    def as_double(self):
+        return self.set_java_repr("REAL", "double")
+
+    @property
+    def epoch_millis(self):
+        '''Timestamp stored as milliseconds since the epoch in an
+        INTEGER, and held as a long instead of a String.'''
+        return self.set_java_repr("INTEGER", "millis")
+
+    def enum(self, *values):
+        '''Store one of values by its ordinal in an INTEGER. The
+        generated class gets a nested enum with these constants, so
+        only append to the list once data exists.'''
+        if not values:
+            raise ValueError("An enum needs at least one value")
+        self.enum_values = tuple(values)
+        return self.set_java_repr("INTEGER", "enum")
+
+    @property
+    def lazy(self):
+        '''Leave this column out of the generated projection. It is
+        loaded on first access and written by a separate update.
+        Meant for large text or blobs.'''
+        self.is_lazy = True
+        return self
+
     def set_constraint(self, *constraints):
         '''Set the constraint on the column'''
 
@@ -88,6 +158,12 @@ class Column(object):
         return self.set_constraint(self.constraint,
                                    "DEFAULT CURRENT_TIMESTAMP")
 
+    @property
+    def default_now_millis(self):
+        '''Use with epoch_millis to default to now.'''
+        return self.set_constraint(self.constraint,
+                                   "DEFAULT " + NOW_MILLIS)
+
 
 class Unique(object):
     """Unique constraint on a table
@@ -212,6 +288,105 @@ class Check(object):
                                    .join([str(x).strip() for x in self.args]))
 
 
+class Index(object):
+    """An index on the expressions of a table, added to the table with
+    Table.add_indexes. Expressions can be column names or anything
+    sqlite can index, like lower(name). A where clause makes a partial
+    index, which only holds the rows a query is restricted to.
+
+    A covering index also holds the remaining columns of the generated
+    FIELDS projection, so item queries never read the table itself.
+
+    Example:
+
+    >>> person = Table('Person').add_cols(Column('name').text,\
+Column('age').integer).soft_delete
+    >>> by_name = Index('ix_person_name').on('lower(name)')\
+.where('deleted = 0')
+    >>> by_age = Index('ix_person_age').on('age').covering
+    >>> person.add_indexes(by_name, by_age).indexes
+    [CREATE INDEX ix_person_name ON Person (lower(name)) WHERE deleted = 0, \
+CREATE INDEX ix_person_age ON Person (age, name, deleted)]
+    >>> by_name.queries
+    ['SELECT _id FROM Person WHERE lower(name) = ? AND deleted = 0']
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.table = None
+        self.exprs = []
+        self._unique = ""
+        self._where = None
+        self.is_covering = False
+        self._queries = []
+
+    def __repr__(self):
+        if self.table is None:
+            raise ValueError('Add the index to a table, like:\
+            Table("bob").add_indexes(Index("ix_bob").on("name"))')
+        if len(self.exprs) < 1:
+            raise ValueError('You must specify what to index, like:\
+            Index("ix_bob").on("name")')
+        sql = "CREATE {}INDEX {} ON {} ({})".format(self._unique, self.name,
+                                                    self.table.name,
+                                                    ", ".join(self.columns))
+        if self._where is not None:
+            sql += " WHERE {}".format(self._where)
+        return sql
+
+    def on(self, *exprs):
+        self.exprs.extend(exprs)
+        return self
+
+    def where(self, condition):
+        self._where = condition
+        return self
+
+    @property
+    def unique(self):
+        self._unique = "UNIQUE "
+        return self
+
+    @property
+    def covering(self):
+        self.is_covering = True
+        return self
+
+    def used_by(self, *queries):
+        """Declare the queries this index is for, which
+        SQLTester.test_index_plans checks"""
+        self._queries.extend(queries)
+        return self
+
+    @property
+    def fields(self):
+        """The columns of the generated FIELDS projection"""
+        return [col.name for col in self.table._columns if not col.is_lazy]
+
+    @property
+    def columns(self):
+        """The indexed expressions, then the covered columns"""
+        if not self.is_covering:
+            return list(self.exprs)
+        # _id is the rowid which every index holds
+        return list(self.exprs) + [name for name in self.fields[1:]
+                                   if name not in self.exprs]
+
+    @property
+    def queries(self):
+        """The declared queries, or a lookup on the first expression
+        under the where clause of the index"""
+        if self._queries:
+            return list(self._queries)
+        fields = self.fields if self.is_covering else ["_id"]
+        sql = "SELECT {} FROM {} WHERE {} = ?".format(",".join(fields),
+                                                      self.table.name,
+                                                      self.exprs[0])
+        if self._where is not None:
+            sql += " AND {}".format(self._where)
+        return [sql]
+
+
 class Table(object):
     """An SQL table which consists of columns
     and constraints. It is prepopualted with an _id column
@@ -252,7 +427,27 @@ class Table(object):
         self.name = name
         self._columns = [Column('_id').integer.primary_key]
         self._constraints = []
+        self.indexes = []
         self.fts3_cols = None
+        self.upsert_key = None
+        self.is_columnar = False
+        self.tracks_changes = False
+        self.soft_deletes = False
+        # (column, child table, foreign key column, summed column or None)
+        self._caches = []
+
+    def fts3(self, *cols):
+        '''Make the text columns cols searchable with a TableFTS3,
+        which the generated handler and provider can search.'''
+        self.fts3_cols = list(cols)
+        return self
+
+    @property
+    def fts(self):
+        '''The TableFTS3 of this table, or None'''
+        if not self.fts3_cols:
+            return None
+        return TableFTS3(self.name).use_cols(*self.fts3_cols)
 
     def __repr__(self):
         constraints = ",\n  ".join(map(str, self._constraints))
@@ -274,6 +469,171 @@ class Table(object):
         self._constraints.extend(constraints)
         return self
 
+    def add_indexes(self, *indexes):
+        """Add Index objects, see Index"""
+        for index in indexes:
+            index.table = self
+        self.indexes.extend(indexes)
+        return self
+
+    def upsert_on(self, *colnames):
+        """Generate a single statement upsert for this table, keyed on
+        _id (the default) or on the columns of a declared Unique
+        constraint. Upserts need sqlite 3.24, the generated code falls
+        back to update-then-insert on older versions.
+
+        Examples:
+
+        >>> Table('People').upsert_on().upsert_key
+        ('_id',)
+
+        >>> Table('People').add_cols(Column('name').text)\
+.add_constraints(Unique('name')).upsert_on('name').upsert_key
+        ('name',)
+
+        >>> Table('People').add_cols(Column('name').text).upsert_on('name')
+        Traceback (most recent call last):
+        ...
+        ValueError: Upsert key (name) must be _id or a declared Unique
+        """
+        if len(colnames) < 1:
+            colnames = ('_id',)
+        uniques = [tuple(c.colnames) for c in self._constraints
+                   if isinstance(c, Unique)]
+        if colnames != ('_id',) and tuple(colnames) not in uniques:
+            raise ValueError("Upsert key ({}) must be _id or a declared\
+ Unique".format(", ".join(colnames)))
+        self.upsert_key = tuple(colnames)
+        return self
+
+    @property
+    def columnar(self):
+        """Also generate a reader which loads the INTEGER and REAL
+        columns of many rows into primitive arrays."""
+        self.is_columnar = True
+        return self
+
+    @property
+    def track_changes(self):
+        """Generate private fields with setters which track what has
+        changed, so updates only write the changed columns."""
+        self.tracks_changes = True
+        return self
+
+    @property
+    def soft_delete(self):
+        """Deletes set the column deleted to 1 instead of removing the
+        row, so they can be synced. Marked rows are removed by the
+        generated purge routine.
+
+        >>> Table('Note').soft_delete._columns
+        [_id INTEGER PRIMARY KEY, deleted INTEGER NOT NULL DEFAULT 0]
+        """
+        self.soft_deletes = True
+        if "deleted" not in [col.name for col in self._columns]:
+            self.add_cols(Column("deleted").as_boolean.not_null.default(0))
+        return self
+
+    def count_of(self, name, child, fk_column):
+        """Add column name holding the number of rows in child whose
+        fk_column references this table, kept up to date by triggers
+        so lists do not need a COUNT(*) per row. child is a Table or a
+        table name. The generated item reads the column but never
+        writes it.
+
+        >>> songs = Table('Song').add_cols(Column('album').integer)
+        >>> album = Table('Album').count_of('songs', songs, 'album')
+        >>> album._columns[-1]
+        songs INTEGER NOT NULL DEFAULT 0
+        >>> album.cache_triggers[0]
+        CREATE  TRIGGER  tr_Album_songs_ins
+          AFTER INSERT ON Song
+          BEGIN
+            UPDATE Album SET songs = songs + 1 WHERE _id = new.album;
+          END
+        """
+        return self._add_cache(name, child, fk_column, None, "INTEGER")
+
+    def sum_of(self, name, child, fk_column, column):
+        """Like count_of, but the column holds the sum of column in the
+        children. Nulls count as 0."""
+        known = dict((c.name, c) for c in getattr(child, "_columns", []))
+        sql_type = "INTEGER"
+        if column in known and known[column].type == "REAL":
+            sql_type = "REAL"
+        return self._add_cache(name, child, fk_column, column, sql_type)
+
+    def _add_cache(self, name, child, fk_column, column, sql_type):
+        cached = Column(name).set_type(sql_type).not_null.default(0)
+        cached.is_derived = True
+        self.add_cols(cached)
+        self._caches.append((name, child, fk_column, column))
+        return self
+
+    def cache_reference(self, child, fk_column):
+        """The column of this table which fk_column of child references,
+        by its foreign key, _id by default
+
+        >>> song = Table('Song').add_cols(Column('album').text)\
+.add_constraints(ForeignKey('album').references('Album', 'title'))
+        >>> Table('Album').cache_reference(song, 'album')
+        'title'
+        """
+        for constraint in getattr(child, "_constraints", []):
+            if (isinstance(constraint, ForeignKey) and
+                constraint.column_name == fk_column):
+                return constraint.foreign_col
+        return "_id"
+
+    @property
+    def cache_rebuild_stmts(self):
+        """Statements which recompute the columns of count_of and
+        sum_of from the children, for rows written without the triggers
+
+        >>> songs = Table('Song').add_cols(Column('album').integer)
+        >>> Table('Album').count_of('songs', songs, 'album')\
+.cache_rebuild_stmts
+        ['UPDATE Album SET songs = (SELECT COUNT(*) FROM Song WHERE Song.album = Album._id)']
+        """
+        stmts = []
+        for name, child, fk_column, column in self._caches:
+            child_name = getattr(child, "name", child)
+            live = "COUNT(*)" if column is None else \
+                   "IFNULL(SUM({}), 0)".format(column)
+            stmts.append("UPDATE {0} SET {1} = (SELECT {2} FROM {3} WHERE\
+ {3}.{4} = {0}.{5})".format(self.name, name, live, child_name, fk_column,
+                            self.cache_reference(child, fk_column)))
+        return stmts
+
+    @property
+    def cache_triggers(self):
+        """Triggers which maintain the columns of count_of and sum_of"""
+        triggers = []
+        for name, child, fk_column, column in self._caches:
+            ref = self.cache_reference(child, fk_column)
+            child_name = getattr(child, "name", child)
+
+            def change(sign, row):
+                if column is None:
+                    delta = "1"
+                else:
+                    delta = "IFNULL({}.{}, 0)".format(row, column)
+                return "UPDATE {0} SET {1} = {1} {2} {3} WHERE {4} = {5}.{6}"\
+                       .format(self.name, name, sign, delta, ref, row,
+                               fk_column)
+
+            prefix = "tr_{}_{}_".format(self.name, name)
+            watched = [fk_column] + ([column] if column else [])
+            triggers.append(Trigger(prefix + "ins").after\
+                            .insert_on(child_name).do_sql(change("+", "new")))
+            triggers.append(Trigger(prefix + "del").after\
+                            .delete_on(child_name).do_sql(change("-", "old")))
+            triggers.append(Trigger(prefix + "up").after\
+                            .update_on(child_name, *watched)\
+                            .do_sql(change("-", "old"))\
+                            .do_sql(change("+", "new")))
+        return triggers
+
     def list_column_names(self, sep=",", withid=False, prefix="",
                           exclude=None):
         """Use to get a single string of column names. By default, it
@@ -314,6 +674,42 @@ class Table(object):
         return sep.join([prefix + c.name for c in cols])
 
 
+def creation_order(tables):
+    """The tables ordered so that every table comes after the tables
+    its foreign keys reference. Tables keep their given order where
+    the references allow it. References to tables not in the list,
+    and tables in a reference cycle, do not change the order.
+
+    >>> artist = Table('Artist')
+    >>> album = Table('Album').add_cols(Column('artist').integer)\
+.add_constraints(ForeignKey('artist').references('Artist'))
+    >>> song = Table('Song').add_cols(Column('album').integer)\
+.add_constraints(ForeignKey('album').references('Album'))
+    >>> [t.name for t in creation_order([song, album, artist])]
+    ['Artist', 'Album', 'Song']
+    """
+    names = set(table.name for table in tables)
+    parents = {}
+    for table in tables:
+        parents[table.name] = set(c.foreign_table for c in table._constraints
+                                  if isinstance(c, ForeignKey) and
+                                  c.foreign_table in names and
+                                  c.foreign_table != table.name)
+    ordered = []
+    created = set()
+    remaining = list(tables)
+    while remaining:
+        ready = [t for t in remaining if parents[t.name] <= created]
+        if not ready:
+            # A cycle, which deferred foreign key checks allow
+            ready = remaining[:1]
+        for table in ready:
+            ordered.append(table)
+            created.add(table.name)
+            remaining.remove(table)
+    return ordered
+
+
 class Trigger(object):
     """Create an sql trigger
 
@@ -335,6 +731,10 @@ class Trigger(object):
         self._action = None
         self._when = None
         self._body = []
+        # What fires the trigger, for DependencyGraph
+        self.event = None
+        self.table = None
+        self.update_cols = ()
 
     @property
     def java_string(self):
@@ -355,7 +755,7 @@ class Trigger(object):
             Trigger("bob").do("SQL")')
 
         return _C_TR.format(self,
-                            body="\n".join(self._body))
+                            body="\n    ".join(self._body))
 
     @property
     def temp(self):
@@ -388,10 +788,12 @@ class Trigger(object):
 
     def delete_on(self, tablename):
         self._action = "DELETE ON {}".format(tablename)
+        self.event, self.table = "DELETE", tablename
         return self
 
     def insert_on(self, tablename):
         self._action = "INSERT ON {}".format(tablename)
+        self.event, self.table = "INSERT", tablename
         return self
 
     def update_on(self, tablename, *cols):
@@ -401,6 +803,8 @@ class Trigger(object):
 
         self._action = "UPDATE {} ON {}".format(of_cols,
                                                 tablename)
+        self.event, self.table = "UPDATE", tablename
+        self.update_cols = tuple(cols or ())
         return self
 
     def do_sql(self, sqlstatement):
@@ -423,21 +827,26 @@ class TableFTS3(object):
     CREATE  TRIGGER  tr_tasks_fts3_ins
       AFTER INSERT ON tasks
       BEGIN
-        INSERT INTO tasks_fts3(_id, title, note) VALUES (new._id, new.title, new.note);
+        INSERT INTO tasks_fts3(docid, _id, title, note) VALUES (new._id, new._id, new.title, new.note);
       END
     <BLANKLINE>
     CREATE  TRIGGER  tr_tasks_fts3_del
       AFTER DELETE ON tasks
       BEGIN
-        DELETE FROM tasks_fts3 WHERE _id IS old._id;
+        DELETE FROM tasks_fts3 WHERE docid = old._id;
       END
     <BLANKLINE>
     CREATE  TRIGGER  tr_tasks_fts3_up
       AFTER UPDATE OF title,note ON tasks
       BEGIN
-        UPDATE tasks_fts3 SET title = new.title, note = new.note WHERE _id IS new._id;
+        UPDATE tasks_fts3 SET title = new.title, note = new.note WHERE docid = new._id;
       END
 
+    The docid of a row is the _id of the row it indexes, so searches
+    join back to the table on its primary key:
+
+    >>> TableFTS3("tasks").use_cols("title").search_sql(["_id", "title"])
+    'SELECT tasks._id,tasks.title FROM tasks_fts3 JOIN tasks ON tasks._id = tasks_fts3.docid WHERE tasks_fts3 MATCH ?1 LIMIT ?2'
     '''
 
     def __init__(self, tablename):
@@ -478,20 +887,20 @@ class TableFTS3(object):
         # Insert trigger
         tr_ins = Trigger("tr_" + self.name + "_ins").after.insert_on(self.tablename)
         tr_ins.do_sql("INSERT INTO {}\
-({}) VALUES ({})".format(self.name,
-                         self._cols(),
-                         self._cols(prefix="new.")))
+(docid, {}) VALUES (new._id, {})".format(self.name,
+                                         self._cols(),
+                                         self._cols(prefix="new.")))
         triggers.append(tr_ins)
         # Delete trigger
         tr_del = Trigger("tr_" + self.name + "_del").after.delete_on(self.tablename)
-        tr_del.do_sql("DELETE FROM {} WHERE _id IS old._id".format(self.name))
+        tr_del.do_sql("DELETE FROM {} WHERE docid = old._id".format(self.name))
         triggers.append(tr_del)
         # Update trigger
         tr_up = Trigger("tr_" +
                         self.name +
                         "_up").after.update_on(self.tablename,
                                                *self.cols)
-        s = "UPDATE {} SET {} WHERE _id IS new._id"
+        s = "UPDATE {} SET {} WHERE docid = new._id"
         setters = ["{0} = new.{0}".format(col) for col in self.cols]
         tr_up.do_sql(s.format(self.name,
                           ", ".join(setters)))
@@ -499,8 +908,35 @@ class TableFTS3(object):
 
         return triggers
 
+    @property
+    def rank(self):
+        '''Number of matching terms in a row, from offsets() which
+        gives four numbers per match. FTS3 has no built in ranking.'''
+        offsets = "offsets({})".format(self.name)
+        return "length({0}) - length(replace({0}, ' ', ''))"\
+               .format(offsets)
+
+    def search_sql(self, columns, ranked=False, where=""):
+        '''Select columns of the table for rows matching ?1, at most
+        ?2 of them (-1 for all). If ranked, a snippet of the match is
+        added as the last column and the best matches come first. where
+        is appended to the condition, like " AND Note.deleted = 0".'''
+        cols = ["{}.{}".format(self.tablename, col) for col in columns]
+        order = ""
+        if ranked:
+            cols.append("snippet({}) AS snippet".format(self.name))
+            order = " ORDER BY {} DESC".format(self.rank)
+        return "SELECT {cols} FROM {fts} JOIN {table} ON {table}._id = \
+{fts}.docid WHERE {fts} MATCH ?1{where}{order} LIMIT ?2"\
+               .format(cols=",".join(cols), fts=self.name,
+                       table=self.tablename, where=where, order=order)
+
+    @property
+    def stmts(self):
+        return [self.table_stmt] + self.trigger_stmts
+
     def __repr__(self):
-        return "\n\n".join([self.table_stmt] + self.trigger_stmts)
+        return "\n\n".join(self.stmts)
 
 
 class View(object):
@@ -517,6 +953,11 @@ songs WHERE artists.name = songs.artistname;
         self._temp = ""
         self._if_not_exists = ""
         self._stmt = None
+        # Known columns, needed to generate an item class for the view
+        self._columns = None
+        # The Join the view was built with, if any
+        self._join = None
+        self.is_materialized = False
         self.name = str(name).strip()
         if self.name is None or len(self.name) < 1:
             raise ValueError('Must give a valid name!')
@@ -536,9 +977,161 @@ songs WHERE artists.name = songs.artistname;
         return self
 
     def as_sql(self, select_stmt):
+        """The select statement of the view. If it comes from
+        select_join, the columns of the view are known.
+
+        >>> t1 = (Table('Artist').add_cols(Column('name').text.not_null),\
+                  ['name'])
+        >>> t2 = ('Album', ['name'])
+        >>> on = (('Artist', 'name'), ('Album', 'artist'))
+        >>> View('music').as_sql(select_join([t1, t2], [on]))._columns
+        [_id INTEGER PRIMARY KEY, Artist_name TEXT NOT NULL, Album_name TEXT]
+        """
         self._stmt = str(select_stmt).strip()
         if not self._stmt.endswith(";"):
             self._stmt += ";"
+        columns = getattr(select_stmt, "columns", None)
+        if columns is not None:
+            self._columns = list(columns)
+        self._join = getattr(select_stmt, "join", None)
+        return self
+
+    @property
+    def materialized(self):
+        """Keep the rows of the view in a table of the same name,
+        instead of running the join on every read. Triggers on the
+        joined tables recompute only the rows of the first table's _ids
+        which a write touches, using a table of dirty ids. The view must
+        be built with Join or select_join, and is never temporary.
+
+        >>> artist = Table('Artist').add_cols(Column('name').text)
+        >>> v = View('artists').as_sql(Join(artist, ['name']).select)
+        >>> print("\\n".join(v.materialized.stmts))
+        DROP TABLE IF EXISTS artists
+        DROP TABLE IF EXISTS artists_dirty
+        CREATE TABLE artists (_id INTEGER, Artist_name TEXT, _t1_id INTEGER)
+        CREATE INDEX artists_id ON artists (_id)
+        CREATE INDEX artists_t1_id ON artists (_t1_id)
+        CREATE TABLE artists_dirty (_id INTEGER PRIMARY KEY)
+        """
+        if self._join is None:
+            raise ValueError("View {} must be built with Join or\
+ select_join to be materialized".format(self.name))
+        if self.is_temp:
+            raise ValueError("Materialized view {} can not be temporary"\
+                             .format(self.name))
+        self.is_materialized = True
+        return self
+
+    @property
+    def dirty_table(self):
+        return self.name + "_dirty"
+
+    def _id_column(self, i):
+        """Column of the backing table holding the _id of table i"""
+        return "_t{}_id".format(i + 1)
+
+    @property
+    def stmts(self):
+        """Statements which create the view, or the tables backing a
+        materialized view. Existing tables are dropped first, so they
+        can run again on a database which has them. A view of the same
+        name must be dropped before, see DatabaseViews.
+
+        >>> import sqlite3
+        >>> artist = Table('Artist').add_cols(Column('name').text)
+        >>> v = View('artists').as_sql(Join(artist, ['name']).select)
+        >>> con = sqlite3.connect(":memory:")
+        >>> for stmt in v.materialized.stmts + v.stmts:
+        ...     _ = con.execute(stmt)
+        >>> con.close()
+        """
+        if not self.is_materialized:
+            return [str(self)]
+        tables = self._join.tables
+        columns = ["{} {}".format(col.name, col.type)
+                   for col in self._columns]
+        columns += ["{} INTEGER".format(self._id_column(i))
+                    for i in range(len(tables))]
+        stmts = ["DROP TABLE IF EXISTS {}".format(self.name),
+                 "DROP TABLE IF EXISTS {}".format(self.dirty_table),
+                 "CREATE TABLE {} ({})".format(self.name, ", ".join(columns)),
+                 "CREATE INDEX {0}_id ON {0} (_id)".format(self.name)]
+        stmts += ["CREATE INDEX {0}{1} ON {0} ({1})"\
+                  .format(self.name, self._id_column(i))
+                  for i in range(len(tables))]
+        stmts.append("CREATE TABLE {} (_id INTEGER PRIMARY KEY)"\
+                     .format(self.dirty_table))
+        return stmts
+
+    def _insert(self, where=""):
+        """Insert the rows of the view into the backing table"""
+        join = self._join
+        names = [col.name for col in self._columns]
+        names += [self._id_column(i) for i in range(len(join.tables))]
+        fields = join.fields(named=False)
+        fields += ["t{}._id".format(i + 1) for i in range(len(join.tables))]
+        return "INSERT INTO {} ({}) SELECT {} {}{}"\
+               .format(self.name, ", ".join(names), ", ".join(fields),
+                       join.sources, where)
+
+    @property
+    def rebuild_stmts(self):
+        """Statements which recompute all rows of a materialized view"""
+        return ["DELETE FROM {}".format(self.name), self._insert()]
+
+    @property
+    def triggers(self):
+        """Triggers which keep a materialized view up to date
+
+        >>> artist = Table('Artist').add_cols(Column('name').text)
+        >>> v = View('artists').as_sql(Join(artist, ['name']).select)
+        >>> v.materialized.triggers[2]
+        CREATE  TRIGGER  tr_artists_Artist_del
+          AFTER DELETE ON Artist
+          BEGIN
+            INSERT OR IGNORE INTO artists_dirty SELECT _id FROM artists WHERE _t1_id = old._id;
+            DELETE FROM artists WHERE _id IN (SELECT _id FROM artists_dirty);
+            INSERT INTO artists (_id, Artist_name, _t1_id) SELECT t1._id, t1.name, t1._id FROM Artist AS t1 WHERE t1._id IN (SELECT _id FROM artists_dirty);
+            DELETE FROM artists_dirty;
+          END
+        """
+        if not self.is_materialized:
+            return []
+        join = self._join
+        triggers = []
+        for i, table in enumerate(join.tables):
+            # Rows which had the old row, and rows which get the new one
+            old = "INSERT OR IGNORE INTO {} SELECT _id FROM {} WHERE\
+ {} = old._id".format(self.dirty_table, self.name, self._id_column(i))
+            new = "INSERT OR IGNORE INTO {} SELECT t1._id {} WHERE\
+ t{}._id = new._id".format(self.dirty_table, join.sources, i + 1)
+            refresh = ["DELETE FROM {} WHERE _id IN (SELECT _id FROM {})"\
+                       .format(self.name, self.dirty_table),
+                       self._insert(" WHERE t1._id IN (SELECT _id FROM {})"\
+                                    .format(self.dirty_table)),
+                       "DELETE FROM {}".format(self.dirty_table)]
+            prefix = "tr_{}_{}_".format(self.name, table)
+            for trigger, marks in ((Trigger(prefix + "ins").after\
+                                    .insert_on(table), [new]),
+                                   (Trigger(prefix + "up").after\
+                                    .update_on(table), [old, new]),
+                                   (Trigger(prefix + "del").after\
+                                    .delete_on(table), [old])):
+                for stmt in marks + refresh:
+                    trigger.do_sql(stmt)
+                triggers.append(trigger)
+        return triggers
+
+    def with_cols(self, *columns):
+        """Declare the columns of a view written in raw sql. The _id
+        column is added.
+
+        >>> View('names').as_sql('SELECT _id, name FROM Person')\
+.with_cols(Column('name').text)._columns
+        [_id INTEGER PRIMARY KEY, name TEXT]
+        """
+        self._columns = [Column('_id').integer.primary_key] + list(columns)
         return self
 
     @property
@@ -553,8 +1146,132 @@ songs WHERE artists.name = songs.artistname;
                                                    self._stmt)
 
 
-def select_join(tab_cols, on_cols):
+class SelectStatement(str):
+    """A select statement which knows which columns it returns, and
+    the Join it was built with"""
+    columns = None
+    join = None
+
+
+class Join(object):
+    """Builds a select over tables joined with explicit JOIN ... ON
+    clauses, in the order the tables are added. Tables get the aliases
+    t1, t2, ... and their columns are named table_column in the result.
+    The _id of the first table is the _id of the result.
+
+    Tables can be given by name or as Table objects. Columns of Table
+    objects keep their type, others are assumed to be TEXT. Columns of
+    left joined tables are always nullable.
+
+    >>> Join('Artist', ['name']).left_join('Album', ['year'],\
+(('Artist', 'name'), ('Album', 'artist'))).select
+    'SELECT t1._id AS _id, t1.name AS Artist_name, t2.year AS Album_year FROM Artist AS t1 LEFT JOIN Album AS t2 ON t1.name = t2.artist;'
+    """
+
+    def __init__(self, table, cols):
+        # (join keyword, table name, alias, columns, known columns, on)
+        self._tables = []
+        self._add("FROM", table, cols, ())
+
+    def _add(self, keyword, table, cols, on):
+        known = dict((c.name, c) for c in getattr(table, "_columns", []))
+        name = getattr(table, "name", table)
+        if name in self.aliases:
+            raise ValueError("Table {} is already joined".format(name))
+        if keyword != "FROM" and not on:
+            raise ValueError("Join of {} needs an ON condition".format(name))
+        alias = "t{}".format(len(self._tables) + 1)
+        self._tables.append((keyword, name, alias, list(cols), known,
+                             list(on)))
+        return self
+
+    def join(self, table, cols, *on):
+        """Inner join table, on pairs like (('Artist', 'name'),
+        ('Album', 'artist'))"""
+        return self._add("JOIN", table, cols, on)
+
+    def left_join(self, table, cols, *on):
+        """Like join, but rows of the earlier tables are kept when
+        nothing in table matches"""
+        return self._add("LEFT JOIN", table, cols, on)
+
+    @property
+    def aliases(self):
+        return dict((name, alias)
+                    for _, name, alias, _, _, _ in self._tables)
+
+    def _on(self, on):
+        aliases = self.aliases
+        result = []
+        for (t1, t1col), (t2, t2col) in on:
+            for table in (t1, t2):
+                if table not in aliases:
+                    raise ValueError("Table {} in ON is not joined"\
+                                     .format(table))
+            result.append("{}.{} = {}.{}".format(aliases[t1], t1col,
+                                                 aliases[t2], t2col))
+        return " AND ".join(result)
+
+    @property
+    def tables(self):
+        """Names of the joined tables, in order"""
+        return [name for _, name, _, _, _, _ in self._tables]
+
+    @property
+    def columns(self):
+        """Columns of the result"""
+        columns = [Column('_id').integer.primary_key]
+        for keyword, table, alias, cols, known, on in self._tables:
+            for col in cols:
+                column = Column("{}_{}".format(table, col))
+                if col in known:
+                    column.set_type(known[col].type)
+                    if ("NOT NULL" in known[col].constraint and
+                        keyword != "LEFT JOIN"):
+                        column.not_null
+                columns.append(column)
+        return columns
+
+    def fields(self, named=True):
+        """The selected expressions, with their names if named"""
+        fields = ["t1._id AS _id" if named else "t1._id"]
+        for _, table, alias, cols, _, _ in self._tables:
+            for col in cols:
+                field = "{}.{}".format(alias, col)
+                if named:
+                    field += " AS {}_{}".format(table, col)
+                fields.append(field)
+        return fields
+
+    @property
+    def sources(self):
+        """FROM and JOIN clauses"""
+        sources = []
+        for keyword, table, alias, _, _, on in self._tables:
+            source = "{} {} AS {}".format(keyword, table, alias)
+            if on:
+                source += " ON " + self._on(on)
+            sources.append(source)
+        return " ".join(sources)
+
+    @property
+    def select(self):
+        stmt = SelectStatement("SELECT {} {};".format(", ".join(self.fields()),
+                                                      self.sources))
+        stmt.columns = self.columns
+        stmt.join = self
+        return stmt
+
+    def __repr__(self):
+        return self.select
+
+
+def select_join(tab_cols, on_cols, left=()):
     """
+    Joins the tables in the order given, each ON the conditions
+    which link it to a table before it. Tables named in left are
+    left joined. See Join for more control.
+
     Example usage:
 
     >>> t1 = ('Artist', 'name age'.split(' '))
@@ -563,32 +1280,31 @@ def select_join(tab_cols, on_cols):
     >>> on1 = (('Artist', 'name'), ('Album', 'artist'))
     >>> on2 = (('Artist', 'name'), ('Song', 'artist'))
     >>> select_join([t1, t2, t3], [on1, on2])
-    'SELECT t1._id AS _id, t1.name AS Artist_name, t1.age AS Artist_age, t2.name AS Album_name, t2.year AS Album_year, t3.name AS Song_name, t3.duration AS Song_duration FROM Album AS t2, Song AS t3, Artist AS t1 WHERE t1.name = t2.artist AND t1.name = t3.artist;'
+    'SELECT t1._id AS _id, t1.name AS Artist_name, t1.age AS Artist_age, t2.name AS Album_name, t2.year AS Album_year, t3.name AS Song_name, t3.duration AS Song_duration FROM Artist AS t1 JOIN Album AS t2 ON t1.name = t2.artist JOIN Song AS t3 ON t1.name = t3.artist;'
+    >>> select_join([t1, t2], [on1, on2])
+    Traceback (most recent call last):
+    ...
+    ValueError: ON Artist.name = Song.artist names a table which is not joined
     """
-
-    alias = {}
-    # Always include the idea of the first table
-    fields = ["t1._id AS _id"]
-    i = 0
+    names = [getattr(table, "name", table) for table, cols in tab_cols]
+    for a, b in on_cols:
+        if a[0] not in names or b[0] not in names:
+            # It would be left out, and the join become a cross join
+            raise ValueError("ON {}.{} = {}.{} names a table which is not\
+ joined".format(a[0], a[1], b[0], b[1]))
+    join = None
     for table, cols in tab_cols:
-        i += 1
-        tx = "t{}".format(i)
-        alias[table] = tx
-        fields.extend(["{0}.{1} \
-AS {2}_{1}".format(tx, col, table) for col in cols])
-
-    on = []
-    for (t1, t1col), (t2, t2col) in on_cols:
-        on.append("{}.{} = {}.{}".format(alias[t1],
-                                         t1col,
-                                         alias[t2],
-                                         t2col))
-
-    tables = []
-    for k, v in alias.items():
-        tables.append("{} AS {}".format(k, v))
-
-    return 'SELECT {} \
-FROM {} WHERE {};'.format(', '.join(fields),
-                          ', '.join(tables),
-                          " AND ".join(on))
+        if join is None:
+            join = Join(table, cols)
+            continue
+        name = getattr(table, "name", table)
+        joined = join.aliases
+        on = [(a, b) for a, b in on_cols
+              if (a[0] == name and b[0] in joined) or
+                 (b[0] == name and a[0] in joined)]
+        if name in left:
+            join.left_join(table, cols, *on)
+        else:
+            join.join(table, cols, *on)
+
+    return join.select
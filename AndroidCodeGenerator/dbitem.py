@@ -14,24 +14,45 @@ then a java OrmClass is generated.
 >>> dbitem = DBItem(t, pkg="com.ex.app.db")
 
 """
+import re
 from hashlib import sha1
-from db_table import Table
+from db_table import Table, Column, Unique
 
 class DBItem(object):
     """Generates an ORM class for the given table"""
 
-    def __init__(self, sql_table, pkg):
+    read_only = False
+
+    def __init__(self, sql_table, pkg, parcelable=False, uri_codes=None):
+        """Give parcelable=True to also generate a Parcelable
+        implementation and writeTo(DataOutput)/readFrom(DataInput).
+
+        uri_codes is a provider.UriCodes which assigns the match codes.
+        Without one the codes are derived from a hash of the class name.
+        Generator always gives one, see its uri_codes argument.
+        """
         self.sql_table = sql_table
         self.pkg = pkg
+        self.parcelable = parcelable
+        self.uri_codes = uri_codes
 
-    def __repr__(self):
-        java_cols = map(JavaColumn, self.sql_table._columns)
+    @property
+    def java_columns(self):
+        return list(map(JavaColumn, self.sql_table._columns))
 
-        content_value_mapping = []
-        for i, java_col in enumerate(java_cols):
-            cursor_get = java_col.cursor_get
-            content_value_mapping.append("this.{} = {};".format(java_col.var_name,
-                                                                cursor_get.format(i)))
+    @property
+    def eager_columns(self):
+        """The columns in FIELDS, which are read from cursors"""
+        return [x for x in self.java_columns if not x.column.is_lazy]
+
+    @property
+    def lazy_columns(self):
+        return [x for x in self.java_columns if x.column.is_lazy]
+
+    def __repr__(self):
+        java_cols = self.eager_columns
+        # Tracked fields must go through their setters
+        visibility = "private" if self.sql_table.tracks_changes else "public"
 
         return CLASS_TEMPLATE.format(
                 table=self.sql_table,
@@ -40,71 +61,658 @@ class DBItem(object):
                 classname=self.classname,
                 baseurihash=self.baseurihash,
                 baseitemhash=self.baseitemhash,
-                column_constants="\n    ".join([x.declare_const for x in java_cols]),
+                column_constants="\n    ".join([x.declare_const
+                                                for x in self.java_columns]),
                 column_constants_list=", ".join([x.const_name for x in java_cols]),
-        column_vars="\n    ".join([x.declare_var for x in java_cols]),
-                column_field_from_cursor="\n        ".join(content_value_mapping),
-                to_content_values=self.to_content_values)
+                column_vars="\n    ".join([x.declare_field(visibility)
+                                            for x in java_cols]),
+                column_count=len(java_cols) - 1,
+                enums="".join([x.declare_enum for x in self.java_columns]),
+                tracking=self.tracking,
+                column_field_from_cursor=self.column_field_from_cursor,
+                to_content_values=self.to_content_values,
+                queries=self.queries,
+                upsert=self.upsert,
+                search=self.search,
+                soft_delete=self.soft_delete,
+                indexes=self.indexes,
+                extra_codes=self.extra_codes,
+                extra_matchers=self.extra_matchers,
+                lazy=self.lazy,
+                columnar=self.columnar,
+                implements=" implements Parcelable" if self.parcelable else "",
+                serialization=self.serialization)
+
+    def _null_mask(self, java_cols):
+        """Java which computes the null bitmap nulls of the fields"""
+        lines = ["long nulls = 0;"]
+        for i, java_col in enumerate(java_cols):
+            if not java_col.is_primitive and java_col.var_name != "_id":
+                lines.append("if ({} == null) nulls |= 1L << {};"\
+                             .format(java_col.var_name, i))
+        return "\n        ".join(lines)
+
+    def _read_fields(self, java_cols, read):
+        """Java which assigns every field from read(java_col), unless
+        its bit is set in the null bitmap nulls"""
+        lines = []
+        for i, java_col in enumerate(java_cols):
+            if java_col.var_name == "_id":
+                lines.append("setId({});".format(read(java_col)))
+            elif not java_col.is_primitive:
+                lines.append("{} = (nulls & (1L << {})) != 0 ? null : {};"\
+                             .format(java_col.var_name, i, read(java_col)))
+            else:
+                lines.append("{} = {};".format(java_col.var_name,
+                                               read(java_col)))
+        return "\n        ".join(lines)
 
-    @property
-    def to_content_values(self):
-        java_cols = map(JavaColumn, self.sql_table._columns)
-        no_id = []
-        for x in java_cols:
-            if x.var_name != "_id":
-                no_id.append(x)
-
-        result = ""
-        sep = "\n        "
-        for java_col in no_id:
-            if 'NOT NULL' in java_col.column.constraint:
-                simple = True
+    def _write_fields(self, java_cols, write):
+        lines = []
+        for i, java_col in enumerate(java_cols):
+            if not java_col.is_primitive and java_col.var_name != "_id":
+                lines.append("if ({} != null) {}".format(java_col.var_name,
+                                                        write(java_col)))
             else:
-                simple = False
-
-            if "CURRENT_" in java_col.column.constraint:
-                # Timestamp, special case here
-                result = \
-                sep.join([result,
-                          "if ({1} != null)\
- values.put({0}, {1});".format(java_col.const_name,
-                               java_col.var_name)])
-            elif simple:
-                result = \
-                sep.join([result,
-                          "values.put({0}, {1});".format(java_col.const_name,
-                                                         java_col.var_name)])
+                lines.append(write(java_col))
+        return "\n        ".join(lines)
+
+    @property
+    def serialization(self):
+        """Parcelable implementation and a compact binary format. Both
+        start with a bitmap of null fields, which are then skipped.
+        Strings can be null in java even if the column is NOT NULL.
+        Lazy columns are not included.
+
+        >>> t = Table('Person').add_cols(Column('name').text)
+        >>> print(DBItem(t, "com.ex", parcelable=True).serialization)
+        <BLANKLINE>
+            public void writeTo(final DataOutput out) throws IOException {
+                long nulls = 0;
+                if (name == null) nulls |= 1L << 1;
+                out.writeLong(nulls);
+                out.writeLong(getId());
+                if (name != null) writeString(out, name);
+            }
+        <BLANKLINE>
+            public void readFrom(final DataInput in) throws IOException {
+                final long nulls = in.readLong();
+                setId(in.readLong());
+                name = (nulls & (1L << 1)) != 0 ? null : readString(in);
+            }
+        <BLANKLINE>
+            @Override
+            public int describeContents() {
+                return 0;
+            }
+        <BLANKLINE>
+            @Override
+            public void writeToParcel(final Parcel dest, final int flags) {
+                long nulls = 0;
+                if (name == null) nulls |= 1L << 1;
+                dest.writeLong(nulls);
+                dest.writeLong(getId());
+                if (name != null) dest.writeString(name);
+            }
+        <BLANKLINE>
+            private PersonItem(final Parcel in) {
+                super();
+                final long nulls = in.readLong();
+                setId(in.readLong());
+                name = (nulls & (1L << 1)) != 0 ? null : in.readString();
+            }
+        <BLANKLINE>
+            public static final Parcelable.Creator<PersonItem> CREATOR =
+                    new Parcelable.Creator<PersonItem>() {
+                public PersonItem createFromParcel(final Parcel in) {
+                    return new PersonItem(in);
+                }
+        <BLANKLINE>
+                public PersonItem[] newArray(final int size) {
+                    return new PersonItem[size];
+                }
+            };
+        <BLANKLINE>
+        """
+        if not self.parcelable:
+            return ""
+
+        java_cols = self.eager_columns
+        if len(java_cols) > 64:
+            raise ValueError("Can not serialize more than 64 columns")
+
+        return SERIALIZATION_TEMPLATE.format(
+            classname=self.classname,
+            null_mask=self._null_mask(java_cols),
+            data_write=self._write_fields(java_cols, lambda x: x.data_write),
+            data_read=self._read_fields(java_cols, lambda x: x.data_read),
+            parcel_write=self._write_fields(java_cols,
+                                            lambda x: x.parcel_write),
+            parcel_read=self._read_fields(java_cols, lambda x: x.parcel_read))
+
+    @property
+    def columnar_columns(self):
+        """Columns which can be read into primitive arrays
+
+        >>> t = Table('Point').add_cols(Column('x').real.not_null,\
+Column('label').text, Column('weight').integer)
+        >>> [x.var_name for x in DBItem(t, "com.ex").columnar_columns]
+        ['_id', 'x', 'weight']
+        """
+        return [x for x in self.eager_columns if x.array_type is not None]
+
+    @property
+    def columnar(self):
+        if not self.sql_table.is_columnar:
+            return ""
+
+        java_cols = self.columnar_columns
+        declare = []
+        allocate = []
+        read = []
+        for i, java_col in enumerate(java_cols):
+            declare.append("public final {0.array_type}[] {0.var_name};"\
+                           .format(java_col))
+            allocate.append("{0.var_name} = new {0.array_type}[count];"\
+                            .format(java_col))
+            get = "{0.var_name}[i] = cursor.get{1}({2});"\
+                  .format(java_col, java_col.array_type.capitalize(), i)
+            if java_col.is_nullable and java_col.var_name != "_id":
+                declare.append("public final BitSet {}Null;"\
+                               .format(java_col.var_name))
+                allocate.append("{}Null = new BitSet(count);"\
+                                .format(java_col.var_name))
+                get = COLUMNAR_NULL_TEMPLATE.format(java_col.var_name,
+                                                    i, get)
+            read.append(get)
+
+        return COLUMNAR_TEMPLATE.format(
+            fields=", ".join([x.const_name for x in java_cols]),
+            declare="\n        ".join(declare),
+            allocate="\n            ".join(allocate),
+            read="\n                ".join(read))
+
+    @property
+    def lazy(self):
+        """Fields, accessors and write-back of lazy columns
+
+        >>> t = Table('Photo').add_cols(Column('data').blob.lazy)
+        >>> DBItem(t, "com.ex").lazy_columns[0].query_const_name
+        'QUERY_DATA_BY_ID'
+
+        >>> t = Table('Photo').add_cols(Column('data').blob.lazy.not_null)
+        >>> DBItem(t, "com.ex").lazy
+        Traceback (most recent call last):
+        ...
+        ValueError: Lazy column data must be nullable or have a default, it is written after the insert
+        """
+        lazy_cols = self.lazy_columns
+        if len(lazy_cols) < 1:
+            return ""
+
+        for x in lazy_cols:
+            if ("NOT NULL" in x.column.constraint and
+                "DEFAULT" not in x.column.constraint):
+                raise ValueError("Lazy column {} must be nullable or have\
+ a default, it is written after the insert".format(x.var_name))
+
+        fields = "\n".join([LAZY_FIELD_TEMPLATE.format(col=x,
+                                                     classname=self.classname)
+                          for x in lazy_cols])
+        content = "\n        ".join([LAZY_CONTENT_TEMPLATE.format(col=x)
+                                     for x in lazy_cols])
+        clear = "\n        ".join(["{}Changed = false;".format(x.var_name)
+                                   for x in lazy_cols])
+        return LAZY_TEMPLATE.format(fields=fields,
+                                    lazy_content=content,
+                                    clear_lazy=clear)
+
+    @property
+    def column_field_from_cursor(self):
+        content_value_mapping = []
+        for i, java_col in enumerate(self.eager_columns):
+            cursor_get = java_col.cursor_get
+            content_value_mapping.append("this.{} = {};".format(java_col.var_name,
+                                                                cursor_get.format(i)))
+        # Reused instances must load lazy columns again
+        for java_col in self.lazy_columns:
+            content_value_mapping.append(
+                "this.{0} = null;\n        {0}Loaded = false;\n\
+        {0}Changed = false;".format(java_col.var_name))
+        return "\n        ".join(content_value_mapping)
+
+    @property
+    def upsert_sql(self):
+        """Single statement upsert using numbered parameters in FIELDS
+        order, or None if the table has no upsert key. Columns
+        defaulting to CURRENT_* keep their value if bound to null.
+
+        >>> t = Table('Person').add_cols(Column('name').text.not_null,\
+Column('time').timestamp.default_current_timestamp).upsert_on()
+        >>> DBItem(t, "com.ex").upsert_sql
+        'INSERT INTO Person (_id,name,time) VALUES (?1,?2,COALESCE(?3, CURRENT_TIMESTAMP)) ON CONFLICT (_id) DO UPDATE SET name = excluded.name, time = COALESCE(?3, time)'
+        """
+        key = self.sql_table.upsert_key
+        if key is None:
+            return None
+
+        values = []
+        setters = []
+        for i, java_col in enumerate(self.eager_columns):
+            name = java_col.var_name
+            param = "?{}".format(i + 1)
+            default = java_col.current_default
+            if default is not None:
+                values.append("COALESCE({}, {})".format(param, default))
+                setters.append("{} = COALESCE({}, {})".format(name, param,
+                                                             name))
             else:
-                result = \
-                sep.join([result,
-                          "if ({1} != null) {{\n\
-            values.put({0}, {1});\n\
-        }} else {{\n\
-            values.putNull({0});\n\
-        }}".format(java_col.const_name,
-                   java_col.var_name)])
+                values.append(param)
+                if (name != "_id" and name not in key and
+                    not java_col.column.is_derived):
+                    setters.append("{0} = excluded.{0}".format(name))
+
+        if len(setters) > 0:
+            action = "UPDATE SET " + ", ".join(setters)
+        else:
+            action = "NOTHING"
+
+        return "INSERT INTO {} ({}) VALUES ({}) ON CONFLICT ({}) DO {}"\
+               .format(self.sql_table.name,
+                       ",".join([x.var_name for x in self.eager_columns]),
+                       ",".join(values),
+                       ",".join(key),
+                       action)
+
+    @property
+    def upsert_key_sql(self):
+        """Looks up the _id of an upserted row when the upsert is keyed
+        on a Unique constraint. None if keyed on _id.
+
+        >>> t = Table('Person').add_cols(Column('name').text.not_null)\
+.add_constraints(Unique('name')).upsert_on('name')
+        >>> DBItem(t, "com.ex").upsert_key_sql
+        'SELECT _id FROM Person WHERE name IS ?'
+        """
+        key = self.sql_table.upsert_key
+        if key is None or key == ('_id',):
+            return None
+        return "SELECT _id FROM {} WHERE {}"\
+               .format(self.sql_table.name,
+                       " AND ".join(["{} IS ?".format(k) for k in key]))
+
+    @property
+    def upsert(self):
+        if self.sql_table.upsert_key is None:
+            return ""
+
+        java_cols = self.eager_columns
+        bind_all = "\n        ".join([java_col.bind_statement(i + 1)
+                                      for i, java_col in enumerate(java_cols)])
+        bind_key = ""
+        key_sql = self.upsert_key_sql
+        if key_sql is None:
+            key_sql = "null"
+        else:
+            key_sql = '"{}"'.format(key_sql)
+            by_name = dict((x.var_name, x) for x in java_cols)
+            bind_key = "\n        ".join(
+                [by_name[k].bind_statement(i + 1)
+                 for i, k in enumerate(self.sql_table.upsert_key)])
+            bind_key = UPSERT_KEY_TEMPLATE.format(bind_key=bind_key)
+
+        return UPSERT_TEMPLATE.format(upsert_sql=self.upsert_sql,
+                                      upsert_key_sql=key_sql,
+                                      bind_all=bind_all,
+                                      bind_key=bind_key)
+
+    @property
+    def query_by_id(self):
+        """SQL which fetches the FIELDS projection of a single row.
+
+        >>> t = Table('Person').add_cols(Column('name').text)
+        >>> DBItem(t, "com.ex").query_by_id
+        'SELECT _id,name FROM Person WHERE _id IS ?'
+        """
+        return "SELECT {} FROM {} WHERE _id IS ?{}"\
+               .format(",".join([x.var_name for x in self.eager_columns]),
+                       self.sql_table.name, self.not_deleted)
+
+    @property
+    def query_exists(self):
+        """
+        >>> DBItem(Table('Person'), "com.ex").query_exists
+        'SELECT EXISTS (SELECT 1 FROM Person WHERE _id IS ?)'
+        """
+        return "SELECT EXISTS (SELECT 1 FROM {} WHERE _id IS ?{})"\
+               .format(self.sql_table.name, self.not_deleted)
+
+    @property
+    def not_deleted(self):
+        """Condition which primary key lookups add, so that rows marked
+        deleted by soft deletes are not found
+
+        >>> DBItem(Table('Note').soft_delete, "com.ex").query_exists
+        'SELECT EXISTS (SELECT 1 FROM Note WHERE _id IS ? AND deleted = 0)'
+        """
+        if getattr(self.sql_table, "soft_deletes", False):
+            return " AND deleted = 0"
+        return ""
+
+    @property
+    def heap_bytes(self):
+        """Rough size in bytes of one loaded item, with its object
+        header and eager fields. Narrower column types shrink it:
+
+        >>> wide = Table('Event').add_cols(Column('time').timestamp.not_null,
+        ...                                Column('done').integer.not_null,
+        ...                                Column('level').integer)
+        >>> DBItem(wide, "com.ex").heap_bytes
+        128
+        >>> narrow = Table('Event').add_cols(Column('time').epoch_millis.not_null,
+        ...                                  Column('done').as_boolean.not_null,
+        ...                                  Column('level').enum('LOW', 'HIGH'))
+        >>> DBItem(narrow, "com.ex").heap_bytes
+        32
+        """
+        # The base class holds the id
+        size = 8 + 8 + sum(x.heap_bytes for x in self.eager_columns
+                           if x.var_name != "_id")
+        return _aligned(size)
+
+    @property
+    def scalar_columns(self):
+        """Columns which can be read with a compiled statement, meaning
+        String and non-null long columns. The _id is excluded."""
+        return [x for x in self.eager_columns
+                if x.var_name != "_id" and x.java_type in ("String", "long")]
+
+    @property
+    def queries(self):
+        """Constant SQL strings for primary key lookups. Using the
+        exact same string every time lets the connection reuse its
+        compiled statement instead of parsing the SQL again.
+
+        >>> t = Table('Person').add_cols(Column('name').text)
+        >>> print(DBItem(t, "com.ex").queries)
+        public static final String QUERY_BY_ID =
+                "SELECT _id,name FROM Person WHERE _id IS ?";
+            public static final String QUERY_EXISTS =
+                "SELECT EXISTS (SELECT 1 FROM Person WHERE _id IS ?)";
+            public static final String QUERY_NAME_BY_ID =
+                "SELECT name FROM Person WHERE _id IS ?";
+        """
+        queries = [QUERY_CONST_TEMPLATE.format("QUERY_BY_ID",
+                                               self.query_by_id),
+                   QUERY_CONST_TEMPLATE.format("QUERY_EXISTS",
+                                               self.query_exists)]
+        for java_col in self.scalar_columns + self.lazy_columns:
+            sql = "SELECT {} FROM {} WHERE _id IS ?{}"\
+                  .format(java_col.var_name, self.sql_table.name,
+                          self.not_deleted)
+            queries.append(QUERY_CONST_TEMPLATE\
+                           .format(java_col.query_const_name, sql))
+        return "\n    ".join(queries)
+
+    @property
+    def fts(self):
+        """The TableFTS3 searching this table, or None"""
+        return getattr(self.sql_table, "fts", None)
+
+    @property
+    def search(self):
+        """Full text search statements, if the table has a TableFTS3.
+        They match in the fts table and join back on the _id.
+
+        >>> t = Table('Note').add_cols(Column('text').text).fts3('text')
+        >>> print(DBItem(t, "com.ex").search) # doctest: +ELLIPSIS
+        <BLANKLINE>
+            // Full text search, see DatabaseHandler.searchNoteItems
+            public static final String FTS_TABLE = "Note_fts3";
+        ...
+            public static final String SEARCH =
+                "SELECT Note._id,Note.text FROM Note_fts3 JOIN Note ON Note._id = Note_fts3.docid WHERE Note_fts3 MATCH ?1 LIMIT ?2";
+        ...
+        """
+        fts = self.fts
+        if fts is None:
+            return ""
+        columns = [x.var_name for x in self.eager_columns]
+        where = self.not_deleted.replace(" deleted",
+                                         " {}.deleted".format(fts.tablename))
+        create = ['"{}"'.format('"\n        +"'.join(stmt.split('\n')))
+                  for stmt in fts.stmts]
+        return SEARCH_TEMPLATE.format(classname=self.classname,
+                                      fts=fts,
+                                      create_fts=",\n        ".join(create),
+                                      search=fts.search_sql(columns,
+                                                            where=where),
+                                      search_ranked=fts.search_sql(columns,
+                                                                   True,
+                                                                   where))
+
+    @property
+    def soft_delete(self):
+        """Statement which purges a batch of rows marked deleted, and
+        the values deletes write instead.
+
+        >>> print(DBItem(Table('Note').soft_delete, "com.ex").soft_delete)
+        <BLANKLINE>
+            // Deletes only mark rows, see DatabaseHandler.purgeNoteItems
+            public static final String PURGE =
+                "DELETE FROM Note WHERE _id IN (SELECT _id FROM Note WHERE deleted = 1 LIMIT ?)";
+        <BLANKLINE>
+            // Reads of DatabaseHandler leave out rows marked deleted
+            public static String notDeleted(final String selection) {
+                if (selection == null || selection.isEmpty()) {
+                    return "deleted = 0";
+                }
+                return "(" + selection + ") AND deleted = 0";
+            }
+        <BLANKLINE>
+            @Override
+            public ContentValues getSoftDeleteContent() {
+                final ContentValues values = new ContentValues();
+                values.put(COL_DELETED, 1);
+                return values;
+            }
+        <BLANKLINE>
+        """
+        if not getattr(self.sql_table, "soft_deletes", False):
+            return ""
+        return SOFT_DELETE_TEMPLATE.format(classname=self.classname,
+                                           table=self.sql_table.name)
+
+    @property
+    def indexes(self):
+        """Statements which create the indexes of the table
+
+        >>> from db_table import Index
+        >>> t = Table('Note').add_cols(Column('title').text)\
+.add_indexes(Index('ix_note_title').on('title'))
+        >>> print(DBItem(t, "com.ex").indexes)
+        <BLANKLINE>
+        <BLANKLINE>
+            public static final String[] CREATE_INDEXES = {
+                "CREATE INDEX ix_note_title ON Note (title)"
+            };
+        """
+        indexes = getattr(self.sql_table, "indexes", [])
+        if not indexes:
+            return ""
+        return INDEXES_TEMPLATE.format(indexes=",\n        ".join(
+            ['"{}"'.format(index) for index in indexes]))
+
+    @property
+    def extra_uris(self):
+        """Uris besides the table and its items, as (constant, path
+        appended to the table uri, mime type constant)
+
+        >>> DBItem(Table('Person'), "com.ex").extra_uris
+        [('COUNTCODE', 'count', 'TYPE_ITEM')]
+        """
+        uris = [("COUNTCODE", "count", "TYPE_ITEM")]
+        if self.fts is not None:
+            uris.append(("SEARCHCODE", "search", "TYPE_DIR"))
+        return uris
+
+    @property
+    def extra_codes(self):
+        return "".join(["\n    public static final int {} = {};"\
+                        .format(const, self._match_code(path))
+                        for const, path, _ in self.extra_uris])
+
+    @property
+    def extra_matchers(self):
+        return "".join([EXTRA_MATCHER_TEMPLATE.format(const, path)
+                        for const, path, _ in self.extra_uris])
+
+    @property
+    def aggregate_columns(self):
+        """Numeric columns which get min, max and sum aggregates in
+        the handler. Booleans, enums and the _id are left out."""
+        return [x for x in self.eager_columns
+                if x.var_name != "_id" and x.value_kind in AGGREGATE_TYPES]
 
+    @property
+    def to_content_values(self):
+        # Columns maintained by triggers are never written
+        no_id = [x for x in self.eager_columns
+                 if x.var_name != "_id" and not x.column.is_derived]
+        return "\n        ".join([x.content_put() for x in no_id])
 
-        return result
-#        return "\n        "\
-#                .join(["values.put({}, {});"\
-#                       .format(x.const_name, x.var_name) for x in no_id])
+    @property
+    def changed_content_values(self):
+        """Puts the columns whose bit is set in the dirty mask. The
+        bit of a column is its index in FIELDS."""
+        result = []
+        for i, java_col in enumerate(self.eager_columns):
+            if java_col.var_name == "_id" or java_col.column.is_derived:
+                continue
+            result.append(DIRTY_PUT_TEMPLATE.format(
+                i, java_col.content_put(indent="            ")))
+        return "\n        ".join(result)
+
+    @property
+    def tracking(self):
+        """Accessors and dirty mask of tables which track changes
+
+        >>> t = Table('Person').add_cols(Column('name').text.not_null)
+        >>> print(DBItem(t.track_changes, "com.ex").tracking)
+        <BLANKLINE>
+            // Bit i is set if FIELDS[i] has changed since the last write
+            private long dirty = 0;
+        <BLANKLINE>
+            public String getName() {
+                return name;
+            }
+        <BLANKLINE>
+            public void setName(final String name) {
+                this.name = name;
+                dirty |= 1L << 1;
+            }
+        <BLANKLINE>
+            @Override
+            public boolean tracksChanges() {
+                return true;
+            }
+        <BLANKLINE>
+            @Override
+            public ContentValues getChangedContent() {
+                final ContentValues values = new ContentValues(Long.bitCount(dirty));
+                if ((dirty & (1L << 1)) != 0) {
+                    values.put(COL_NAME, name);
+                }
+                return values;
+            }
+        <BLANKLINE>
+            @Override
+            public void clearChanges() {
+                dirty = 0;
+            }
+        <BLANKLINE>
+        """
+        if not self.sql_table.tracks_changes:
+            return ""
+
+        java_cols = self.eager_columns
+        if len(java_cols) > 64:
+            raise ValueError("Can not track changes of more than 64 columns")
+
+        accessors = "".join([ACCESSOR_TEMPLATE.format(col=x, bit=i)
+                             for i, x in enumerate(java_cols)
+                             if x.var_name != "_id"])
+        return TRACKING_TEMPLATE.format(
+            accessors=accessors,
+            changed_content_values=self.changed_content_values)
 
     @property
     def classname(self):
         return "{0.name}Item".format(self.sql_table)
 
+    def _match_code(self, uri):
+        if self.uri_codes is not None:
+            return str(self.uri_codes.code(self.classname, uri))
+        s = sha1(self.classname.encode("utf-8"))
+        s.update(uri.encode("utf-8"))
+        return "0x" + s.hexdigest()[:7]
+
     @property
     def baseurihash(self):
-        s = sha1(self.classname)
-        s.update("baseuri")
-        return "0x" + s.hexdigest()[:7]
+        return self._match_code("baseuri")
 
     @property
     def baseitemhash(self):
-        s = sha1(self.classname)
-        s.update("baseitem")
-        return "0x" + s.hexdigest()[:7]
+        return self._match_code("baseitem")
+
+    @property
+    def match_codes(self):
+        """The UriMatcher codes of this item as (constant, code)
+
+        >>> DBItem(Table('Person'), "com.ex").match_codes[:2]
+        [('BASEURICODE', '0x976bb9a'), ('BASEITEMCODE', '0xaf3449d')]
+        """
+        return [("BASEURICODE", self.baseurihash),
+                ("BASEITEMCODE", self.baseitemhash)] + \
+               [(const, self._match_code(path))
+                for const, path, _ in self.extra_uris]
+
+class ViewItem(DBItem):
+    """Generates a read-only class for a View with known columns.
+
+    >>> from db_table import View
+    >>> v = View('names').as_sql('SELECT _id, name FROM Person')\
+.with_cols(Column('name').text)
+    >>> ViewItem(v, "com.ex").classname
+    'namesItem'
+    """
+
+    read_only = True
+
+    def __init__(self, view, pkg, uri_codes=None):
+        if view._columns is None:
+            raise ValueError("Columns of view {} are not known, use\
+ select_join or View.with_cols".format(view.name))
+        DBItem.__init__(self, view, pkg, uri_codes=uri_codes)
+
+    def __repr__(self):
+        java_cols = self.eager_columns
+        return VIEW_CLASS_TEMPLATE.format(
+                view=self.sql_table,
+                pkg=self.pkg,
+                classname=self.classname,
+                baseurihash=self.baseurihash,
+                baseitemhash=self.baseitemhash,
+                column_constants="\n    ".join([x.declare_const
+                                                for x in java_cols]),
+                column_constants_list=", ".join([x.const_name
+                                                 for x in java_cols]),
+                column_vars="\n    ".join([x.declare_var for x in java_cols]),
+                column_field_from_cursor=self.column_field_from_cursor,
+                queries=self.queries,
+                extra_codes=self.extra_codes,
+                extra_matchers=self.extra_matchers)
+
 
 class JavaColumn(object):
     def __init__(self, sql_column):
@@ -119,6 +727,62 @@ class JavaColumn(object):
     def var_name(self):
         return self.column.name
 
+    @property
+    def method_name(self):
+        """Capitalized name, used in getters and setters"""
+        return self.var_name[0].upper() + self.var_name[1:]
+
+    @property
+    def is_nullable(self):
+        """Lazy columns are always nullable in java since they
+        might not have been loaded. The _id is never null."""
+        if self.var_name == "_id":
+            return False
+        return 'NOT NULL' not in self.column.constraint or self.column.is_lazy
+
+    @property
+    def repr(self):
+        """How the value is held in java. Columns without an explicit
+        representation get the default of their sql type."""
+        if self.column.java_repr is not None:
+            return self.column.java_repr
+        return DEFAULT_REPRS.get(self.column.type, "String")
+
+    @property
+    def enum_name(self):
+        """Name of the nested enum of an enum column"""
+        return self.method_name
+
+    @property
+    def values_const_name(self):
+        """Constant holding the values of the enum, since values()
+        copies the array on every call
+
+        >>> JavaColumn(Column('kind').enum('A', 'B')).cursor_get
+        'cursor.isNull({0}) ? null : KIND_VALUES[cursor.getInt({0})]'
+        """
+        return self.const_name[len("COL_"):] + "_VALUES"
+
+    @property
+    def declare_enum(self):
+        if self.repr != "enum":
+            return ""
+        return ENUM_TEMPLATE.format(self.enum_name,
+                                    ", ".join(self.column.enum_values),
+                                    self.values_const_name)
+
+    @property
+    def array_type(self):
+        """Primitive type used by columnar readers, None if the
+        column can not be read into a primitive array."""
+        if self.column.is_lazy:
+            return None
+        return ARRAY_TYPES.get(self.value_kind)
+
+    @property
+    def is_primitive(self):
+        return self.java_type in PRIMITIVE_BYTES
+
     @property
     def const_name(self):
         name = self.column.upper_name
@@ -127,50 +791,143 @@ class JavaColumn(object):
         return "COL_" + name
 
     @property
-    def java_type(self):
-        st = self.column.type
+    def current_default(self):
+        """The CURRENT_* keyword or the parenthesized expression this
+        column defaults to, if any. Such fields are null in java until
+        set, so the database fills in the default.
+
+        >>> JavaColumn(Column('t').epoch_millis.default_now_millis).current_default
+        "(CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER))"
+        """
+        constraint = self.column.constraint
+        start = constraint.find("DEFAULT ")
+        if start < 0:
+            return None
+        value = constraint[start + len("DEFAULT "):].strip()
+        if value.startswith("CURRENT_"):
+            return value.split()[0]
+        if value.startswith("("):
+            depth = 0
+            for i, char in enumerate(value):
+                depth += {"(": 1, ")": -1}.get(char, 0)
+                if depth == 0:
+                    return value[:i + 1]
+        return None
 
-        if 'NOT NULL' in self.column.constraint:
-            simple = True
-        else:
-            simple = False
-
-        if st == "INTEGER":
-            return "long" if simple else "Long"
-        elif st == "REAL":
-            return "float" if simple else "Float"
-        elif st == "TIMESTAMP":
-            return "String"
-        else:
-            return "String"
+    @property
+    def stored_value(self):
+        """Java expression of the non-null field as it is stored"""
+        if self.repr == "enum":
+            return "{}.ordinal()".format(self.var_name)
+        return self.var_name
+
+    def bind_statement(self, index):
+        """Java which binds this field to parameter index of a
+        SQLiteStatement named stmt."""
+        if self.var_name == "_id":
+            return BIND_ID_TEMPLATE.format(index)
+
+        method = BIND_METHODS[self.value_kind]
+        value = self.stored_value
+        if self.repr == "boolean":
+            value = "{} ? 1 : 0".format(self.var_name)
+
+        if self.is_primitive:
+            return "stmt.{}({}, {});".format(method, index, value)
+        return BIND_NULLABLE_TEMPLATE.format(index, self.var_name, method,
+                                             value)
+
+    @property
+    def query_const_name(self):
+        return "QUERY_" + self.const_name[len("COL_"):] + "_BY_ID"
+
+    @property
+    def java_type(self):
+        """Primitive type for non-null values, boxed otherwise.
+
+        >>> JavaColumn(Column('n').as_short.not_null).java_type
+        'short'
+        >>> JavaColumn(Column('n').as_short).java_type
+        'Short'
+        >>> JavaColumn(Column('kind').enum('A', 'B')).java_type
+        'Kind'
+        """
+        if self.repr == "enum":
+            return self.enum_name
+        primitive, boxed = JAVA_TYPES[self.repr]
+        if self.is_nullable or self.current_default is not None:
+            return boxed
+        return primitive
 
     @property
     def cursor_get(self):
-        # Double braces are converted to single braces at the end of
-        # function.
-        base = "cursor.get{0}({{0}})"
-
-        if ('NOT NULL' not in self.column.constraint
-            and self.column.name != "_id"):
-            base = "cursor.isNull({{0}}) ? null : cursor.get{0}({{0}})"
-
-        st = self.column.type
-
-        if st == "INTEGER":
-            return base.format("Long")
-        elif st == "REAL":
-            return base.format("Float")
-        elif st == "TIMESTAMP":
-            return base.format("String")
-        else:
-            return base.format("String")
+        """Java expression which reads the field from column {0} of
+        cursor.
+
+        >>> JavaColumn(Column('done').as_boolean.not_null).cursor_get
+        'cursor.getInt({0}) != 0'
+        """
+        # Enum names are substituted first, so escape the index
+        read = CURSOR_GETS[self.value_kind].format("{{0}}",
+                                                   self.values_const_name)
+
+        if self.is_nullable and self.column.name != "_id":
+            read = "cursor.isNull({{0}}) ? null : " + read
+
+        return read.format()
+
+    @property
+    def value_kind(self):
+        """How the value is read and written, like Long, Int, Boolean,
+        Enum or String. Used to pick cursor, parcel and stream methods."""
+        return VALUE_KINDS[self.repr]
 
+    @property
+    def parcel_write(self):
+        """Java which writes the non-null field to Parcel dest"""
+        if self.var_name == "_id":
+            return "dest.writeLong(getId());"
+        return PARCEL_METHODS[self.value_kind][0].format(self.var_name)
+
+    @property
+    def parcel_read(self):
+        """Java expression which reads the field from Parcel in"""
+        return PARCEL_METHODS[self.value_kind][1].format(
+            self.values_const_name)
+
+    @property
+    def data_write(self):
+        """Java which writes the non-null field to DataOutput out"""
+        if self.var_name == "_id":
+            return "out.writeLong(getId());"
+        return DATA_METHODS[self.value_kind][0].format(self.var_name)
+
+    @property
+    def data_read(self):
+        """Java expression which reads the field from DataInput in"""
+        return DATA_METHODS[self.value_kind][1].format(
+            self.values_const_name)
 
     @property
     def default_value(self):
+        """Initializer of the java field, from the column's default.
+
+        >>> JavaColumn(Column('done').as_boolean.default(1)).default_value
+        '= true'
+        >>> JavaColumn(Column('kind').enum('A', 'B').default(1)).default_value
+        '= Kind.B'
+        >>> JavaColumn(Column('w').real.default(0.5)).default_value
+        '= 0.5f'
+        >>> JavaColumn(Column('w').real.default(1)).default_value
+        '= 1f'
+        >>> JavaColumn(Column('w').real.as_double.default(1)).default_value
+        '= 1d'
+        >>> JavaColumn(Column('w').real.default('NULL')).default_value
+        '= null'
+        """
         if "PRIMARY KEY" in self.column.constraint:
             return "= -1" #_id columns should have a non-null invalid value
-        elif "CURRENT_" in self.column.constraint:
+        elif self.current_default is not None:
             return "= null"
         elif "DEFAULT" in self.column.constraint:
             val = self.column.constraint\
@@ -178,30 +935,448 @@ class JavaColumn(object):
                   .replace('NOT NULL', '')\
                   .replace('DEFAULT', '', 1)\
                   .replace("'", '"').strip()
+            if val.upper() == "NULL":
+                return "= null"
+            # Only numeric literals take a type suffix
+            numeric = NUMBER_RE.match(val) is not None
+            if self.repr == "boolean":
+                val = "false" if val in ("0", "0.0") else "true"
+            elif self.repr == "enum":
+                val = "{}.{}".format(self.enum_name,
+                                     self.column.enum_values[int(val)])
+            elif self.repr == "float" and numeric:
+                # Java does not box an int literal into a Float or Double
+                val += "f"
+            elif self.repr == "double" and numeric:
+                val += "d"
+            elif self.repr == "millis" and numeric:
+                val += "L"
             return "= {}".format(val)
         else:
             # No need to define a default value
             return ""
 
+    @property
+    def heap_bytes(self):
+        """Rough bytes used by this field of one loaded item, with 4
+        byte references and 16 byte boxes as on ART. Text and blobs
+        are counted as 16 characters or bytes, timestamps as the 19
+        characters of YYYY-MM-DD HH:MM:SS."""
+        if self.is_primitive:
+            return PRIMITIVE_BYTES[self.java_type]
+        elif self.repr == "enum":
+            # Constants are shared
+            return REFERENCE_BYTES
+        elif self.repr == "String":
+            length = 19 if self.column.type == "TIMESTAMP" else 16
+            # String object and its char array
+            return REFERENCE_BYTES + 24 + _aligned(12 + 2 * length)
+        elif self.repr == "byte[]":
+            return REFERENCE_BYTES + _aligned(12 + 16)
+        return REFERENCE_BYTES + 16
+
     @property
     def declare_var(self):
-        return "public {0.java_type} {0.var_name} {0.default_value}"\
-               .format(self).strip() + ";"
+        return self.declare_field("public")
+
+    def declare_field(self, visibility):
+        return "{1} {0.java_type} {0.var_name} {0.default_value}"\
+               .format(self, visibility).strip() + ";"
+
+    def content_put(self, indent="        "):
+        """Java which puts this field into ContentValues values"""
+        if self.current_default is not None:
+            # Left out so the database fills in the default
+            return "if ({1} != null) values.put({0}, {2});"\
+                   .format(self.const_name, self.var_name, self.stored_value)
+        elif not self.is_nullable:
+            return "values.put({0}, {1});".format(self.const_name,
+                                                  self.stored_value)
+        else:
+            return CONTENT_PUT_NULLABLE_TEMPLATE.format(self.const_name,
+                                                        self.var_name,
+                                                        indent,
+                                                        self.stored_value)
+
+def _aligned(size):
+    """Object sizes are rounded up to 8 bytes"""
+    return (size + 7) // 8 * 8
+
+REFERENCE_BYTES = 4
+
+# Java representation of each sql type, unless the column sets one
+DEFAULT_REPRS = {"INTEGER": "long",
+                 "REAL": "float",
+                 "BLOB": "byte[]"}
+
+# Primitive and boxed java type of each representation
+JAVA_TYPES = {"long": ("long", "Long"),
+              "millis": ("long", "Long"),
+              "int": ("int", "Integer"),
+              "short": ("short", "Short"),
+              "boolean": ("boolean", "Boolean"),
+              "float": ("float", "Float"),
+              "double": ("double", "Double"),
+              "String": ("String", "String"),
+              "byte[]": ("byte[]", "byte[]")}
+
+PRIMITIVE_BYTES = {"long": 8, "int": 4, "short": 2, "boolean": 1,
+                   "float": 4, "double": 8}
+
+VALUE_KINDS = {"long": "Long",
+               "millis": "Long",
+               "int": "Int",
+               "short": "Short",
+               "boolean": "Boolean",
+               "enum": "Enum",
+               "float": "Float",
+               "double": "Double",
+               "String": "String",
+               "byte[]": "Blob"}
+
+# Cursor read of column index {0}, {1} is the enum name
+CURSOR_GETS = {"Long": "cursor.getLong({0})",
+               "Int": "cursor.getInt({0})",
+               "Short": "cursor.getShort({0})",
+               "Boolean": "cursor.getInt({0}) != 0",
+               "Enum": "{1}[cursor.getInt({0})]",
+               "Float": "cursor.getFloat({0})",
+               "Double": "cursor.getDouble({0})",
+               "String": "cursor.getString({0})",
+               "Blob": "cursor.getBlob({0})"}
+
+BIND_METHODS = {"Long": "bindLong",
+                "Int": "bindLong",
+                "Short": "bindLong",
+                "Boolean": "bindLong",
+                "Enum": "bindLong",
+                "Float": "bindDouble",
+                "Double": "bindDouble",
+                "String": "bindString",
+                "Blob": "bindBlob"}
+
+# Java type of min and max, and of sum, by value kind
+AGGREGATE_TYPES = {"Long": ("Long", "long"),
+                   "Int": ("Long", "long"),
+                   "Short": ("Long", "long"),
+                   "Float": ("Double", "double"),
+                   "Double": ("Double", "double")}
+
+# Element type of columnar arrays
+ARRAY_TYPES = {"Long": "long",
+               "Int": "int",
+               "Short": "short",
+               "Float": "double",
+               "Double": "double"}
+
+NUMBER_RE = re.compile(r"^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$")
+
+ENUM_TEMPLATE = """
+    public enum {0} {{ {1} }}
+    private static final {0}[] {2} = {0}.values();
+"""
 
 COL_CONST_TEMPLATE = 'public static final String {0} = "{1}";'
 
+BIND_ID_TEMPLATE = """if (getId() > -1) {{
+            stmt.bindLong({0}, getId());
+        }} else {{
+            stmt.bindNull({0});
+        }}"""
+
+BIND_NULLABLE_TEMPLATE = """if ({1} != null) {{
+            stmt.{2}({0}, {3});
+        }} else {{
+            stmt.bindNull({0});
+        }}"""
+
+UPSERT_TEMPLATE = """
+    // Single statement upsert, used by DatabaseHandler.putItem
+    public static final String UPSERT =
+        "{upsert_sql}";
+
+    @Override
+    public String getUpsertSql() {{
+        return UPSERT;
+    }}
+
+    @Override
+    public String getUpsertKeySql() {{
+        return {upsert_key_sql};
+    }}
+
+    @Override
+    public void bindUpsert(final SQLiteStatement stmt) {{
+        {bind_all}
+    }}
+{bind_key}"""
+
+UPSERT_KEY_TEMPLATE = """
+    @Override
+    public void bindUpsertKey(final SQLiteStatement stmt) {{
+        {bind_key}
+    }}
+"""
+
+LAZY_FIELD_TEMPLATE = """    private {col.java_type} {col.var_name};
+    private boolean {col.var_name}Loaded = false;
+    private boolean {col.var_name}Changed = false;
+
+    /**
+     * Loads {col.var_name} from the database on first access.
+     */
+    public {col.java_type} get{col.method_name}(final DatabaseHandler handler) {{
+        if (!{col.var_name}Loaded && getId() > -1) {{
+            {col.var_name} = handler.get{classname}{col.method_name}(getId());
+        }}
+        {col.var_name}Loaded = true;
+        return {col.var_name};
+    }}
+
+    public void set{col.method_name}(final {col.java_type} {col.var_name}) {{
+        this.{col.var_name} = {col.var_name};
+        {col.var_name}Loaded = true;
+        {col.var_name}Changed = true;
+    }}
+"""
+
+LAZY_CONTENT_TEMPLATE = """if ({col.var_name}Changed) {{
+            if ({col.var_name} != null) {{
+                values.put({col.const_name}, {col.var_name});
+            }} else {{
+                values.putNull({col.const_name});
+            }}
+        }}"""
+
+LAZY_TEMPLATE = """
+    // Lazy columns are not part of FIELDS
+{fields}
+    @Override
+    public ContentValues getLazyContent() {{
+        final ContentValues values = new ContentValues();
+        {lazy_content}
+        return values;
+    }}
+
+    @Override
+    public void clearLazyContent() {{
+        {clear_lazy}
+    }}
+"""
+
+COLUMNAR_NULL_TEMPLATE = """if (cursor.isNull({1})) {{
+                    {0}Null.set(i);
+                }} else {{
+                    {2}
+                }}"""
+
+COLUMNAR_TEMPLATE = """
+    /**
+     * Numeric columns of many rows read into primitive arrays in one
+     * pass, without creating an item or boxed value per row. Nulls are
+     * marked in the matching BitSet.
+     */
+    public static class Columns {{
+        // For database projection so order is consistent
+        public static final String[] FIELDS = {{ {fields} }};
+
+        public final int size;
+        {declare}
+
+        public Columns(final Cursor cursor) {{
+            final int count = cursor.getCount();
+            {allocate}
+
+            int i = 0;
+            while (cursor.moveToNext()) {{
+                {read}
+                i++;
+            }}
+            size = i;
+        }}
+    }}
+"""
+
+CONTENT_PUT_NULLABLE_TEMPLATE = """if ({1} != null) {{
+{2}    values.put({0}, {3});
+{2}}} else {{
+{2}    values.putNull({0});
+{2}}}"""
+
+DIRTY_PUT_TEMPLATE = """if ((dirty & (1L << {0})) != 0) {{
+            {1}
+        }}"""
+
+ACCESSOR_TEMPLATE = """
+    public {col.java_type} get{col.method_name}() {{
+        return {col.var_name};
+    }}
+
+    public void set{col.method_name}(final {col.java_type} {col.var_name}) {{
+        this.{col.var_name} = {col.var_name};
+        dirty |= 1L << {bit};
+    }}
+"""
+
+TRACKING_TEMPLATE = """
+    // Bit i is set if FIELDS[i] has changed since the last write
+    private long dirty = 0;
+{accessors}
+    @Override
+    public boolean tracksChanges() {{
+        return true;
+    }}
+
+    @Override
+    public ContentValues getChangedContent() {{
+        final ContentValues values = new ContentValues(Long.bitCount(dirty));
+        {changed_content_values}
+        return values;
+    }}
+
+    @Override
+    public void clearChanges() {{
+        dirty = 0;
+    }}
+"""
+
+# Write and read methods of Parcel, by JavaColumn.value_kind
+PARCEL_METHODS = {"Long": ("dest.writeLong({});", "in.readLong()"),
+                  "Int": ("dest.writeInt({});", "in.readInt()"),
+                  "Short": ("dest.writeInt({});", "(short) in.readInt()"),
+                  "Boolean": ("dest.writeInt({} ? 1 : 0);",
+                              "in.readInt() != 0"),
+                  "Enum": ("dest.writeInt({}.ordinal());",
+                           "{}[in.readInt()]"),
+                  "Float": ("dest.writeFloat({});", "in.readFloat()"),
+                  "Double": ("dest.writeDouble({});", "in.readDouble()"),
+                  "String": ("dest.writeString({});", "in.readString()"),
+                  "Blob": ("dest.writeByteArray({});",
+                           "in.createByteArray()")}
+
+# Java which writes and reads a field with DataOutput/DataInput
+DATA_METHODS = {"Long": ("out.writeLong({});", "in.readLong()"),
+                "Int": ("out.writeInt({});", "in.readInt()"),
+                "Short": ("out.writeShort({});", "in.readShort()"),
+                "Boolean": ("out.writeBoolean({});", "in.readBoolean()"),
+                "Enum": ("out.writeInt({}.ordinal());",
+                         "{}[in.readInt()]"),
+                "Float": ("out.writeFloat({});", "in.readFloat()"),
+                "Double": ("out.writeDouble({});", "in.readDouble()"),
+                "String": ("writeString(out, {});", "readString(in)"),
+                "Blob": ("writeBlob(out, {});", "readBlob(in)")}
+
+SERIALIZATION_TEMPLATE = """
+    public void writeTo(final DataOutput out) throws IOException {{
+        {null_mask}
+        out.writeLong(nulls);
+        {data_write}
+    }}
+
+    public void readFrom(final DataInput in) throws IOException {{
+        final long nulls = in.readLong();
+        {data_read}
+    }}
+
+    @Override
+    public int describeContents() {{
+        return 0;
+    }}
+
+    @Override
+    public void writeToParcel(final Parcel dest, final int flags) {{
+        {null_mask}
+        dest.writeLong(nulls);
+        {parcel_write}
+    }}
+
+    private {classname}(final Parcel in) {{
+        super();
+        final long nulls = in.readLong();
+        {parcel_read}
+    }}
+
+    public static final Parcelable.Creator<{classname}> CREATOR =
+            new Parcelable.Creator<{classname}>() {{
+        public {classname} createFromParcel(final Parcel in) {{
+            return new {classname}(in);
+        }}
+
+        public {classname}[] newArray(final int size) {{
+            return new {classname}[size];
+        }}
+    }};
+"""
+
+SOFT_DELETE_TEMPLATE = """
+    // Deletes only mark rows, see DatabaseHandler.purge{classname}s
+    public static final String PURGE =
+        "DELETE FROM {table} WHERE _id IN (SELECT _id FROM {table} WHERE deleted = 1 LIMIT ?)";
+
+    // Reads of DatabaseHandler leave out rows marked deleted
+    public static String notDeleted(final String selection) {{
+        if (selection == null || selection.isEmpty()) {{
+            return "deleted = 0";
+        }}
+        return "(" + selection + ") AND deleted = 0";
+    }}
+
+    @Override
+    public ContentValues getSoftDeleteContent() {{
+        final ContentValues values = new ContentValues();
+        values.put(COL_DELETED, 1);
+        return values;
+    }}
+"""
+
+INDEXES_TEMPLATE = """
+
+    public static final String[] CREATE_INDEXES = {{
+        {indexes}
+    }};"""
+
+SEARCH_TEMPLATE = """
+    // Full text search, see DatabaseHandler.search{classname}s
+    public static final String FTS_TABLE = "{fts.name}";
+
+    // The fts table and the triggers which keep it up to date
+    public static final String[] CREATE_FTS = {{
+        {create_fts}
+    }};
+
+    public static final String SEARCH =
+        "{search}";
+
+    // Adds a snippet column after FIELDS, best matches first
+    public static final String SEARCH_RANKED =
+        "{search_ranked}";
+"""
+
+EXTRA_MATCHER_TEMPLATE = """
+        sURIMatcher.addURI(ItemProvider.AUTHORITY, TABLE_NAME + "/{1}", {0});"""
+
+QUERY_CONST_TEMPLATE = 'public static final String {0} =\n        "{1}";'
+
 CLASS_TEMPLATE = '''package {pkg};
 
 import android.content.ContentValues;
 import android.content.UriMatcher;
 import android.database.Cursor;
+import android.database.sqlite.SQLiteStatement;
 import android.net.Uri;
+import android.os.Parcel;
+import android.os.Parcelable;
+
+import java.io.DataInput;
+import java.io.DataOutput;
+import java.io.IOException;
+import java.util.BitSet;
 
 /**
  * Represents {table.name} in the database.
  *
  */
-public class {classname} extends DBItem {{
+public class {classname} extends DBItem{implements} {{
     public static final String TABLE_NAME = "{table.name}";
 
     public static Uri URI() {{
@@ -217,13 +1392,16 @@ public class {classname} extends DBItem {{
     public static final String[] FIELDS = {{ {column_constants_list} }};
 
     {column_vars}
-
+{enums}{tracking}{lazy}
+    // Primary key lookups
+    {queries}
+{upsert}{search}{soft_delete}
     public static final int BASEURICODE = {baseurihash};
-    public static final int BASEITEMCODE = {baseitemhash};
+    public static final int BASEITEMCODE = {baseitemhash};{extra_codes}
 
     public static void addMatcherUris(UriMatcher sURIMatcher) {{
         sURIMatcher.addURI(ItemProvider.AUTHORITY, TABLE_NAME, BASEURICODE);
-        sURIMatcher.addURI(ItemProvider.AUTHORITY, TABLE_NAME + "/#", BASEITEMCODE);
+        sURIMatcher.addURI(ItemProvider.AUTHORITY, TABLE_NAME + "/#", BASEITEMCODE);{extra_matchers}
     }}
 
     public static final String TYPE_DIR = "vnd.android.cursor.dir/vnd.{pkg}." + TABLE_NAME;
@@ -235,12 +1413,30 @@ public class {classname} extends DBItem {{
 
     public {classname}(final Cursor cursor) {{
         super();
+        readFrom(cursor);
+    }}
+
+    /**
+     * Fills this instance from the current row of the cursor,
+     * so it can be reused for many rows.
+     */
+    @Override
+    public void readFrom(final Cursor cursor) {{
         // Projection expected to match FIELDS array
         {column_field_from_cursor}
+        clearChanges();
     }}
 
+    public static final ItemPool.Factory<{classname}> FACTORY =
+            new ItemPool.Factory<{classname}>() {{
+        public {classname} create() {{
+            return new {classname}();
+        }}
+    }};
+{columnar}
+{serialization}
     public ContentValues getContent() {{
-        ContentValues values = new ContentValues();
+        ContentValues values = new ContentValues({column_count});
         {to_content_values}
 
         return values;
@@ -263,7 +1459,87 @@ public class {classname} extends DBItem {{
     }}
 
     public static final String CREATE_TABLE =
-"{sqltable}";
+"{sqltable}";{indexes}
+}}
+'''
+
+VIEW_CLASS_TEMPLATE = '''package {pkg};
+
+import android.content.ContentValues;
+import android.content.UriMatcher;
+import android.database.Cursor;
+import android.net.Uri;
+
+/**
+ * Represents the view {view.name} in the database. Read-only.
+ *
+ */
+public class {classname} extends DBItem {{
+    public static final String TABLE_NAME = "{view.name}";
+
+    public static Uri URI() {{
+        return Uri.withAppendedPath(
+            Uri.parse(ItemProvider.SCHEME
+                      + ItemProvider.AUTHORITY), TABLE_NAME);
+    }}
+
+    // Column names
+    {column_constants}
+
+    // For database projection so order is consistent
+    public static final String[] FIELDS = {{ {column_constants_list} }};
+
+    {column_vars}
+
+    // Primary key lookups
+    {queries}
+
+    public static final int BASEURICODE = {baseurihash};
+    public static final int BASEITEMCODE = {baseitemhash};{extra_codes}
+
+    public static void addMatcherUris(UriMatcher sURIMatcher) {{
+        sURIMatcher.addURI(ItemProvider.AUTHORITY, TABLE_NAME, BASEURICODE);
+        sURIMatcher.addURI(ItemProvider.AUTHORITY, TABLE_NAME + "/#", BASEITEMCODE);{extra_matchers}
+    }}
+
+    public static final String TYPE_DIR = "vnd.android.cursor.dir/vnd.{pkg}." + TABLE_NAME;
+    public static final String TYPE_ITEM = "vnd.android.cursor.item/vnd.{pkg}." + TABLE_NAME;
+
+    public {classname}() {{
+        super();
+    }}
+
+    public {classname}(final Cursor cursor) {{
+        super();
+        readFrom(cursor);
+    }}
+
+    @Override
+    public void readFrom(final Cursor cursor) {{
+        // Projection expected to match FIELDS array
+        {column_field_from_cursor}
+    }}
+
+    public ContentValues getContent() {{
+        throw new UnsupportedOperationException(
+                "View " + TABLE_NAME + " is read-only");
+    }}
+
+    public String getTableName() {{
+        return TABLE_NAME;
+    }}
+
+    public String[] getFields() {{
+        return FIELDS;
+    }}
+
+    public long getId() {{
+        return _id;
+    }}
+
+    public void setId(final long id) {{
+        _id = id;
+    }}
 }}
 '''
 
@@ -272,8 +1548,13 @@ DBITEM_CLASS = '''package {pkg};
 import android.content.Context;
 import android.content.ContentValues;
 import android.database.Cursor;
+import android.database.sqlite.SQLiteStatement;
 import android.net.Uri;
 
+import java.io.DataInput;
+import java.io.DataOutput;
+import java.io.IOException;
+
 public abstract class DBItem {{
     public static final String COL_ID = "_id";
 
@@ -283,6 +1564,12 @@ public abstract class DBItem {{
 
     public abstract ContentValues getContent();
 
+    /**
+     * Fills the item from the current row of a cursor
+     * with the FIELDS projection.
+     */
+    public abstract void readFrom(final Cursor cursor);
+
     public abstract String getTableName();
 
     public abstract long getId();
@@ -291,6 +1578,68 @@ public abstract class DBItem {{
 
     public abstract String[] getFields();
 
+    /**
+     * Single statement upsert with numbered parameters in
+     * FIELDS order, or null if the table has none.
+     */
+    public String getUpsertSql() {{
+        return null;
+    }}
+
+    /**
+     * Query which finds the _id of an upserted row, or null
+     * if the upsert is keyed on _id.
+     */
+    public String getUpsertKeySql() {{
+        return null;
+    }}
+
+    public void bindUpsert(final SQLiteStatement stmt) {{}}
+
+    public void bindUpsertKey(final SQLiteStatement stmt) {{}}
+
+    /**
+     * True if the item knows which columns have changed, so
+     * updates only write those.
+     */
+    public boolean tracksChanges() {{
+        return false;
+    }}
+
+    /**
+     * The columns changed since the last write. All columns
+     * unless the item tracks changes.
+     */
+    public ContentValues getChangedContent() {{
+        return getContent();
+    }}
+
+    /**
+     * Called after the item has been written.
+     */
+    public void clearChanges() {{}}
+
+    /**
+     * Changed lazy columns, which are written separately
+     * from getContent. Null if the table has none.
+     */
+    public ContentValues getLazyContent() {{
+        return null;
+    }}
+
+    /**
+     * Called after the lazy content has been written.
+     */
+    public void clearLazyContent() {{}}
+
+    /**
+     * Values which mark the row deleted, or null if deletes
+     * remove the row.
+     */
+    public ContentValues getSoftDeleteContent() {{
+        return null;
+    }}
+
     public Uri getUri() {{
         return Uri.withAppendedPath(getBaseUri(), Long.toString(getId()));
     }}
@@ -301,6 +1650,32 @@ public abstract class DBItem {{
                       + ItemProvider.AUTHORITY), getTableName());
     }}
 
+    /**
+     * Strings are written as length prefixed UTF-8 since
+     * writeUTF is limited to 64kB.
+     */
+    protected static void writeString(final DataOutput out,
+            final String value) throws IOException {{
+        writeBlob(out, value.getBytes("UTF-8"));
+    }}
+
+    protected static String readString(final DataInput in)
+            throws IOException {{
+        return new String(readBlob(in), "UTF-8");
+    }}
+
+    protected static void writeBlob(final DataOutput out,
+            final byte[] value) throws IOException {{
+        out.writeInt(value.length);
+        out.write(value);
+    }}
+
+    protected static byte[] readBlob(final DataInput in) throws IOException {{
+        final byte[] value = new byte[in.readInt()];
+        in.readFully(value);
+        return value;
+    }}
+
     public void notifyProvider(final Context context) {{
         try {{
             context.getContentResolver().notifyChange(getUri(), null, false);
@@ -312,3 +1687,63 @@ public abstract class DBItem {{
 
 }}
 '''
+
+ITEM_POOL_CLASS = '''package {pkg};
+
+import java.util.ArrayList;
+
+import android.database.Cursor;
+
+/**
+ * Reuses item instances, typically one pool per adapter, so reading
+ * rows while scrolling does not allocate a new item per row. Not
+ * thread safe.
+ *
+ * final ItemPool<PersonItem> pool =
+ *         new ItemPool<PersonItem>(PersonItem.FACTORY, 32);
+ * final PersonItem item = pool.obtain(cursor);
+ * ...
+ * pool.recycle(item);
+ */
+public class ItemPool<T extends DBItem> {{
+
+    public interface Factory<T> {{
+        T create();
+    }}
+
+    private final Factory<T> factory;
+    private final ArrayList<T> free;
+    private final int capacity;
+
+    public ItemPool(final Factory<T> factory, final int capacity) {{
+        this.factory = factory;
+        this.capacity = capacity;
+        this.free = new ArrayList<T>(capacity);
+    }}
+
+    /**
+     * Returns a recycled or new item filled from the
+     * current row of the cursor.
+     */
+    public T obtain(final Cursor cursor) {{
+        final T item;
+        if (free.isEmpty()) {{
+            item = factory.create();
+        }}
+        else {{
+            item = free.remove(free.size() - 1);
+        }}
+        item.readFrom(cursor);
+        return item;
+    }}
+
+    /**
+     * Gives the item back to the pool. It must not be used after this.
+     */
+    public void recycle(final T item) {{
+        if (free.size() < capacity) {{
+            free.add(item);
+        }}
+    }}
+}}
+'''
@@ -0,0 +1,235 @@
+"""Graph of the writes which triggers and foreign key cascades cause
+when a row is inserted, updated or deleted. Used to find cyclic
+trigger chains and the worst case number of rows a single write can
+turn into, before a schema change ships.
+
+How many rows a statement writes can not be known from the schema, so
+every write which might hit several rows (cascades, and statements
+which do not pick a single row by _id) is counted as children rows.
+
+>>> from db_table import Table, Column, ForeignKey, Trigger
+>>> artist = Table('Artist').add_cols(Column('name').text)
+>>> album = Table('Album').add_cols(Column('artist').integer)\
+.add_constraints(ForeignKey('artist').references('Artist').on_delete_cascade)
+>>> log = Trigger('tr_log').after.delete_on('Album')\
+.do_sql('INSERT INTO Log (album) VALUES (old._id)')
+
+>>> graph = DependencyGraph(children=10)
+>>> graph.add_tables(artist, album)
+>>> graph.add_triggers(log)
+>>> graph.fanout('Artist', 'DELETE')
+20
+>>> print(graph.report())
+Worst case rows written by one write:
+  DELETE on Artist: 20
+  DELETE on Album: 1
+>>> print(graph.dot())
+digraph schema {
+  "Artist" -> "Album" [label="DELETE: ON DELETE CASCADE"];
+  "Album" -> "Log" [label="DELETE: tr_log"];
+}
+>>> graph.check(max_rows=10)
+Traceback (most recent call last):
+...
+ValueError: DELETE on Artist writes up to 20 rows, more than 10
+"""
+
+from __future__ import print_function
+import re
+
+INSERT_RE = re.compile(r"^\s*(?:INSERT|REPLACE)(?:\s+OR\s+\w+)?\s+INTO\s+(\w+)"
+                       r"(.*)$", re.I | re.S)
+UPDATE_RE = re.compile(r"^\s*UPDATE(?:\s+OR\s+\w+)?\s+(\w+)\s+SET\s+(.*?)"
+                       r"(?:\s+WHERE\s+(.*))?$", re.I | re.S)
+DELETE_RE = re.compile(r"^\s*DELETE\s+FROM\s+(\w+)(?:\s+WHERE\s+(.*))?$",
+                       re.I | re.S)
+# A where clause which picks the single row of the triggering row
+SINGLE_ROW_RE = re.compile(r"\b(?:_id|docid|rowid)\s*(?:=|IS)\s*"
+                           r"(?:new|old)\.\w+", re.I)
+SET_COLUMN_RE = re.compile(r"(?:^|,)\s*(\w+)\s*=")
+
+
+class Edge(object):
+    """A write to target caused by a write to source"""
+
+    def __init__(self, source, event, target, target_event, rows, label,
+                 cols=None, update_cols=()):
+        self.source = source
+        self.event = event
+        self.target = target
+        self.target_event = target_event
+        # Estimated rows written per triggering row
+        self.rows = rows
+        self.label = label
+        # Columns set by a target UPDATE, None if unknown
+        self.cols = cols
+        # Columns an UPDATE of source must set to fire this edge
+        self.update_cols = update_cols
+
+    def fires_on(self, table, event, cols):
+        if (self.source, self.event) != (table, event):
+            return False
+        if event != "UPDATE" or not self.update_cols or cols is None:
+            return True
+        return bool(set(self.update_cols) & set(cols))
+
+
+def statement_writes(stmt, children):
+    """The (table, event, columns, rows) a trigger statement writes
+
+    >>> statement_writes("UPDATE Album SET count = count + 1 WHERE _id = new.album", 10)
+    ('Album', 'UPDATE', ['count'], 1)
+    >>> statement_writes("DELETE FROM Log WHERE album = old._id;", 10)
+    ('Log', 'DELETE', None, 10)
+    """
+    stmt = stmt.strip().rstrip(";")
+    match = INSERT_RE.match(stmt)
+    if match:
+        rows = 1 if re.search(r"\bVALUES\b", match.group(2), re.I) \
+               else children
+        return match.group(1), "INSERT", None, rows
+    match = UPDATE_RE.match(stmt)
+    if match:
+        where = match.group(3) or ""
+        rows = 1 if SINGLE_ROW_RE.search(where) else children
+        return (match.group(1), "UPDATE",
+                SET_COLUMN_RE.findall(match.group(2)), rows)
+    match = DELETE_RE.match(stmt)
+    if match:
+        where = match.group(2) or ""
+        rows = 1 if SINGLE_ROW_RE.search(where) else children
+        return match.group(1), "DELETE", None, rows
+    return None
+
+
+class DependencyGraph(object):
+    """Tables, triggers and foreign key cascades as a graph of writes.
+    children is the number of rows assumed for writes which can hit
+    more than one row."""
+
+    def __init__(self, children=10):
+        self.children = children
+        self.edges = []
+
+    def add_tables(self, *tables):
+        """Adds the foreign key cascades of the tables, and the
+        triggers of their full text search and cached aggregates"""
+        for table in tables:
+            for constraint in getattr(table, "_constraints", []):
+                case = getattr(constraint, "cascade_case", "")
+                if not case:
+                    continue
+                if case == "ON DELETE CASCADE":
+                    event, cols = "DELETE", None
+                else:
+                    event, cols = "UPDATE", [constraint.column_name]
+                self.edges.append(Edge(constraint.foreign_table, "DELETE",
+                                       table.name, event, self.children,
+                                       case, cols))
+            fts = getattr(table, "fts", None)
+            if fts is not None:
+                self.add_triggers(*fts.triggers)
+            self.add_triggers(*getattr(table, "cache_triggers", []))
+
+    def add_triggers(self, *triggers):
+        for trigger in triggers:
+            for stmt in trigger._body:
+                writes = statement_writes(stmt, self.children)
+                if writes is None:
+                    continue
+                target, event, cols, rows = writes
+                self.edges.append(Edge(trigger.table, trigger.event,
+                                       target, event, rows, trigger.name,
+                                       cols, trigger.update_cols))
+
+    def add_views(self, *views):
+        """Adds the triggers of materialized views"""
+        for view in views:
+            self.add_triggers(*view.triggers)
+
+    def _out(self, table, event, cols=None):
+        return [e for e in self.edges if e.fires_on(table, event, cols)]
+
+    def fanout(self, table, event, cols=None, _path=()):
+        """Worst case rows written because one row of table had event,
+        or float('inf') if the writes can loop."""
+        node = (table, event)
+        if node in _path:
+            return float('inf')
+        total = 0
+        for edge in self._out(table, event, cols):
+            total += edge.rows * (1 + self.fanout(edge.target,
+                                                  edge.target_event,
+                                                  edge.cols,
+                                                  _path + (node,)))
+        return total
+
+    @property
+    def sources(self):
+        """Every (table, event) which causes other writes"""
+        seen = []
+        for edge in self.edges:
+            if (edge.source, edge.event) not in seen:
+                seen.append((edge.source, edge.event))
+        return seen
+
+    def cycles(self):
+        """Chains of writes which lead back to where they started,
+        as lists of 'EVENT on table'
+
+        >>> from db_table import Trigger
+        >>> graph = DependencyGraph()
+        >>> graph.add_triggers(Trigger('tr_a').after.update_on('A')\
+.do_sql('UPDATE B SET x = 1 WHERE _id = new.b'),\
+Trigger('tr_b').after.update_on('B', 'x')\
+.do_sql('UPDATE A SET y = 2 WHERE _id = new.a'))
+        >>> graph.cycles()
+        [['UPDATE on A', 'UPDATE on B', 'UPDATE on A']]
+        >>> graph.fanout('A', 'UPDATE')
+        inf
+        """
+        found = []
+        def visit(table, event, cols, path):
+            node = (table, event)
+            if node in path:
+                cycle = path[path.index(node):] + [node]
+                names = ["{} on {}".format(e, t) for t, e in cycle]
+                if sorted(names[:-1]) not in [sorted(c[:-1]) for c in found]:
+                    found.append(names)
+                return
+            for edge in self._out(table, event, cols):
+                visit(edge.target, edge.target_event, edge.cols,
+                      path + [node])
+        for table, event in self.sources:
+            visit(table, event, None, [])
+        return found
+
+    def report(self):
+        lines = ["Worst case rows written by one write:"]
+        fanouts = [(self.fanout(t, e), t, e) for t, e in self.sources]
+        for rows, table, event in sorted(fanouts, key=lambda x: -x[0]):
+            lines.append("  {} on {}: {}".format(event, table, rows))
+        for cycle in self.cycles():
+            lines.append("Cycle: " + " -> ".join(cycle))
+        return "\n".join(lines)
+
+    def dot(self):
+        """The graph in the DOT language of graphviz"""
+        lines = ["digraph schema {"]
+        for edge in self.edges:
+            lines.append('  "{}" -> "{}" [label="{}: {}"];'\
+                         .format(edge.source, edge.target, edge.event,
+                                 edge.label))
+        lines.append("}")
+        return "\n".join(lines)
+
+    def check(self, max_rows):
+        """Raise a ValueError if writes can loop, or if one write can
+        turn into more than max_rows rows written"""
+        for cycle in self.cycles():
+            raise ValueError("Writes loop: " + " -> ".join(cycle))
+        for table, event in self.sources:
+            rows = self.fanout(table, event)
+            if rows > max_rows:
+                raise ValueError("{} on {} writes up to {} rows, more than {}"\
+                                 .format(event, table, rows, max_rows))
@@ -7,15 +7,25 @@ be added to the Manifest.
 
 import os, errno
 import dbitem
-from dbitem import DBItem
-from database_handler import DatabaseHandler
+from dbitem import DBItem, ViewItem
+from database_handler import DatabaseHandler, schema_fingerprint
 from database_triggers import DatabaseTriggers
 from database_views import DatabaseViews
 from provider import Provider
+from dependency_graph import DependencyGraph
+from render_cache import RenderCache
+from database_asset import DatabaseAsset
+from profiler import Profile
+from sql_validator import SQLTester
 
 class Generator(object):
+    # RenderCache used by all generators, see watch
+    render_cache = None
 
-    def __init__(self, srcdir, pkg):
+    def __init__(self, srcdir, pkg, parcelable=False, uri_codes=None,
+                 max_writes=None, fingerprint=False, analyze_rows=None,
+                 sample_data=None, cache=None, asset_data=None,
+                 asset_dir=None, profile=None):
         """Need to specify srcdir and pkg. Srcdir
         is the directory where your java files lives.
         If srcdir is /projectdir/src for example,
@@ -29,9 +39,64 @@ class Generator(object):
 
         To just see what the output is before you write to the
         final location, you can pass srcdir='./' and pkg='sample'
-        for example"""
+        for example
+
+        Give parcelable=True to make the generated items Parcelable
+        and serializable with writeTo/readFrom.
+
+        uri_codes is the path of a json file where the UriMatcher codes
+        are kept. Keep it with your project so the codes stay the same
+        between generations. Without it the codes are still dense, but
+        assigned in the order tables and views are added, so they may
+        change when that order does.
+
+        If max_writes is given, write fails with a ValueError when the
+        triggers and foreign key cascades can loop, or can turn a
+        single write into more than max_writes rows written. See
+        dependency_graph for the report and a DOT graph.
+
+        Give fingerprint=True to not touch the permanent triggers and
+        views on every open. A checksum of the schema is stored in the
+        database, they are recreated when it changes, and temporary
+        objects are created in a single transaction. Declare triggers
+        and views on your own tables without .temp then, they cost
+        nothing on open.
+
+        Give analyze_rows to run ANALYZE with SQLTester over that many
+        synthetic rows per table, or over the rows of sample_data (lists
+        of dicts by table name), and ship the resulting statistics in
+        onCreate. Fresh installs then get the query plans of a filled
+        database.
+
+        cache is a RenderCache shared by writes, which then only render
+        the tables that changed and only write the files that changed.
+        Generators made without one use Generator.render_cache, which
+        watch mode sets.
+
+        asset_data gives reference data to ship with the app, as csv or
+        json files (or lists of dicts) by table name. The database is
+        then built with it into asset_dir, which defaults to the assets
+        directory next to srcdir, and copied into place on first open.
+        See DatabaseAsset.
+
+        profile is a Profile, which write fills with the time spent per
+        phase and per table. See profiler for the report."""
         self.srcdir = srcdir
         self.pkg = pkg
+        self.parcelable = parcelable
+        self.uri_codes = uri_codes
+        self.max_writes = max_writes
+        self.fingerprint = fingerprint
+        self.analyze_rows = analyze_rows
+        self.sample_data = sample_data
+        self.cache = cache if cache is not None else Generator.render_cache
+        self.asset_data = asset_data
+        if asset_dir is None:
+            # src/main/java and src/main/assets
+            asset_dir = os.path.join(os.path.dirname(os.path.normpath(srcdir)),
+                                     "assets")
+        self.asset_dir = asset_dir
+        self.profile = profile
         self.tables = []
         self.triggers = []
         self.views = []
@@ -48,63 +113,158 @@ class Generator(object):
     def add_views(self, *views):
         self.views.extend(views)
 
+    @property
+    def dependency_graph(self):
+        """The writes caused by the triggers and cascades of the schema"""
+        graph = DependencyGraph()
+        graph.add_tables(*self.tables)
+        graph.add_triggers(*self.triggers)
+        graph.add_views(*self.views)
+        return graph
+
+    def analyze(self):
+        """The sqlite_stat1 rows of the tables filled with sample data,
+        see SQLTester.analyze"""
+        tester = SQLTester()
+        tester.add_tables(*self.tables)
+        return tester.analyze(rows=self.analyze_rows or 1000,
+                              data=self.sample_data)
+
     def write(self):
+        profile = self.profile if self.profile is not None \
+                  else Profile(enabled=False)
+        profile.start()
+        try:
+            self._write_all(profile)
+        finally:
+            profile.stop()
+
+    def _write_all(self, profile):
+        if self.max_writes is not None:
+            with profile.phase("validate"):
+                self.dependency_graph.check(self.max_writes)
+
         mkdir_p(self.path)
+        cache = self.cache if self.cache is not None else RenderCache()
 
-        db_handler = DatabaseHandler("SampleDB", pkg=self.pkg)
-        provider = Provider(classname="ItemProvider", pkg=self.pkg)
+        provider = Provider(classname="ItemProvider", pkg=self.pkg,
+                            uri_codes=self.uri_codes)
 
-        db_triggers = DatabaseTriggers(pkg=self.pkg)
-        db_triggers.add(*self.triggers)
+        with profile.phase("schema"):
+            db_triggers = DatabaseTriggers(pkg=self.pkg)
+            db_triggers.add(*self.triggers)
 
-        db_views = DatabaseViews(pkg=self.pkg)
-        db_views.add(*self.views)
+            db_views = DatabaseViews(pkg=self.pkg)
+            db_views.add(*self.views)
+            for view in self.views:
+                # Materialized views are kept up to date by triggers
+                db_triggers.add(*view.triggers)
+            for table in self.tables:
+                # And so are counts and sums of children
+                db_triggers.add(*table.cache_triggers)
+
+            fingerprint = None
+            if self.fingerprint:
+                indexes = [i for table in self.tables for i in table.indexes]
+                fingerprint = schema_fingerprint(self.tables + indexes +
+                                                 db_triggers.triggers +
+                                                 self.views)
+        stats = None
+        if self.analyze_rows or self.sample_data:
+            with profile.phase("analyze"):
+                stats = cache.render(("analyze",
+                                      cache.definition(self.tables),
+                                      self.analyze_rows,
+                                      cache.definition(self.sample_data)),
+                                     self.analyze)
+        db_handler = DatabaseHandler("SampleDB", pkg=self.pkg,
+                                     fingerprint=fingerprint, stats=stats,
+                                     cache=cache,
+                                     asset="SampleDB" if self.asset_data
+                                     else None,
+                                     profile=profile)
 
         # Generate dbitem files
         for table in self.tables:
-            item = DBItem(table, pkg=self.pkg)
-            filename = item.classname + ".java"
-            fpath = os.path.join(self.path, filename)
-            with open(fpath, 'w') as javafile:
-                javafile.write(str(item))
-
-            # Add to other classes
-            db_handler.add_dbitems(item)
-            provider.add_dbitems(item)
-
-        # Abstract DBItem
-        fpath = os.path.join(self.path,
-                             "DBItem.java")
-        with open(fpath, 'w') as javafile:
-            javafile.write(dbitem.DBITEM_CLASS.format(pkg=self.pkg))
+            with profile.phase("render_item", table.name):
+                item = DBItem(table, pkg=self.pkg, parcelable=self.parcelable,
+                              uri_codes=provider.uri_codes)
+                key = ("item", cache.definition(table), self.pkg,
+                       self.parcelable, tuple(item.match_codes))
+                content = cache.render(key, lambda: str(item))
 
-        # Triggers
-        fpath = os.path.join(self.path,
-                             "DatabaseTriggers.java")
-        with open(fpath, 'w') as javafile:
-            javafile.write(str(db_triggers))
+                # Add to other classes
+                db_handler.add_dbitems(item)
+                provider.add_dbitems(item)
+            with profile.phase("io", table.name):
+                self._write(cache, item.classname + ".java", content)
 
-        # Views
-        fpath = os.path.join(self.path,
-                             "DatabaseViews.java")
-        with open(fpath, 'w') as javafile:
-            javafile.write(str(db_views))
+        # Read-only items of views with known columns
+        for view in self.views:
+            if view._columns is None:
+                continue
+            with profile.phase("render_item", view.name):
+                item = ViewItem(view, pkg=self.pkg,
+                                uri_codes=provider.uri_codes)
+                key = ("view", cache.definition(view), self.pkg,
+                       tuple(item.match_codes))
+                content = cache.render(key, lambda: str(item))
 
-        # Database handler
-        fpath = os.path.join(self.path,
-                             db_handler.classname + ".java")
-        with open(fpath, 'w') as javafile:
-            javafile.write(str(db_handler))
+                db_handler.add_dbitems(item)
+                provider.add_dbitems(item)
+            with profile.phase("io", view.name):
+                self._write(cache, item.classname + ".java", content)
 
-        # Provider
-        fpath = os.path.join(self.path,
-                             provider.classname + ".java")
-        with open(fpath, 'w') as javafile:
-            javafile.write(str(provider))
+        classes = [
+            # Abstract DBItem
+            ("render_dbitem", "DBItem.java",
+             lambda: dbitem.DBITEM_CLASS.format(pkg=self.pkg)),
+            # Pool of reusable items
+            ("render_dbitem", "ItemPool.java",
+             lambda: dbitem.ITEM_POOL_CLASS.format(pkg=self.pkg)),
+            ("render_triggers", "DatabaseTriggers.java",
+             lambda: str(db_triggers)),
+            ("render_views", "DatabaseViews.java", lambda: str(db_views)),
+            ("render_handler", db_handler.classname + ".java",
+             lambda: str(db_handler)),
+            ("render_provider", provider.classname + ".java",
+             lambda: str(provider))]
+        for phase, filename, render in classes:
+            with profile.phase(phase):
+                content = render()
+            with profile.phase("io"):
+                self._write(cache, filename, content)
+
+        with profile.phase("io"):
+            provider.uri_codes.save()
+        cache.finish()
+
+        if self.asset_data:
+            with profile.phase("asset"):
+                self.build_asset(fingerprint)
 
         # And print manifest stuff
         self.print_manifest(provider)
 
+    def build_asset(self, fingerprint):
+        """Build the prepopulated database into asset_dir"""
+        asset = DatabaseAsset(os.path.join(self.asset_dir, "SampleDB"))
+        asset.add_tables(*self.tables)
+        asset.add_triggers(*self.triggers)
+        asset.add_views(*self.views)
+        for table_name, source in sorted(self.asset_data.items()):
+            asset.add_data(table_name, source)
+        return asset.build(fingerprint=fingerprint)
+
+    def _write(self, cache, filename, content):
+        """Write a generated file, unless the cache knows it already
+        has that content"""
+        fpath = os.path.join(self.path, filename)
+        if cache.unchanged(fpath, content):
+            return
+        with open(fpath, 'w') as javafile:
+            javafile.write(content)
+
     def print_manifest(self, provider):
         """Print necessary manifest entries"""
         print("Make sure your AndroidManifest.xml contains the following:")
@@ -0,0 +1,156 @@
+"""Where the time of a Generator.write goes, by phase and by table
+
+>>> profile = Profile()
+>>> with profile.phase("render_item", "Person"):
+...     pass
+>>> with profile.phase("io", "Person"):
+...     pass
+>>> sorted(profile.report()["tables"]["Person"])
+['io', 'render_item', 'total']
+>>> print(profile.summary()) # doctest: +ELLIPSIS
+Generated in ... ms
+...
+Slowest tables:
+  Person ...
+
+Give Generator a Profile to fill, then save the JSON report:
+
+    profile = Profile(memory=True, cprofile="write.prof")
+    g = Generator(srcdir, pkg, profile=profile)
+    g.write()
+    print(profile.summary())
+    profile.save("write.json")
+
+Phases with a dot, like render_handler.getters, are part of the phase
+before the dot. memory=True takes tracemalloc snapshots (python 3.4+)
+for the memory allocated by each phase and the largest allocation
+sites. cprofile is a path the cProfile stats of the write are dumped
+to, for pstats or a viewer like snakeviz.
+"""
+from __future__ import print_function, division
+import json
+import time
+from contextlib import contextmanager
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+_timer = getattr(time, "perf_counter", time.time)
+
+class Profile(object):
+
+    def __init__(self, memory=False, cprofile=None, enabled=True):
+        if memory and tracemalloc is None:
+            raise ValueError("Memory profiles need tracemalloc, python 3.4+")
+        self.memory = memory
+        self.cprofile = cprofile
+        self.enabled = enabled
+        self.total = 0.0
+        # Seconds by phase, and by phase by table name
+        self.phases = {}
+        self.tables = {}
+        # Bytes allocated and peak by phase
+        self.allocated = {}
+        self.top_allocations = []
+        self._start = None
+        self._profiler = None
+
+    def start(self):
+        if not self.enabled:
+            return
+        if self.memory:
+            tracemalloc.start()
+        if self.cprofile:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._start = _timer()
+
+    def stop(self):
+        if not self.enabled or self._start is None:
+            return
+        self.total += _timer() - self._start
+        self._start = None
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.cprofile)
+            self._profiler = None
+        if self.memory:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self.top_allocations = [
+                {"where": "{}:{}".format(stat.traceback[0].filename,
+                                         stat.traceback[0].lineno),
+                 "bytes": stat.size, "count": stat.count}
+                for stat in snapshot.statistics("lineno")[:10]]
+
+    @contextmanager
+    def phase(self, name, table=None):
+        """Time the block as phase name, of table if given"""
+        if not self.enabled:
+            yield
+            return
+        if self.memory and tracemalloc.is_tracing():
+            before = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, "reset_peak"):
+                # Python 3.9, before that the peak is of the whole write
+                tracemalloc.reset_peak()
+        start = _timer()
+        try:
+            yield
+        finally:
+            elapsed = _timer() - start
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+            if table is not None:
+                timings = self.tables.setdefault(table, {})
+                timings[name] = timings.get(name, 0.0) + elapsed
+            if self.memory and tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                memory = self.allocated.setdefault(name, {"allocated": 0,
+                                                          "peak": 0})
+                memory["allocated"] += current - before
+                memory["peak"] = max(memory["peak"], peak - before)
+
+    def report(self):
+        """Everything measured, as a dict which can be dumped as json"""
+        tables = {}
+        for table, timings in self.tables.items():
+            tables[table] = dict(timings)
+            tables[table]["total"] = sum(timings.values())
+        report = {"total": self.total, "phases": dict(self.phases),
+                  "tables": tables}
+        if self.memory:
+            report["memory"] = self.allocated
+            report["top_allocations"] = self.top_allocations
+        if self.cprofile:
+            report["cprofile"] = self.cprofile
+        return report
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    def summary(self, slowest=10):
+        """The phases and the slowest tables, in milliseconds"""
+        report = self.report()
+        lines = ["Generated in {:.1f} ms".format(report["total"] * 1000)]
+        for name in sorted(self.phases, key=self.phases.get, reverse=True):
+            line = "  {:<24} {:8.1f} ms".format(name, self.phases[name] * 1000)
+            if name in self.allocated:
+                line += "  {:8.1f} kB".format(
+                    self.allocated[name]["allocated"] / 1024)
+            lines.append(line)
+        tables = sorted(report["tables"].items(),
+                        key=lambda item: item[1]["total"], reverse=True)
+        if tables:
+            lines.append("Slowest tables:")
+        for table, timings in tables[:slowest]:
+            parts = ", ".join("{} {:.1f}".format(name, timings[name] * 1000)
+                              for name in sorted(timings, key=timings.get,
+                                                 reverse=True)
+                              if name != "total")
+            lines.append("  {:<24} {:8.1f} ms  ({})".format(
+                table, timings["total"] * 1000, parts))
+        return "\n".join(lines)
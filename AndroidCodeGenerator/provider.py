@@ -12,22 +12,109 @@
              Unique('albumname').on_conflict_replace)
 
 >>> p = Provider("MyProvider", pkg)
->>> p.add_dbitems(DBItem(t, pkg))
+>>> p.add_dbitems(DBItem(t, pkg, uri_codes=p.uri_codes))
 """
 
+import json
+import os
 from dbitem import DBItem
 from database_handler import DatabaseHandler
 
+class UriCodes(object):
+    """Assigns dense UriMatcher codes, so the switches in the provider
+    compile to a tableswitch. Codes are persisted in a json file if
+    a path is given, which keeps them stable when tables are added or
+    reordered. Codes of removed tables are not reused.
+
+    >>> codes = UriCodes()
+    >>> codes.code("PersonItem", "baseuri")
+    1
+    >>> codes.code("PersonItem", "baseitem")
+    2
+    >>> codes.code("PersonItem", "baseuri")
+    1
+    >>> codes.codes = {"PersonItem/baseuri": 1, "AlbumItem/baseuri": 1}
+    >>> codes.check()
+    Traceback (most recent call last):
+    ...
+    ValueError: Match code 1 is used by both AlbumItem/baseuri and PersonItem/baseuri
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.codes = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.codes = json.load(f)
+            self.check()
+
+    def check(self):
+        """Raise a ValueError if two uris share a code"""
+        seen = {}
+        for key in sorted(self.codes):
+            code = self.codes[key]
+            if code in seen:
+                raise ValueError("Match code {} is used by both {} and {}"\
+                                 .format(code, seen[code], key))
+            seen[code] = key
+
+    def code(self, classname, uri):
+        key = "{}/{}".format(classname, uri)
+        if key not in self.codes:
+            self.codes[key] = max([0] + list(self.codes.values())) + 1
+        return self.codes[key]
+
+    def save(self):
+        if self.path is None:
+            return
+        with open(self.path, 'w') as f:
+            json.dump(self.codes, f, indent=2, sort_keys=True,
+                      separators=(',', ': '))
+            f.write("\n")
+
+
 class Provider(object):
-    def __init__(self, classname, pkg):
-        """Must specify pkg and classname"""
+    def __init__(self, classname, pkg, uri_codes=None):
+        """Must specify pkg and classname. uri_codes is the path of a
+        json file where match codes are kept, see UriCodes. Give the
+        uri_codes attribute to the DBItems."""
         self.pkg = pkg
         self.classname = classname
         self.dbitems = []
+        self.uri_codes = UriCodes(uri_codes)
+        # Names of the uris by match code, of the items added so far
+        self._codes = {}
 
     def add_dbitems(self, *items):
+        for item in items:
+            self._check_codes(item, self._codes)
         self.dbitems.extend(items)
 
+    def check_codes(self):
+        """Raise a ValueError if two uris share a match code, which
+        can happen with hashed codes.
+
+        >>> from db_table import Table
+        >>> p = Provider("MyProvider", "com.ex")
+        >>> p.add_dbitems(DBItem(Table('Person'), "com.ex"),\
+                          DBItem(Table('Person'), "com.ex"))
+        Traceback (most recent call last):
+        ...
+        ValueError: Match code 0x976bb9a of PersonItem.BASEURICODE collides with PersonItem.BASEURICODE
+        """
+        seen = {}
+        for item in self.dbitems:
+            self._check_codes(item, seen)
+
+    @staticmethod
+    def _check_codes(item, seen):
+        for const, code in item.match_codes:
+            name = "{}.{}".format(item.classname, const)
+            if int(code, 0) in seen:
+                raise ValueError("Match code {} of {} collides with {}"\
+                                 .format(code, name, seen[int(code, 0)]))
+            seen[int(code, 0)] = name
+
     @property
     def match_uris(self):
         result = "\n        "\
@@ -41,17 +128,45 @@ class Provider(object):
         #for item in self.dbitems:
         result = "".join([MATCH_TYPE_TEMPLATE\
                           .format(classname=item.classname) for item in self.dbitems])
+        result += "".join([MATCH_TYPE_EXTRA_TEMPLATE\
+                           .format(classname=item.classname, code=const,
+                                   mime=mime)
+                           for item in self.dbitems
+                           for const, _, mime in item.extra_uris])
         return result
 
     @property
     def match_query(self):
-        return "".join([MATCH_QUERY_TEMPLATE.format(classname=item.classname)\
-                          for item in self.dbitems])
+        result = ""
+        for item in self.dbitems:
+            if item.read_only:
+                template = MATCH_QUERY_VIEW_TEMPLATE
+            else:
+                template = MATCH_QUERY_TEMPLATE
+            result += template.format(classname=item.classname)
+            if item.read_only:
+                notify_uri = "Uri.parse(SCHEME + AUTHORITY)"
+            else:
+                notify_uri = item.classname + ".URI()"
+            result += MATCH_COUNT_TEMPLATE.format(classname=item.classname,
+                                                  notify_uri=notify_uri)
+            if item.fts is not None:
+                result += MATCH_SEARCH_TEMPLATE.format(classname=item.classname)
+        return result
 
     @property
     def delete_cases(self):
-        return "".join([DELETE_CASE_TEMPLATE.format(classname=item.classname)\
-                        for item in self.dbitems])
+        result = ""
+        for item in self.dbitems:
+            if item.read_only:
+                continue
+            if item.sql_table.soft_deletes:
+                mark = MARK_DELETED_TEMPLATE.format(classname=item.classname)
+            else:
+                mark = ""
+            result += DELETE_CASE_TEMPLATE.format(classname=item.classname,
+                                                  mark_deleted=mark)
+        return result
 
     def __repr__(self):
       return PROVIDER_TEMPLATE.format(provider=self)
@@ -88,6 +203,45 @@ MATCH_QUERY_TEMPLATE = """
             break;
 """
 
+MATCH_TYPE_EXTRA_TEMPLATE = """
+        case {classname}.{code}:
+            return {classname}.{mime};"""
+
+# One row with the number of matching rows in column _count
+MATCH_COUNT_TEMPLATE = """
+        case {classname}.COUNTCODE:
+            result = handler.count{classname}sCursor(selection, args);
+            result.setNotificationUri(getContext().getContentResolver(),
+                    {notify_uri});
+            break;
+"""
+
+# Search with content://AUTHORITY/table/search?q=query&limit=10&ranked=true
+MATCH_SEARCH_TEMPLATE = """
+        case {classname}.SEARCHCODE:
+            result = handler.search{classname}sCursor(searchQuery(uri),
+                    queryLimit(uri), "true".equals(uri.getQueryParameter("ranked")));
+            result.setNotificationUri(getContext().getContentResolver(),
+                    {classname}.URI());
+            break;
+"""
+
+# Views change when any of their tables do, so their cursors
+# observe every uri of the provider.
+MATCH_QUERY_VIEW_TEMPLATE = """
+        case {classname}.BASEITEMCODE:
+            id = Long.parseLong(uri.getLastPathSegment());
+            result = handler.get{classname}Cursor(id);
+            result.setNotificationUri(getContext().getContentResolver(),
+                    Uri.parse(SCHEME + AUTHORITY));
+            break;
+        case {classname}.BASEURICODE:
+            result = handler.getAll{classname}sCursor(selection, args, sortOrder);
+            result.setNotificationUri(getContext().getContentResolver(),
+                    Uri.parse(SCHEME + AUTHORITY));
+            break;
+"""
+
 DELETE_CASE_TEMPLATE = """
         case {classname}.BASEITEMCODE:
             table = {classname}.TABLE_NAME;
@@ -95,19 +249,28 @@ DELETE_CASE_TEMPLATE = """
                 sb.append(" AND ");
             }}
             sb.append({classname}.COL_ID + " IS ?");
-            args.add(uri.getLastPathSegment());
-            // Alternative is this
-            // values.put({classname}.COL_DELETED, 1);
+            args.add(uri.getLastPathSegment());{mark_deleted}
+            break;
+        case {classname}.BASEURICODE:
+            // Every row matching the selection, in one statement
+            table = {classname}.TABLE_NAME;{mark_deleted}
             break;
 """
 
+# Soft deletes update the rows instead
+MARK_DELETED_TEMPLATE = """
+            values.put({classname}.COL_DELETED, 1);"""
+
 PROVIDER_TEMPLATE = """
 package {provider.pkg};
 
+import java.util.ArrayList;
+
 import android.content.ContentProvider;
 import android.content.ContentValues;
 import android.content.UriMatcher;
 import android.database.Cursor;
+import android.database.sqlite.SQLiteDatabase;
 import android.net.Uri;
 
 public class {provider.classname} extends ContentProvider {{
@@ -153,11 +316,15 @@ public class {provider.classname} extends ContentProvider {{
         final SQLiteDatabase db = DatabaseHandler.getInstance(getContext())
                 .getWritableDatabase();
         final String[] argArray = new String[args.size()];
-        final int result = db.delete(table, sb.toString(),
-                args.toArray(argArray));
-        // Or alternatively
-        //final int result = db.update(table, values, sb.toString(),
-        //        args.toArray(argArray));
+        final int result;
+        if (values.size() > 0) {{
+            result = db.update(table, values, sb.toString(),
+                    args.toArray(argArray));
+        }}
+        else {{
+            result = db.delete(table, sb.toString(),
+                    args.toArray(argArray));
+        }}
 
         if (result > 0) {{
             // Support upload sync
@@ -203,5 +370,18 @@ public class {provider.classname} extends ContentProvider {{
 
         return result;
     }}
+
+    private static String searchQuery(final Uri uri) {{
+        final String query = uri.getQueryParameter("q");
+        if (query == null) {{
+            throw new IllegalArgumentException("Missing search query q in " + uri);
+        }}
+        return query;
+    }}
+
+    private static int queryLimit(final Uri uri) {{
+        final String limit = uri.getQueryParameter("limit");
+        return limit == null ? -1 : Integer.parseInt(limit);
+    }}
 }}
 """
@@ -0,0 +1,93 @@
+"""Rendered code kept between writes of a Generator, so that watch mode
+only renders again what changed. Entries are keyed on the definitions
+of the objects they were rendered from.
+"""
+
+import os
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+class RenderCache(object):
+    """Rendered classes and written files kept between writes. Entries
+    not used by a write are dropped when it finishes.
+
+    >>> cache = RenderCache()
+    >>> cache.render("a", lambda: "rendered")
+    'rendered'
+    >>> cache.render("a", lambda: "not called")
+    'rendered'
+    >>> cache.unchanged(os.devnull, "")
+    False
+    >>> cache.unchanged(os.devnull, "")
+    True
+    """
+
+    def __init__(self):
+        self.rendered = {}
+        self.files = {}
+        self.hits = 0
+        self._used = set()
+        # Definitions by id, valid until the write finishes
+        self._definitions = {}
+
+    def render(self, key, func):
+        self._used.add(key)
+        if key in self.rendered:
+            self.hits += 1
+        else:
+            self.rendered[key] = func()
+        return self.rendered[key]
+
+    def definition(self, obj):
+        """definition of obj, computed once per write"""
+        if id(obj) not in self._definitions:
+            self._definitions[id(obj)] = (obj, definition(obj))
+        return self._definitions[id(obj)][1]
+
+    def unchanged(self, path, content):
+        """True if content is what was last written to path, and the
+        file is still there"""
+        same = self.files.get(path) == content and os.path.exists(path)
+        self.files[path] = content
+        return same
+
+    def finish(self):
+        for key in list(self.rendered):
+            if key not in self._used:
+                del self.rendered[key]
+        self._used = set()
+        self._definitions = {}
+
+def definition(obj):
+    """Bytes which change when anything about obj does, pickled if
+    possible and a repr which also shows the attributes of objects
+    otherwise.
+
+    >>> from db_table import Table, Column
+    >>> a = Table('Note').add_cols(Column('done').integer)
+    >>> b = Table('Note').add_cols(Column('done').as_boolean)
+    >>> str(a) == str(b), definition(a) == definition(b)
+    (True, False)
+    >>> describe(a) == describe(b)
+    False
+    """
+    try:
+        return pickle.dumps(obj, 2)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return describe(obj)
+
+def describe(obj, _path=()):
+    if isinstance(obj, (list, tuple)):
+        return "[{}]".format(",".join(describe(x, _path) for x in obj))
+    if isinstance(obj, dict):
+        return "{{{}}}".format(",".join("{}:{}".format(k, describe(v, _path))
+                                        for k, v in sorted(obj.items())))
+    if hasattr(obj, "__dict__"):
+        if id(obj) in _path:
+            # Like an Index referring to its Table
+            return "<{}>".format(type(obj).__name__)
+        return "{}{}".format(type(obj).__name__,
+                             describe(vars(obj), _path + (id(obj),)))
+    return repr(obj)
@@ -0,0 +1,330 @@
+"""Micro-benchmarks which use python's sqlite3 as a stand-in for the
+sqlite found on the device. The absolute numbers say little about a
+phone, but the ratios between the alternatives give an idea of what
+the generated code saves.
+
+Run this file directly to print all the benchmarks:
+
+    python sql_benchmark.py
+
+>>> result = bench_pk_lookup(rows=50, lookups=50)
+>>> sorted(result.keys())
+['cached', 'uncached']
+"""
+from __future__ import print_function, division
+import sqlite3 as sql
+import random
+import time
+from db_table import Table, Column, ForeignKey, Index, creation_order
+from sql_validator import SQLTester
+from dbitem import DBItem
+from database_asset import DatabaseAsset
+
+def best_of(func, repeat=3):
+    '''Call func repeat times and return the fastest wall time
+    in seconds.'''
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def report(title, result, unit="ms", scale=1000):
+    '''Print the timings in result, relative to the largest one.
+    Give unit and scale to print other measures, like sizes.'''
+    print(title)
+    largest = max(result.values())
+    for name in sorted(result, key=result.get):
+        print("  {:<20} {:10.2f} {}  ({:.2f}x)".format(name,
+                                                    result[name] * scale,
+                                                    unit,
+                                                    largest / result[name]))
+
+def _person_db(rows, cached_statements=100):
+    con = sql.connect(':memory:', cached_statements=cached_statements)
+    con.execute("CREATE TABLE Person (_id INTEGER PRIMARY KEY,\
+ firstname TEXT NOT NULL, lastname TEXT NOT NULL, bio TEXT NOT NULL)")
+    con.executemany("INSERT INTO Person (firstname, lastname, bio)\
+ VALUES (?, ?, ?)", (("first{}".format(i), "last{}".format(i), "bio")
+                     for i in range(rows)))
+    con.commit()
+    return con
+
+def bench_pk_lookup(rows=10000, lookups=10000):
+    '''Primary key lookups by id, like get<Item>Cursor(id).
+
+    uncached: the statement is compiled for every lookup, which is
+    what happens when the connection has no statement cache.
+    cached: the same sql string is used every time and the compiled
+    statement is reused, like the generated QUERY_BY_ID constants.
+    '''
+    query = "SELECT _id,firstname,lastname,bio FROM Person WHERE _id IS ?"
+    ids = [random.randint(1, rows) for _ in range(lookups)]
+    result = {}
+    for name, cache in (("uncached", 0), ("cached", 100)):
+        con = _person_db(rows, cached_statements=cache)
+        def lookup():
+            for i in ids:
+                con.execute(query, (i,)).fetchone()
+        result[name] = best_of(lookup)
+        con.close()
+    return result
+
+def bench_put_item(rows=10000):
+    '''Putting items with preset ids and then updating them, with the
+    generated upsert and with the update-then-insert of putItem.'''
+    person = Table('Person').add_cols(Column('firstname').text.not_null,
+                                      Column('lastname').text.not_null,
+                                      Column('bio').text.not_null)
+    return SQLTester().test_upsert(person.upsert_on(), rows=rows)
+
+def _photo_db(rows, payload):
+    con = sql.connect(':memory:')
+    con.execute("CREATE TABLE Photo (_id INTEGER PRIMARY KEY,\
+ title TEXT NOT NULL, data BLOB)")
+    blob = bytes(bytearray(random.getrandbits(8) for _ in range(payload)))
+    con.executemany("INSERT INTO Photo (title, data) VALUES (?, ?)",
+                    (("title{}".format(i), sql.Binary(blob))
+                     for i in range(rows)))
+    con.commit()
+    return con
+
+def _db_size(con):
+    page_size = con.execute("PRAGMA page_size").fetchone()[0]
+    page_count = con.execute("PRAGMA page_count").fetchone()[0]
+    return page_size * page_count
+
+def bench_lazy_read(rows=2000, payload=64 * 1024):
+    '''Reading every row of a list, with a large blob in the projection
+    (eager) and without it like a lazy column.'''
+    con = _photo_db(rows, payload)
+    result = {}
+    for name, cols in (("eager", "_id,title,data"), ("lazy", "_id,title")):
+        query = "SELECT {} FROM Photo".format(cols)
+        result[name] = best_of(lambda: con.execute(query).fetchall())
+    con.close()
+    return result
+
+def bench_blob_storage(rows=2000, payload=4 * 1024):
+    '''Database size in bytes when binary data is stored in a BLOB
+    column, and when it is base64 encoded into a TEXT column.'''
+    import base64
+    con = _photo_db(rows, payload)
+    result = {"blob": _db_size(con)}
+    con.execute("CREATE TABLE Photo64 (_id INTEGER PRIMARY KEY,\
+ title TEXT NOT NULL, data TEXT)")
+    con.execute("DROP TABLE Photo")
+    blob = bytes(bytearray(random.getrandbits(8) for _ in range(payload)))
+    text = base64.b64encode(blob).decode("ascii")
+    con.executemany("INSERT INTO Photo64 (title, data) VALUES (?, ?)",
+                    (("title{}".format(i), text) for i in range(rows)))
+    con.commit()
+    con.execute("VACUUM")
+    result["base64_text"] = _db_size(con)
+    con.close()
+    return result
+
+def bench_search(rows=20000):
+    '''Searching a word in text columns with the generated full text
+    search, and with LIKE which scans the table.'''
+    note = Table('Note').add_cols(Column('title').text,
+                                  Column('body').text).fts3('title', 'body')
+    return SQLTester().test_search(note, rows=rows)
+
+def bench_item_memory(items=100000):
+    '''Estimated heap in bytes of loaded items, with the default java
+    types and with narrowed ones for the same columns.'''
+    wide = Table('Event').add_cols(Column('time').timestamp.not_null,
+                                   Column('done').integer.not_null,
+                                   Column('priority').integer.not_null,
+                                   Column('level').text,
+                                   Column('score').real)
+    narrow = Table('Event').add_cols(Column('time').epoch_millis.not_null,
+                                     Column('done').as_boolean.not_null,
+                                     Column('priority').as_short.not_null,
+                                     Column('level').enum('LOW', 'HIGH'),
+                                     Column('score').as_double)
+    return {"default": DBItem(wide, "com.ex").heap_bytes * items,
+            "narrowed": DBItem(narrow, "com.ex").heap_bytes * items}
+
+def _note_db(path, triggers, temp):
+    con = sql.connect(path, isolation_level=None)
+    con.execute("CREATE TABLE IF NOT EXISTS Note (_id INTEGER PRIMARY KEY,\
+ text TEXT)")
+    con.execute("CREATE TABLE IF NOT EXISTS Log (note INTEGER, text TEXT)")
+    return [("CREATE {} TRIGGER IF NOT EXISTS tr_log{} AFTER UPDATE ON Note\
+ WHEN new.text LIKE '%{}%' BEGIN INSERT INTO Log (note, text) VALUES\
+ (new._id, new.text); END").format(temp, i, i) for i in range(triggers)]
+
+def bench_open(triggers=40, opens=200):
+    '''Opening the database, like onOpen with triggers on Note.
+
+    temp_each_open: every trigger is a temporary one, created
+    statement by statement on every open. This is the default onOpen.
+    temp_in_transaction: the same, in a single transaction.
+    fingerprint: the triggers are permanent and created once. An open
+    only reads the stored schema fingerprint, like the generated
+    onOpen of Generator(fingerprint=True).
+    '''
+    import os, shutil, tempfile
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "open.db")
+    result = {}
+    try:
+        stmts = _note_db(path, triggers, "")
+        con = sql.connect(path, isolation_level=None)
+        for stmt in stmts:
+            con.execute(stmt)
+        con.execute("CREATE TABLE schema_fingerprint (_id INTEGER PRIMARY KEY,\
+ fingerprint INTEGER NOT NULL)")
+        con.execute("INSERT INTO schema_fingerprint VALUES (1, 42)")
+        con.close()
+        temp_stmts = _note_db(path, triggers, "TEMP")
+
+        def temp_each_open():
+            for _ in range(opens):
+                con = sql.connect(path, isolation_level=None)
+                for stmt in temp_stmts:
+                    con.execute(stmt)
+                con.close()
+
+        def temp_in_transaction():
+            for _ in range(opens):
+                con = sql.connect(path, isolation_level=None)
+                con.execute("BEGIN")
+                for stmt in temp_stmts:
+                    con.execute(stmt)
+                con.execute("COMMIT")
+                con.close()
+
+        def fingerprint():
+            for _ in range(opens):
+                con = sql.connect(path, isolation_level=None)
+                con.execute("BEGIN")
+                stored = con.execute("SELECT IFNULL(MAX(fingerprint), 0)\
+ FROM schema_fingerprint").fetchone()[0]
+                assert stored == 42
+                con.execute("COMMIT")
+                con.close()
+
+        for func in (temp_each_open, temp_in_transaction, fingerprint):
+            result[func.__name__] = best_of(func) / opens
+    finally:
+        shutil.rmtree(tmpdir)
+    return result
+
+def _schema_stmts(tables):
+    """DDL like the generated onCreate, for a chain of tables where
+    each one references the one before it"""
+    schema = []
+    for i in range(tables):
+        table = Table('T{}'.format(i)).add_cols(Column('name').text,
+                                                Column('value').integer)
+        if i > 0:
+            table.add_cols(Column('parent').integer)
+            table.add_constraints(ForeignKey('parent')\
+                                  .references('T{}'.format(i - 1))\
+                                  .on_delete_cascade)
+            table.add_indexes(Index('ix_t{}_parent'.format(i)).on('parent'))
+        schema.append(table)
+    random.Random(tables).shuffle(schema)
+    stmts = []
+    for table in creation_order(schema):
+        stmts.append("DROP TABLE IF EXISTS {}".format(table.name))
+        stmts.append(str(table))
+        stmts.extend(str(index) for index in table.indexes)
+    return stmts
+
+def bench_create_schema(tables=400):
+    '''Creating a fresh database with tables tables, ordered by their
+    foreign keys, like onCreate on first launch.
+
+    autocommit: every statement is its own transaction.
+    transaction: all of it in one transaction with deferred foreign
+    key checks, like the generated onCreate.
+    '''
+    import os, shutil, tempfile
+    stmts = _schema_stmts(tables)
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "create.db")
+    result = {}
+
+    def create(transaction):
+        def run():
+            if os.path.exists(path):
+                os.remove(path)
+            con = sql.connect(path, isolation_level=None)
+            con.execute("PRAGMA foreign_keys = ON")
+            if transaction:
+                con.execute("BEGIN")
+                con.execute("PRAGMA defer_foreign_keys = ON")
+            for stmt in stmts:
+                con.execute(stmt)
+            if transaction:
+                con.execute("COMMIT")
+            con.close()
+        return run
+
+    try:
+        result["autocommit"] = best_of(create(False))
+        result["transaction"] = best_of(create(True))
+    finally:
+        shutil.rmtree(tmpdir)
+    return result
+
+def bench_prepopulate(rows=5000):
+    '''Filling a database with reference data on first launch.
+
+    per_row: one insert per row in its own transaction, like putItem
+    of every item.
+    asset: building the whole database offline with DatabaseAsset,
+    which the app only copies.
+    '''
+    import os, shutil, tempfile
+    word = Table('Word').add_cols(Column('word').text.not_null,
+                                  Column('length').integer.not_null)
+    data = [{"word": "word{}".format(i), "length": i % 12}
+            for i in range(rows)]
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "words.db")
+    result = {}
+
+    def per_row():
+        if os.path.exists(path):
+            os.remove(path)
+        con = sql.connect(path, isolation_level=None)
+        con.execute(str(word))
+        for row in data:
+            con.execute("INSERT INTO Word (word, length) VALUES (?, ?)",
+                        (row["word"], row["length"]))
+        con.close()
+
+    def asset():
+        builder = DatabaseAsset(path)
+        builder.add_tables(word)
+        builder.add_data('Word', data)
+        builder.build()
+
+    try:
+        result["per_row"] = best_of(per_row, repeat=1)
+        result["asset"] = best_of(asset)
+    finally:
+        shutil.rmtree(tmpdir)
+    return result
+
+if __name__ == '__main__':
+    report("Primary key lookups", bench_pk_lookup())
+    report("Put items with preset ids", bench_put_item())
+    report("Read list of rows with 64kB blobs", bench_lazy_read())
+    report("Storing 4kB of binary data per row", bench_blob_storage(),
+           unit="kB", scale=1 / 1024)
+    report("Full text search of 20k rows", bench_search())
+    report("Heap of 100k loaded items", bench_item_memory(),
+           unit="kB", scale=1 / 1024)
+    report("Opening a database with 40 triggers", bench_open(),
+           unit="us", scale=1000000)
+    report("Creating 400 tables on first launch", bench_create_schema())
+    report("Loading 5k rows of reference data", bench_prepopulate())
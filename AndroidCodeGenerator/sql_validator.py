@@ -1,28 +1,87 @@
 from __future__ import print_function, division
 import sqlite3 as sql
 import os
+import random
+import re
+import time
+from functools import wraps
+from db_table import ForeignKey
+from dbitem import DBItem
 
 def clear_db(func):
     '''Removes the db-file before and after
     function call'''
+    @wraps(func)
     def _wrap(*args, **kwargs):
         try:
             os.remove('test.db')
         except OSError:
             pass
 
-        func(*args, **kwargs)
+        result = func(*args, **kwargs)
 
         try:
             os.remove('test.db')
         except OSError:
             pass
 
+        return result
+
     return _wrap
 
 def set_pragmas(cur):
     cur.execute("PRAGMA foreign_keys = ON;")
 
+def synthetic_value(column, i):
+    """A value for column in row i, distinct for every row.
+
+    >>> from db_table import Column
+    >>> synthetic_value(Column('age').integer, 3)
+    3
+    >>> synthetic_value(Column('name').text, 3)
+    'name3'
+    """
+    if column.type == "INTEGER":
+        return i
+    elif column.type == "REAL":
+        return i / 2
+    elif column.type == "TIMESTAMP":
+        return "2013-01-01 00:{:02d}:{:02d}".format((i // 60) % 60, i % 60)
+    else:
+        return "{}{}".format(column.name, i)
+
+def parameter_count(query):
+    """The number of parameters sqlite expects for query
+
+    >>> parameter_count("SELECT * FROM Note WHERE _id = ? OR title = ?")
+    2
+    >>> parameter_count("SELECT * FROM Note WHERE title MATCH ?1 LIMIT ?2")
+    2
+    """
+    numbered = [int(n) for n in re.findall(r"\?(\d+)", query)]
+    if numbered:
+        return max(numbered)
+    return query.count("?")
+
+def plan_table(detail):
+    """The table, or its alias, which a SCAN or SEARCH row of a query
+    plan reads. Before sqlite 3.36 the rows read SCAN TABLE name AS
+    alias, since then SCAN alias.
+
+    >>> plan_table("SCAN t2")
+    't2'
+    >>> plan_table("SCAN TABLE Album AS t2")
+    't2'
+    >>> plan_table("SEARCH TABLE Album USING AUTOMATIC COVERING INDEX (artist=?)")
+    'Album'
+    """
+    words = detail.split()[1:]
+    if words[0] == "TABLE":
+        words = words[1:]
+    if len(words) > 2 and words[1] == "AS":
+        return words[2]
+    return words[0]
+
 class SQLTester(object):
     """This class actually creates an sql database
     and tries to create all the tables and triggers
@@ -44,6 +103,13 @@ class SQLTester(object):
     def add_views(self, *views):
         self.views.extend(views)
 
+    @property
+    def view_triggers(self):
+        """Triggers which maintain materialized views and cached
+        aggregates"""
+        return [t for view in self.views for t in view.triggers] + \
+               [t for table in self.tables for t in table.cache_triggers]
+
     @clear_db
     def test_create(self):
         """Try creating all tables and triggers"""
@@ -56,11 +122,520 @@ class SQLTester(object):
             for table in self.tables:
                 print("\n", table)
                 cur.execute(str(table))
+                for index in table.indexes:
+                    print("\n", index)
+                    cur.execute(str(index))
 
             for view in self.views:
                 print("\n", view)
-                cur.execute(str(view))
+                for stmt in view.stmts:
+                    cur.execute(stmt)
 
-            for trigger in self.triggers:
+            for trigger in self.triggers + self.view_triggers:
                 print("\n", trigger)
                 cur.execute(str(trigger))
+
+    @clear_db
+    def test_view_plans(self):
+        """Ask sqlite for the query plan of a full select from every
+        view, and report the views which would scan a table inside the
+        join or build an automatic index for it. Both mean a join column
+        is not indexed. Returns the scanned tables by view name.
+
+        >>> from db_table import Table, Column, View, Join
+        >>> artist = Table('Artist').add_cols(Column('name').text)
+        >>> album = Table('Album').add_cols(Column('artist').text)
+        >>> v = View('albums').as_sql(Join(artist, ['name'])\
+.join(album, [], (('Artist', 'name'), ('Album', 'artist'))).select)
+        >>> s = SQLTester()
+        >>> s.add_tables(artist, album)
+        >>> s.add_views(v)
+        >>> s.test_view_plans()
+        View albums scans Album
+        {'albums': ['Album']}
+        """
+        con = sql.connect('test.db')
+        scans = {}
+        with con:
+            cur = con.cursor()
+            self._create_schema(cur)
+            for view in self.views:
+                # Plans name tables by their alias in the view
+                names = dict((alias or table, table) for table, alias in
+                             re.findall(r"(?:FROM|JOIN)\s+(\w+)"
+                                        r"(?:\s+AS\s+(\w+))?",
+                                        str(view)))
+                cur.execute("EXPLAIN QUERY PLAN SELECT * FROM {}"\
+                            .format(view.name))
+                details = [row[-1] for row in cur.fetchall()
+                           if row[-1].startswith(("SCAN", "SEARCH"))]
+                scanned = []
+                # The outermost loop reads every row anyway
+                for detail in details[1:]:
+                    words = detail.split()
+                    if words[0] == "SCAN" or "AUTOMATIC" in words:
+                        table = plan_table(detail)
+                        scanned.append(names.get(table, table))
+                if scanned:
+                    print("View {} scans {}".format(view.name,
+                                                    ", ".join(scanned)))
+                    scans[view.name] = scanned
+        con.close()
+        return scans
+
+    @clear_db
+    def test_index_plans(self):
+        """Ask sqlite for the query plan of the queries of every index,
+        and report the ones which do not use their index. A covering
+        index must be used as a covering index. Returns the unused
+        queries by index name.
+
+        >>> from db_table import Table, Column, Index
+        >>> note = Table('Note').add_cols(Column('title').text).soft_delete\
+.add_indexes(Index('ix_note_title').on('lower(title)')\
+.where('deleted = 0').covering,\
+Index('ix_note_live').on('title').where('deleted = 0')\
+.used_by('SELECT _id FROM Note WHERE title = ?'))
+        >>> s = SQLTester()
+        >>> s.add_tables(note)
+        >>> s.test_index_plans()
+        Index ix_note_live is not used by: SELECT _id FROM Note WHERE title = ?
+        {'ix_note_live': ['SELECT _id FROM Note WHERE title = ?']}
+        """
+        con = sql.connect('test.db')
+        unused = {}
+        with con:
+            cur = con.cursor()
+            self._create_schema(cur)
+            for table in self.tables:
+                for index in table.indexes:
+                    kind = "COVERING INDEX" if index.is_covering else "INDEX"
+                    used = re.compile(r"\b{} {}\b".format(kind, index.name))
+                    for query in index.queries:
+                        cur.execute("EXPLAIN QUERY PLAN " + query,
+                                    [None] * parameter_count(query))
+                        if any(used.search(row[-1]) for row in cur.fetchall()):
+                            continue
+                        print("Index {} is not used by: {}".format(index.name,
+                                                                   query))
+                        unused.setdefault(index.name, []).append(query)
+        con.close()
+        return unused
+
+    @clear_db
+    def analyze(self, rows=1000, data=None):
+        """Fill the tables, run ANALYZE and return the rows of
+        sqlite_stat1 as (table, index, stat), for DatabaseHandler to
+        ship. data holds sample rows as lists of dicts by table name,
+        other tables get synthetic rows. Synthetic foreign keys
+        reference a tenth as many parents, and booleans and enums
+        repeat their values, so the statistics are not all unique.
+        Only tables and their indexes are created.
+
+        >>> from db_table import Table, Column, ForeignKey, Index
+        >>> note = Table('Note').add_cols(Column('title').text,\
+Column('list').integer).add_constraints(ForeignKey('list')\
+.references('List')).add_indexes(Index('ix_note_list').on('list'))
+        >>> SQLTester().analyze(rows=100, data={'List': [{'_id': 1}]})
+        []
+        >>> s = SQLTester()
+        >>> s.add_tables(Table('List'), note)
+        >>> s.analyze(rows=100, data={'List': [{'_id': 1}]})
+        [('List', None, '1'), ('Note', 'ix_note_list', '100 10')]
+        """
+        data = data or {}
+        con = sql.connect('test.db')
+        with con:
+            cur = con.cursor()
+            for table in self.tables:
+                cur.execute(str(table))
+                for index in table.indexes:
+                    cur.execute(str(index))
+
+            for table in self.tables:
+                sample = data.get(table.name)
+                if sample is None:
+                    sample = [self._sample_row(table, i, rows)
+                              for i in range(rows)]
+                for row in sample:
+                    names = sorted(row)
+                    cur.execute("INSERT INTO {} ({}) VALUES ({})"\
+                                .format(table.name, ", ".join(names),
+                                        ", ".join("?" * len(names))),
+                                [row[name] for name in names])
+
+            cur.execute("ANALYZE")
+            cur.execute("SELECT tbl, idx, stat FROM sqlite_stat1\
+ ORDER BY tbl, idx")
+            stats = [tuple(None if value is None else str(value)
+                           for value in row) for row in cur.fetchall()]
+        con.close()
+        return stats
+
+    @staticmethod
+    def _sample_row(table, i, rows):
+        references = [c.column_name for c in table._constraints
+                      if isinstance(c, ForeignKey)]
+        row = {}
+        for col in table._columns[1:]:
+            if col.is_derived:
+                continue
+            if col.name in references:
+                row[col.name] = 1 + i % max(1, rows // 10)
+            elif col.enum_values:
+                row[col.name] = i % len(col.enum_values)
+            elif col.java_repr == "boolean":
+                row[col.name] = i % 2
+            else:
+                row[col.name] = synthetic_value(col, i)
+        return row
+
+    def _create_schema(self, cur, *extra_tables):
+        tables = self.tables + [t for t in extra_tables
+                                if t not in self.tables]
+        for stmt in tables:
+            cur.execute(str(stmt))
+        for table in tables:
+            for index in table.indexes:
+                cur.execute(str(index))
+        for view in self.views:
+            for stmt in view.stmts:
+                cur.execute(stmt)
+        for trigger in self.triggers + self.view_triggers:
+            cur.execute(str(trigger))
+        for table in tables:
+            if table.fts is not None:
+                for stmt in table.fts.stmts:
+                    cur.execute(stmt)
+
+    @clear_db
+    def test_upsert(self, table, rows=1000):
+        """Verify the upsert generated for table. New items are put,
+        then put again with changed values the way putItem would
+        (with their _id if the upsert is keyed on _id, as new items
+        otherwise). The row count and ids must be unchanged and the
+        values updated. The table is created along with the others
+        if it was not added. Foreign keys are not enforced since the
+        values are synthetic.
+
+        If the upsert is keyed on _id, the returned dict holds the
+        seconds taken by the upsert and by update-then-insert to put
+        rows items with preset ids and then update them.
+
+        >>> from db_table import Table, Column, Unique
+        >>> t = Table('Person').add_cols(Column('name').text.not_null,\
+Column('age').integer).add_constraints(Unique('name').on_conflict_replace)
+        >>> SQLTester().test_upsert(t.upsert_on('name'), rows=10)
+        {}
+        >>> sorted(SQLTester().test_upsert(t.upsert_on(), rows=10))
+        ['update_insert', 'upsert']
+        """
+        item = DBItem(table, pkg="")
+        upsert_sql = item.upsert_sql
+        upsert_key_sql = item.upsert_key_sql
+        if upsert_sql is None:
+            raise ValueError("{} has no upsert key".format(table.name))
+
+        # Lazy columns are not part of the upsert
+        cols = [c for c in table._columns[1:] if not c.is_lazy]
+        names = [c.name for c in cols]
+        key = table.upsert_key
+        update_sql = "UPDATE {} SET {} WHERE _id IS ?"\
+                     .format(table.name,
+                             ", ".join(["{} = ?".format(c.name)
+                                        for c in cols]))
+        insert_sql = "INSERT INTO {} ({}) VALUES ({})"\
+                     .format(table.name,
+                             ",".join(["_id"] + names),
+                             ",".join("?" * (len(cols) + 1)))
+
+        def values(i, changed):
+            return [synthetic_value(c, i + rows
+                                    if changed and c.name not in key else i)
+                    for c in cols]
+
+        def upsert(cur, _id, vals):
+            cur.execute(upsert_sql, [_id] + vals)
+            if _id is not None:
+                return _id
+            if upsert_key_sql is None:
+                return cur.lastrowid
+            by_name = dict(zip(names, vals))
+            cur.execute(upsert_key_sql, [by_name[k] for k in key])
+            return cur.fetchone()[0]
+
+        def update_insert(cur, _id, vals):
+            cur.execute(update_sql, vals + [_id])
+            if cur.rowcount < 1:
+                cur.execute(insert_sql, [_id] + vals)
+
+        con = sql.connect('test.db')
+        with con:
+            cur = con.cursor()
+            self._create_schema(cur, table)
+
+            ids = [upsert(cur, None, values(i, False)) for i in range(rows)]
+            for i, _id in enumerate(ids):
+                again = upsert(cur, _id if key == ('_id',) else None,
+                               values(i, True))
+                assert again == _id, "Upsert changed _id {}".format(_id)
+
+            cur.execute("SELECT {} FROM {} ORDER BY _id"\
+                        .format(",".join(names), table.name))
+            assert [list(r) for r in cur.fetchall()] == \
+                   [values(i, True) for i in range(rows)], \
+                   "Upsert did not update the values"
+        con.close()
+
+        timings = {}
+        if key != ('_id',):
+            return timings
+
+        for name, put in (("upsert", upsert),
+                          ("update_insert", update_insert)):
+            os.remove('test.db')
+            con = sql.connect('test.db')
+            with con:
+                cur = con.cursor()
+                self._create_schema(cur, table)
+                start = time.time()
+                for changed in (False, True):
+                    for i in range(rows):
+                        put(cur, i + 1, values(i, changed))
+                timings[name] = time.time() - start
+            con.close()
+        return timings
+
+    @clear_db
+    def test_search(self, table, rows=2000, words=30, queries=20):
+        """Fill the searchable columns of table with synthetic text,
+        then verify that the generated full text search finds the same
+        rows as LIKE '%word%' on the table. The table is created with
+        the others if it was not added.
+
+        Returns the seconds taken by queries searches with MATCH and
+        with LIKE.
+
+        >>> from db_table import Table, Column
+        >>> t = Table('Note').add_cols(Column('title').text,\
+Column('body').text.not_null).fts3('title', 'body')
+        >>> sorted(SQLTester().test_search(t, rows=50, queries=2))
+        ['like', 'match']
+        """
+        fts = table.fts
+        if fts is None:
+            raise ValueError("{} has no fts3 columns".format(table.name))
+
+        # Fixed width words, so LIKE does not match within other words
+        rand = random.Random(rows)
+        vocabulary = ["w{:04d}".format(i) for i in range(1000)]
+        def text():
+            return " ".join(rand.choice(vocabulary) for _ in range(words))
+
+        cols = table._columns[1:]
+        insert_sql = "INSERT INTO {} ({}) VALUES ({})"\
+                     .format(table.name, ",".join(c.name for c in cols),
+                             ",".join("?" * len(cols)))
+        match_sql = fts.search_sql(["_id"])
+        like_sql = "SELECT _id FROM {} WHERE {} LIMIT ?2"\
+                   .format(table.name,
+                           " OR ".join("{} LIKE ?1".format(col)
+                                       for col in fts.cols))
+        terms = [rand.choice(vocabulary) for _ in range(queries)]
+
+        con = sql.connect('test.db')
+        with con:
+            cur = con.cursor()
+            self._create_schema(cur, table)
+            cur.executemany(insert_sql,
+                            ([text() if c.name in fts.cols
+                              else synthetic_value(c, i) for c in cols]
+                             for i in range(rows)))
+
+            timings = {}
+            found = {}
+            for name, query, arg in (("match", match_sql, "{}"),
+                                     ("like", like_sql, "%{}%")):
+                start = time.time()
+                found[name] = [sorted(r[0] for r in
+                                      cur.execute(query,
+                                                  (arg.format(term), -1)))
+                               for term in terms]
+                timings[name] = time.time() - start
+            assert found["match"] == found["like"], \
+                   "MATCH and LIKE found different rows"
+        con.close()
+        return timings
+
+    @clear_db
+    def test_materialized(self, view, writes=500):
+        """Make random inserts, updates and deletes in the tables of
+        a materialized view, and verify after each of them that its
+        backing table holds the same rows as the select of the view.
+        The tables must have been added, the view is added if it was
+        not. Values are drawn from a few choices so that rows join.
+
+        >>> from db_table import Table, Column, View, Join
+        >>> artist = Table('Artist').add_cols(Column('name').text)
+        >>> album = Table('Album').add_cols(Column('artist').text,\
+Column('year').integer)
+        >>> v = View('albums').as_sql(Join(artist, ['name']).left_join(\
+album, ['year'], (('Artist', 'name'), ('Album', 'artist'))).select)
+        >>> s = SQLTester()
+        >>> s.add_tables(artist, album)
+        >>> s.test_materialized(v.materialized, writes=100)
+        100
+        """
+        if not view.is_materialized:
+            raise ValueError("View {} is not materialized".format(view.name))
+        if view not in self.views:
+            self.views.append(view)
+        tables = dict((t.name, t) for t in self.tables)
+        rand = random.Random(writes)
+
+        def value(column):
+            return synthetic_value(column, rand.randrange(5))
+
+        names = ", ".join(col.name for col in view._columns)
+        expected_sql = "SELECT {} FROM ({})".format(names, view._stmt[:-1])
+        actual_sql = "SELECT {} FROM {}".format(names, view.name)
+
+        con = sql.connect('test.db')
+        with con:
+            cur = con.cursor()
+            self._create_schema(cur)
+            for _ in range(writes):
+                table = tables[rand.choice(view._join.tables)]
+                cols = table._columns[1:]
+                cur.execute("SELECT _id FROM {}".format(table.name))
+                ids = [r[0] for r in cur.fetchall()]
+                action = rand.choice(("insert", "insert", "update", "delete"))
+                if action == "insert" or not ids:
+                    cur.execute("INSERT INTO {} ({}) VALUES ({})"\
+                                .format(table.name,
+                                        ", ".join(c.name for c in cols),
+                                        ", ".join("?" * len(cols))),
+                                [value(c) for c in cols])
+                elif action == "update":
+                    col = rand.choice(cols)
+                    cur.execute("UPDATE {} SET {} = ? WHERE _id = ?"\
+                                .format(table.name, col.name),
+                                (value(col), rand.choice(ids)))
+                else:
+                    cur.execute("DELETE FROM {} WHERE _id = ?"\
+                                .format(table.name), (rand.choice(ids),))
+
+                expected = sorted(cur.execute(expected_sql).fetchall(),
+                                  key=repr)
+                actual = sorted(cur.execute(actual_sql).fetchall(), key=repr)
+                assert actual == expected, \
+                       "{} differs from its select after {} on {}"\
+                       .format(view.name, action, table.name)
+        con.close()
+        return writes
+
+    @clear_db
+    def test_cached_aggregates(self, table, writes=500):
+        """Make random inserts, updates and deletes in the parent table
+        and the children of the count_of and sum_of columns of table,
+        and verify after each that the cached values match a COUNT(*)
+        or SUM over the children. The tables must have been added.
+        Foreign keys are enforced, so children only reference existing
+        parents.
+
+        >>> from db_table import Table, Column, ForeignKey
+        >>> song = Table('Song').add_cols(Column('album').integer,\
+Column('length').integer).add_constraints(ForeignKey('album')\
+.references('Album').on_delete_cascade)
+        >>> album = Table('Album').count_of('songs', song, 'album')\
+.sum_of('length', song, 'album', 'length')
+        >>> s = SQLTester()
+        >>> s.add_tables(album, song)
+        >>> s.test_cached_aggregates(album, writes=100)
+        100
+
+        Foreign keys may reference another column than _id:
+
+        >>> from db_table import Unique
+        >>> song = Table('Song').add_cols(Column('album').text)\
+.add_constraints(ForeignKey('album').references('Album', 'title'))
+        >>> album = Table('Album').add_cols(Column('title').text)\
+.add_constraints(Unique('title').on_conflict_ignore)\
+.count_of('songs', song, 'album')
+        >>> s = SQLTester()
+        >>> s.add_tables(album, song)
+        >>> s.test_cached_aggregates(album, writes=100)
+        100
+        """
+        tables = dict((t.name, t) for t in self.tables)
+        rand = random.Random(writes)
+        checks = []
+        refs = {}
+        for name, child, fk_column, column in table._caches:
+            child = tables[getattr(child, "name", child)]
+            live = "COUNT(*)" if column is None else \
+                   "IFNULL(SUM({}), 0)".format(column)
+            checks.append((name, child, fk_column, live))
+            # The triggers follow the column the foreign key references
+            refs[child.name, fk_column] = table.cache_reference(child,
+                                                                fk_column)
+
+        def ids(cur, name, column="_id"):
+            cur.execute("SELECT {} FROM {}".format(column, name))
+            return [r[0] for r in cur.fetchall()]
+
+        def value(cur, child, fk_column, col):
+            if col.name == fk_column:
+                parents = ids(cur, table.name, refs[child.name, fk_column])
+                return rand.choice(parents) if parents else None
+            return synthetic_value(col, rand.randrange(5))
+
+        con = sql.connect('test.db')
+        with con:
+            cur = con.cursor()
+            set_pragmas(cur)
+            self._create_schema(cur)
+            for _ in range(writes):
+                target = rand.choice([table] + [c[1] for c in checks])
+                fk_column = None
+                for name, child, fk, live in checks:
+                    if child is target:
+                        fk_column = fk
+                cols = [c for c in target._columns[1:] if not c.is_derived]
+                if target is table:
+                    # Children reference these, like they do the _id
+                    cols = [c for c in cols if c.name not in refs.values()]
+                existing = ids(cur, target.name)
+                action = rand.choice(("insert", "insert", "update", "delete"))
+                if action == "insert" or not existing:
+                    if cols:
+                        cur.execute("INSERT INTO {} ({}) VALUES ({})"\
+                                    .format(target.name,
+                                            ", ".join(c.name for c in cols),
+                                            ", ".join("?" * len(cols))),
+                                    [value(cur, target, fk_column, c)
+                                     for c in cols])
+                    else:
+                        cur.execute("INSERT INTO {} DEFAULT VALUES"\
+                                    .format(target.name))
+                elif action == "update" and cols:
+                    col = rand.choice(cols)
+                    cur.execute("UPDATE {} SET {} = ? WHERE _id = ?"\
+                                .format(target.name, col.name),
+                                (value(cur, target, fk_column, col),
+                                 rand.choice(existing)))
+                else:
+                    cur.execute("DELETE FROM {} WHERE _id = ?"\
+                                .format(target.name),
+                                (rand.choice(existing),))
+
+                for name, child, fk_column, live in checks:
+                    cur.execute("SELECT COUNT(*) FROM {0} WHERE {1} IS NOT\
+ (SELECT {2} FROM {3} WHERE {3}.{4} = {0}.{5})"\
+                                .format(table.name, name, live, child.name,
+                                        fk_column, refs[child.name, fk_column]))
+                    wrong = cur.fetchone()[0]
+                    assert wrong == 0, "{}.{} is wrong in {} rows after {}\
+ on {}".format(table.name, name, wrong, action, target.name)
+        con.close()
+        return writes
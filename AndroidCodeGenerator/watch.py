@@ -0,0 +1,83 @@
+"""Watch mode, which generates again whenever the schema script changes
+
+    python -m AndroidCodeGenerator.watch sample.py     # python 2
+    python AndroidCodeGenerator/watch.py sample.py     # python 3
+
+The modules of the package import each other by their plain names,
+which python 3 only finds when the package directory is on sys.path.
+Running watch.py as a script puts it there. The schema script must
+then import the same modules, as from generator import Generator,
+or its generators would not share the cache.
+
+The script is run again in this process after every change, the way
+python runs it, so it needs no changes. Its generators share one
+RenderCache: only the tables whose definitions changed are rendered
+again, and only the files which changed are written. Imports stay
+loaded between runs.
+
+>>> watcher = Watcher("no_such_schema.py")
+>>> watcher.changed()
+False
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import traceback
+from generator import Generator, RenderCache
+
+class Watcher(object):
+    """Polls the schema script every interval seconds"""
+
+    def __init__(self, path, interval=0.2):
+        self.path = path
+        self.interval = interval
+        self.cache = RenderCache()
+        self._stamp = None
+
+    def changed(self):
+        """True if the script was changed since the last call"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        stamp = (st.st_mtime, st.st_size)
+        if stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        return True
+
+    def run(self):
+        """Run the script once with the shared cache, and return the
+        seconds it took"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if directory not in sys.path:
+            sys.path.insert(0, directory)
+        previous = Generator.render_cache
+        Generator.render_cache = self.cache
+        start = time.time()
+        try:
+            with open(self.path) as f:
+                code = compile(f.read(), self.path, "exec")
+            exec(code, {"__name__": "__main__", "__file__": self.path})
+        finally:
+            Generator.render_cache = previous
+        return time.time() - start
+
+    def watch(self):
+        while True:
+            if self.changed():
+                try:
+                    elapsed = self.run()
+                except Exception:
+                    # Keep watching, the next edit might fix it
+                    traceback.print_exc()
+                else:
+                    print("Generated in {:.0f} ms".format(elapsed * 1000))
+            time.sleep(self.interval)
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python AndroidCodeGenerator/watch.py schema.py")
+        sys.exit(1)
+    Watcher(sys.argv[1]).watch()
@@ -38,3 +38,6 @@ st.add_tables(persons, log)
 st.add_triggers(trigger)
 
 st.test_create()
+
+# And again on the same database, like an upgrade does
+st.test_recreate()